@@ -0,0 +1,22 @@
+"""
+Retención y compactación de los buckets diarios de influencia.
+
+    python -m app.compact_buckets
+
+Pensado para lanzarse una vez al día (cron).
+"""
+from app.database import SessionLocal
+from app.utils.influence_buckets import compact_buckets
+
+
+def main():
+    db = SessionLocal()
+    try:
+        deleted, merged = compact_buckets(db)
+        print(f"buckets borrados por retención: {deleted}, fundidos en semanales: {merged}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
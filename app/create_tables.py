@@ -1,5 +1,44 @@
-from app.database import engine, Base
+from sqlalchemy import inspect, text
+
+from app.database import IS_POSTGRES, engine, Base
 from app import models
 
+# índices que ya nada lee: solo encarecían cada escritura
+OBSOLETE_INDEXES = (
+    "ix_territory_owner_updated_at",
+    "ix_territory_owner_rollup_updated",
+)
+
 Base.metadata.create_all(bind=engine)
+
+# create_all no toca tablas existentes: añadir columnas nullable o con
+# valor por defecto en el servidor, índices nuevos y quitar NOT NULL
+# (cambios aditivos; los demás llevan su propia migración). SQLite no
+# puede quitar NOT NULL: recrear la base.
+inspector = inspect(engine)
+with engine.begin() as conn:
+    for table in Base.metadata.sorted_tables:
+        existing_nullable = {c["name"]: c["nullable"] for c in inspector.get_columns(table.name)}
+        existing = set(existing_nullable)
+        for column in table.columns:
+            if column.name not in existing and (column.nullable or column.server_default is not None):
+                column_type = column.type.compile(dialect=engine.dialect)
+                if not column.nullable:
+                    column_type += f" NOT NULL DEFAULT {column.server_default.arg}"
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                print(f"➕ {table.name}.{column.name}")
+                existing.add(column.name)
+            elif IS_POSTGRES and column.nullable and not column.primary_key and not existing_nullable.get(column.name, True):
+                # columnas que pasan a admitir NULL (p. ej. activities.strava_activity_id)
+                conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {column.name} DROP NOT NULL"))
+                print(f"🔓 {table.name}.{column.name} admite NULL")
+
+        # índices sobre columnas que aún no existen: pendientes de su migración
+        for index in table.indexes:
+            if {c.name for c in index.columns} <= existing:
+                index.create(bind=conn, checkfirst=True)
+
+    for name in OBSOLETE_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
 print("Tables created successfully!")
@@ -1,5 +1,7 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -7,10 +9,65 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL no está definida")
 
+IS_POSTGRES = make_url(DATABASE_URL).get_backend_name() == "postgresql"
+
+# la concurrencia de las peticiones la limita el pool, no los hilos
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# sslmode solo aplica a Postgres (SQLite se usa en tests / benchmarks)
+connect_args = {"sslmode": "require"} if IS_POSTGRES else {}
+
+# 🧵 Engine síncrono: workers en segundo plano y scripts (create_tables, rebuilds)
 engine = create_engine(
     DATABASE_URL,
     pool_pre_ping=True,
-    connect_args={"sslmode": "require"},
+    connect_args=connect_args,
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+
+def _async_url(url):
+    url = make_url(url)
+    if url.get_backend_name() == "postgresql":
+        # asyncpg no entiende sslmode: se pasa como ssl= en connect_args
+        return url.set(drivername="postgresql+asyncpg").difference_update_query(["sslmode"])
+    if url.get_backend_name() == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    return url
+
+
+# ⚡ Engine asíncrono: endpoints de la API
+async_engine = create_async_engine(
+    _async_url(DATABASE_URL),
+    pool_pre_ping=True,
+    **(
+        {
+            "connect_args": {"ssl": "require"},
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+        }
+        if IS_POSTGRES else {}
+    ),
+)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+
+def insert_for(db):
+    """`insert()` del dialecto activo, para poder usar ON CONFLICT."""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+# --- DB dependency (compartida por todos los routers) ---
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,14 +1,17 @@
 from fastapi import Depends, HTTPException, Request
 from jose import jwt, JWTError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import SECRET_KEY, ALGORITHM
+from app.database import get_db
 from app.models import User
-from app.database import SessionLocal
-import os
+from app.utils import user_cache
 
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = "HS256"
 
-
-def get_current_user(request: Request):
+def get_current_user_id(request: Request) -> str:
+    """
+    Solo verifica el JWT: para endpoints que únicamente necesitan el id,
+    sin tocar la base de datos.
+    """
     auth = request.headers.get("Authorization")
 
     if not auth or not auth.startswith("Bearer "):
@@ -22,11 +25,30 @@ def get_current_user(request: Request):
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    db = SessionLocal()
-    user = db.query(User).filter(User.id == user_id).first()
-    db.close()
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    return user_id
+
+
+async def get_current_user(
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Usuario autenticado (desligado de la sesión). Sale de la caché si está;
+    si no, se carga con la sesión de la propia petición.
+    """
+    user = user_cache.get_user(user_id)
+    if user:
+        return user
+
+    user = await db.get(User, user_id)
 
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
 
+    db.expunge(user)
+    user_cache.put_user(user)
+
     return user
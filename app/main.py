@@ -1,9 +1,14 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
-from app.database import engine
+from app.database import async_engine, engine
 from app.models import Base
-from app.routes import activities, users, territories, auth, strava, strava_webhook
+from app.routes import activities, users, territories, auth, strava, strava_webhook, leaderboard
+from app.utils.strava_backfill import resume_backfills
+from app.utils.strava_events import start_event_workers, stop_event_workers
+from app.utils.strava_client import start_token_refresher, stop_token_refresher
+from app.utils.metrics import instrument_engine, metrics_middleware, render_metrics
 
 app = FastAPI()
 
@@ -17,8 +22,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# 🗜️ gzip para respuestas grandes (mapa de territorios, listados)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# 📈 Métricas: latencia por ruta, consultas por petición, pool y Strava
+app.middleware("http")(metrics_middleware)
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+
 # 🧱 Create tables (DEV ONLY)
 Base.metadata.create_all(bind=engine)
 
@@ -27,10 +41,32 @@ app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(activities.router)
 app.include_router(territories.router)
+app.include_router(leaderboard.router)
 app.include_router(strava.router)
 app.include_router(strava_webhook.router)
 
 
+# 🔁 Relanzar imports de Strava interrumpidos, arrancar workers del webhook
+# y el refresco de tokens en segundo plano
+@app.on_event("startup")
+def start_strava_workers():
+    resume_backfills()
+    start_event_workers()
+    start_token_refresher()
+
+
+@app.on_event("shutdown")
+def stop_strava_workers():
+    stop_event_workers()
+    stop_token_refresher()
+
+
 @app.get("/")
 def root():
     return {"status": "Dominion backend is running"}
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
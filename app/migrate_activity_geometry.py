@@ -0,0 +1,84 @@
+"""
+Mueve activities.polyline a activity_geometry (comprimida, ver
+app/utils/geometry.py).
+
+    python -m app.migrate_activity_geometry [--batch 5000] [--drop]
+
+Por lotes de la clave primaria, con un commit por lote: se puede lanzar
+con la app funcionando y relanzar (las actividades ya copiadas se saltan).
+Tras desplegar el código nuevo (que ya no escribe activities.polyline),
+una última pasada con --drop copia lo que falte y borra la columna.
+
+En Postgres el espacio de la columna no se recupera hasta reescribir la
+tabla (VACUUM FULL activities o pg_repack).
+"""
+import sys
+import time
+
+from sqlalchemy import inspect, text
+
+from app.database import Base, SessionLocal, engine
+from app.utils.geometry import geometry_row, record_geometries
+
+DEFAULT_BATCH = 5000
+
+
+def _has_polyline_column():
+    return "polyline" in {c["name"] for c in inspect(engine).get_columns("activities")}
+
+
+def _copy(batch):
+    db = SessionLocal()
+    last = ""
+    total = 0
+    start = time.perf_counter()
+    try:
+        while True:
+            rows = db.execute(
+                text("""
+                    SELECT a.id, a.polyline
+                    FROM activities AS a
+                    LEFT JOIN activity_geometry AS g ON g.activity_id = a.id
+                    WHERE a.id > :last AND a.polyline IS NOT NULL AND g.activity_id IS NULL
+                    ORDER BY a.id
+                    LIMIT :n
+                """),
+                {"last": last, "n": batch},
+            ).all()
+            if not rows:
+                return total
+
+            record_geometries(db, [geometry_row(activity_id, polyline) for activity_id, polyline in rows])
+            db.commit()
+
+            total += len(rows)
+            last = rows[-1][0]
+            rate = total / max(time.perf_counter() - start, 1e-9)
+            print(f"  activity_geometry: {total} filas ({rate:.0f} filas/s)")
+    finally:
+        db.close()
+
+
+def main():
+    batch = DEFAULT_BATCH
+    if "--batch" in sys.argv:
+        batch = int(sys.argv[sys.argv.index("--batch") + 1])
+
+    # activity_geometry (create_all no toca las tablas existentes)
+    Base.metadata.create_all(bind=engine)
+
+    if not _has_polyline_column():
+        print("✅ activities.polyline ya no existe: nada que migrar")
+        return
+
+    print("🔁 Copiando polylines a activity_geometry")
+    _copy(batch)
+
+    if "--drop" in sys.argv:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE activities DROP COLUMN polyline"))
+        print("🗑️ activities.polyline borrada")
+
+
+if __name__ == "__main__":
+    main()
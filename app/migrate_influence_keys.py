@@ -0,0 +1,160 @@
+"""
+Migra territory_influence y territory_influence_rollup a claves enteras:
+hexágono como BIGINT (h3.str_to_int) y usuario como user_keys.id.
+
+    python -m app.migrate_influence_keys [--batch 50000]
+
+Se hace en el sitio y por lotes (solo Postgres):
+
+1. crea user_keys y le da una clave a cada usuario;
+2. añade las columnas territory_key / user_key y las rellena por rangos
+   de la clave primaria antigua, con un commit por lote (la app puede
+   seguir escribiendo mientras tanto);
+3. en una última transacción corta (con la tabla bloqueada) rellena las
+   filas que hayan entrado durante la migración, cambia la clave
+   primaria, borra las columnas antiguas y crea los índices nuevos.
+
+Tras el paso 3 hay que desplegar el código que usa el esquema nuevo.
+Se puede relanzar: las tablas ya migradas se saltan.
+"""
+import sys
+import time
+
+from sqlalchemy import inspect, text
+
+from app.database import IS_POSTGRES, Base, engine
+from app.models import TerritoryInfluence, TerritoryInfluenceRollup
+
+DEFAULT_BATCH = 50_000
+
+# tabla -> columnas de la clave primaria antigua
+TABLES = {
+    TerritoryInfluence.__table__: ["territory_id", "user_id"],
+    TerritoryInfluenceRollup.__table__: ["resolution", "territory_id", "user_id"],
+}
+
+# hexágono H3 en hex (15 caracteres) -> BIGINT
+_H3_TO_BIGINT = "('x' || lpad(t.territory_id, 16, '0'))::bit(64)::bigint"
+
+
+def _assign_user_keys(conn):
+    conn.execute(text("""
+        INSERT INTO user_keys (user_id)
+        SELECT id FROM users
+        ON CONFLICT (user_id) DO NOTHING
+    """))
+
+
+def _migrated(table):
+    columns = {c["name"] for c in inspect(engine).get_columns(table.name)}
+    return "user_id" not in columns
+
+
+def _fill(conn, table, where, params):
+    return conn.execute(
+        text(f"""
+            UPDATE {table.name} AS t
+            SET territory_key = {_H3_TO_BIGINT}, user_key = k.id
+            FROM user_keys AS k
+            WHERE k.user_id = t.user_id AND t.territory_key IS NULL AND {where}
+        """),
+        params,
+    ).rowcount
+
+
+def _backfill(table, pk, batch):
+    cols = ", ".join(pk)
+    last = None
+    total = 0
+    start = time.perf_counter()
+
+    while True:
+        after = f"({cols}) > ({', '.join(':l' + str(i) for i in range(len(pk)))})" if last else "TRUE"
+        params = {f"l{i}": v for i, v in enumerate(last or ())}
+
+        with engine.begin() as conn:
+            # último PK del lote (por el índice de la clave primaria)
+            upper = conn.execute(
+                text(f"SELECT {cols} FROM {table.name} WHERE {after} ORDER BY {cols} LIMIT 1 OFFSET :n"),
+                {**params, "n": batch - 1},
+            ).first()
+
+            where = after
+            if upper is not None:
+                where += f" AND ({cols}) <= ({', '.join(':u' + str(i) for i in range(len(pk)))})"
+                params.update({f"u{i}": v for i, v in enumerate(upper)})
+
+            total += _fill(conn, table, where, params)
+
+        rate = total / max(time.perf_counter() - start, 1e-9)
+        print(f"  {table.name}: {total} filas ({rate:.0f} filas/s)")
+
+        if upper is None:
+            return total
+        last = tuple(upper)
+
+
+def _swap(table, pk):
+    new_pk = ", ".join("user_key" if c == "user_id" else c for c in pk)
+    name = table.name
+
+    with engine.begin() as conn:
+        conn.execute(text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+        # usuarios y filas que la app ha creado durante el backfill
+        _assign_user_keys(conn)
+        _fill(conn, table, "TRUE", {})
+
+        conn.execute(text(f"""
+            ALTER TABLE {name}
+                ALTER COLUMN territory_key SET NOT NULL,
+                ALTER COLUMN user_key SET NOT NULL,
+                DROP CONSTRAINT {name}_pkey,
+                DROP COLUMN territory_id,
+                DROP COLUMN user_id
+        """))
+        conn.execute(text(f"ALTER TABLE {name} RENAME COLUMN territory_key TO territory_id"))
+        conn.execute(text(f"""
+            ALTER TABLE {name}
+                ADD PRIMARY KEY ({new_pk}),
+                ADD FOREIGN KEY (user_key) REFERENCES user_keys (id)
+        """))
+
+        # los índices que colgaban de user_id se han ido con la columna
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+
+def main():
+    if not IS_POSTGRES:
+        print("❌ La migración solo está soportada en Postgres (en SQLite, recrear la base)")
+        sys.exit(1)
+
+    batch = DEFAULT_BATCH
+    if "--batch" in sys.argv:
+        batch = int(sys.argv[sys.argv.index("--batch") + 1])
+
+    # user_keys (y cualquier tabla nueva); create_all no toca las existentes
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        _assign_user_keys(conn)
+
+    for table, pk in TABLES.items():
+        if _migrated(table):
+            print(f"✅ {table.name}: ya migrada")
+            continue
+
+        with engine.begin() as conn:
+            conn.execute(text(f"""
+                ALTER TABLE {table.name}
+                    ADD COLUMN IF NOT EXISTS territory_key BIGINT,
+                    ADD COLUMN IF NOT EXISTS user_key INTEGER
+            """))
+
+        print(f"🔁 {table.name}: rellenando claves enteras")
+        _backfill(table, pk, batch)
+        _swap(table, pk)
+        print(f"✅ {table.name}: migrada")
+
+
+if __name__ == "__main__":
+    main()
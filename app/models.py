@@ -1,8 +1,10 @@
-from sqlalchemy import Column, String, Integer, Float, DateTime, BigInteger, Text
+from sqlalchemy import Column, String, Integer, Float, DateTime, BigInteger, Text, LargeBinary, Boolean
 from sqlalchemy.sql import func
 from app.database import Base
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, UniqueConstraint, false, text
+from sqlalchemy.orm import deferred, relationship
 import uuid
+from datetime import datetime, timezone
 
 class User(Base):
     __tablename__ = "users"
@@ -29,15 +31,264 @@ class Activity(Base):
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = Column(String, ForeignKey("users.id"), nullable=False)
 
-    # 🔴 STRAVA
-    strava_activity_id = Column(BigInteger, unique=True, index=True, nullable=False)
+    # 🔴 STRAVA (NULL en las subidas manuales / masivas)
+    strava_activity_id = Column(BigInteger, unique=True, index=True, nullable=True)
+
+    # el recorrido va aparte (ActivityGeometry): los listados y consultas
+    # sobre actividades no lo arrastran; se carga solo al acceder
+    geometry = relationship(
+        "ActivityGeometry",
+        uselist=False,
+        lazy="select",
+        cascade="all, delete-orphan",
+    )
+    # fecha de la actividad (start_date de Strava); decide el bucket diario
+    start_date = Column(DateTime(timezone=True), nullable=True)
+    # también con valor por defecto en Python: el cursor de paginación compara
+    # created_at exacto y en SQLite CURRENT_TIMESTAMP no guarda microsegundos
+    created_at = Column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        server_default=func.now(),
+    )
+
+    # listado paginado por (created_at, id) de cada usuario
+    __table_args__ = (
+        Index("ix_activities_user_created", user_id, created_at, id),
+    )
+
+class ActivityGeometry(Base):
+    """
+    Recorrido de cada actividad, comprimido (ver app/utils/geometry.py).
+    `summary` es la polyline resumen de Strava, la que cuenta para la
+    influencia; `detail`, el track completo si lo tenemos (diferido: solo
+    se lee si se pide).
+    """
+    __tablename__ = "activity_geometry"
+    activity_id = Column(String, ForeignKey("activities.id", ondelete="CASCADE"), primary_key=True)
+    summary = Column(LargeBinary, nullable=False)
+    detail = deferred(Column(LargeBinary, nullable=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class UserKey(Base):
+    """
+    Clave entera de cada usuario para las tablas de influencia (mucho más
+    pequeña que el UUID en índices y claves compuestas).
+    """
+    __tablename__ = "user_keys"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String, ForeignKey("users.id"), unique=True, nullable=False)
 
-    polyline = Column(Text)
+class ActivityFootprint(Base):
+    """
+    Hexágonos exactos que sumó cada actividad (ver app/utils/footprints.py),
+    para poder restarlos al borrarla o editarla.
+    """
+    __tablename__ = "activity_footprints"
+    activity_id = Column(String, ForeignKey("activities.id", ondelete="CASCADE"), primary_key=True)
+    # bucket diario en el que se sumó (días desde 1970-01-01)
+    day = Column(Integer, nullable=False)
+    cells = Column(LargeBinary, nullable=False)   # uint64 little-endian, resolución H3_RESOLUTION
+    counts = Column(LargeBinary, nullable=True)   # uint32 little-endian; NULL = 1 por hexágono
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class TerritoryInfluence(Base):
+    """
+    Hexágono H3 como BIGINT (h3.str_to_int) y usuario como UserKey.id.
+    Hacia fuera (API, territory_owner) se sigue usando el formato string.
+    """
     __tablename__ = "territory_influence"
+    # la PK (territory_id, user_key) sirve las lecturas por hexágono
+    territory_id = Column(BigInteger, primary_key=True)
+    user_key = Column(Integer, ForeignKey("user_keys.id"), primary_key=True)
+    influence = Column(Float)
+
+    # lecturas por usuario (estadísticas, rebuild de rollups)
+    __table_args__ = (
+        Index("ix_territory_influence_user", user_key, territory_id),
+    )
+
+class TerritoryOwner(Base):
+    """
+    Dueño actual de cada hexágono, mantenido en cada ingest
+    (ver app/utils/territory_owner.py).
+    """
+    __tablename__ = "territory_owner"
     territory_id = Column(String, primary_key=True)
-    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    user_id = Column(String, ForeignKey("users.id"), nullable=True)
+    influence = Column(Float, nullable=False, default=0)
+    # ventaja sobre el segundo (= influence si no hay rival)
+    margin = Column(Float, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class MapVersion(Base):
+    """
+    Versión del mapa por resolución (ETag de GET /territories). Se
+    incrementa en una transacción corta justo después del commit de cada
+    ingest (ver territory_owner.mark_map_changed): a diferencia de
+    max(updated_at) (now() es el inicio de la transacción), cambia siempre
+    después de que los datos nuevos sean visibles.
+    """
+    __tablename__ = "map_version"
+    resolution = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+class TerritoryInfluenceRollup(Base):
+    """
+    Influencia agregada a resoluciones H3 más gruesas (cell_to_parent),
+    para el mapa con poco zoom.
+    """
+    __tablename__ = "territory_influence_rollup"
+    resolution = Column(Integer, primary_key=True)
+    territory_id = Column(BigInteger, primary_key=True)
+    user_key = Column(Integer, ForeignKey("user_keys.id"), primary_key=True)
     influence = Column(Float)
 
+    # 🏆 leaderboard regional por influencia
+    __table_args__ = (
+        Index("ix_influence_rollup_rank", resolution, territory_id, influence.desc(), user_key),
+    )
+
+class TerritoryInfluenceBucket(Base):
+    """
+    Influencia por día de actividad (ver app/utils/influence_buckets.py).
+    `day` = días desde 1970-01-01; tras la compactación, los buckets
+    antiguos son semanales (day = lunes de la semana).
+    """
+    __tablename__ = "territory_influence_bucket"
+    # la PK sirve "hexágonos del área con day >= since"
+    resolution = Column(Integer, primary_key=True)
+    territory_id = Column(BigInteger, primary_key=True)
+    day = Column(Integer, primary_key=True)
+    user_key = Column(Integer, ForeignKey("user_keys.id"), primary_key=True)
+    influence = Column(Float, nullable=False, default=0)
+
+    # retención / compactación por día
+    __table_args__ = (
+        Index("ix_territory_influence_bucket_day", day),
+    )
+
+class TerritoryOwnerRollup(Base):
+    __tablename__ = "territory_owner_rollup"
+    resolution = Column(Integer, primary_key=True)
+    territory_id = Column(String, primary_key=True)
+    user_id = Column(String, ForeignKey("users.id"), nullable=True)
+    influence = Column(Float, nullable=False, default=0)
+    margin = Column(Float, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class StravaImportJob(Base):
+    __tablename__ = "strava_import_jobs"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, ForeignKey("users.id"), index=True, nullable=False)
+
+    # pending | running | done | failed
+    status = Column(String, nullable=False, default="pending")
+
+    # checkpoint: epoch del start_date más reciente ya importado
+    after_cursor = Column(BigInteger, nullable=False, default=0)
+
+    pages = Column(Integer, nullable=False, default=0)
+    imported = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+
+    # lo renueva el proceso que ejecuta el job; si se queda viejo, el
+    # job es de un runner que murió y otro lo puede reclamar
+    locked_at = Column(DateTime(timezone=True), nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        # un solo job activo por usuario (create_or_get_job)
+        Index(
+            "uq_strava_import_jobs_active_user",
+            user_id,
+            unique=True,
+            postgresql_where=text("status IN ('pending', 'running')"),
+            sqlite_where=text("status IN ('pending', 'running')"),
+        ),
+    )
+
+class StravaEvent(Base):
+    __tablename__ = "strava_events"
+    # un mismo objeto solo se encola una vez por tipo de evento
+    __table_args__ = (UniqueConstraint("object_id", "aspect_type"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    object_id = Column(BigInteger, nullable=False)
+    owner_id = Column(BigInteger, nullable=False)
+    aspect_type = Column(String, nullable=False)
+    event_time = Column(BigInteger, nullable=True)
+    updates = Column(Text, nullable=True)  # JSON tal cual lo manda Strava
+
+    # pending | processing | done | failed
+    status = Column(String, nullable=False, default="pending", index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    locked_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+    # llegó otro "update" mientras un worker lo procesaba: al terminar ese
+    # worker se vuelve a procesar (ver enqueue_event / claim_events)
+    rerun = Column(Boolean, nullable=False, default=False, server_default=false())
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class PolylineCells(Base):
+    """
+    Caché persistente polyline -> hexágonos (ver app/utils/cell_cache.py).
+    """
+    __tablename__ = "polyline_cells"
+
+    # blake2b(resolución + polyline)
+    key = Column(String, primary_key=True)
+    resolution = Column(Integer, nullable=False)
+    cells = Column(LargeBinary, nullable=False)   # uint64 little-endian
+    counts = Column(LargeBinary, nullable=False)  # uint32 little-endian
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class UserStats(Base):
+    """
+    Contadores por usuario que el ingest mantiene en su misma transacción
+    (ver app/utils/user_stats.py). /users/me/stats es una lectura por PK.
+    """
+    __tablename__ = "user_stats"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    activities = Column(Integer, nullable=False, default=0)
+    # hexágonos con influencia del usuario / de los que es dueño
+    hexes = Column(Integer, nullable=False, default=0)
+    hexes_owned = Column(Integer, nullable=False, default=0)
+    influence = Column(Float, nullable=False, default=0)
+    last_activity_at = Column(DateTime(timezone=True), nullable=True)
+    # versión del listado de actividades (ETag): +1 en cada alta, baja o
+    # cambio de recorrido
+    activities_version = Column(BigInteger, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    # 🏆 leaderboard global: ORDER BY ... LIMIT n recorre solo n entradas
+    __table_args__ = (
+        Index("ix_user_stats_owned_rank", hexes_owned.desc(), user_id),
+        Index("ix_user_stats_influence_rank", influence.desc(), user_id),
+    )
+
+class RegionStats(Base):
+    """
+    Hexágonos en propiedad por usuario dentro de cada región (padre H3 en
+    una de ROLLUP_RESOLUTIONS). Para el ranking regional por influencia se
+    usa territory_influence_rollup.
+    """
+    __tablename__ = "region_stats"
+    resolution = Column(Integer, primary_key=True)
+    region_id = Column(String, primary_key=True)
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    hexes_owned = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_region_stats_owned_rank", resolution, region_id, hexes_owned.desc(), user_id),
+    )
@@ -0,0 +1,480 @@
+"""
+Reconstruye la influencia desde las actividades guardadas (por ejemplo
+tras cambiar H3_RESOLUTION o corregir polyline_to_h3):
+territory_influence, territory_influence_bucket y activity_footprints,
+y después los rollups, los dueños y las estadísticas.
+
+    python -m app.rebuild_influence [--workers N] [--batch 2000]
+
+Pensado para lanzarse con la app parada (sin ingest ni workers):
+
+1. lee las actividades con un cursor de servidor y pasa las polylines a
+   hexágonos en un pool de procesos, con una consulta a la caché
+   polyline_cells por lote (su clave lleva geo.POLYLINE_H3_VERSION: tras
+   corregir polyline_to_h3 hay que subirla y se recalcula todo);
+2. agrega en memoria, con arrays de numpy, la influencia por
+   (hexágono, usuario) y por (hexágono, día, usuario);
+3. carga cada tabla en una tabla sombra con COPY, le crea la PK, los
+   índices y las FKs de la tabla buena, y las cambia todas en una única
+   transacción corta.
+
+Si entran o se borran actividades mientras tanto, el cambio se aborta.
+En SQLite (desarrollo) no hay COPY ni cursor de servidor: la tabla sombra
+se carga con inserts y se vuelca en la buena dentro de una transacción.
+"""
+import io
+import multiprocessing
+import os
+import re
+import sys
+import time
+from collections import deque
+from itertools import repeat
+
+import h3.api.basic_int as h3_int
+import numpy as np
+from sqlalchemy import Column, MetaData, Table, func, insert, select, text
+
+from app.database import IS_POSTGRES, SessionLocal, engine
+from app.models import (
+    Activity,
+    ActivityFootprint,
+    ActivityGeometry,
+    TerritoryInfluence,
+    TerritoryInfluenceBucket,
+    User,
+    UserKey,
+)
+from app.utils import cell_cache, geo
+from app.utils.geometry import unpack_polyline
+from app.utils.influence_buckets import (
+    INFLUENCE_DAILY_DAYS,
+    INFLUENCE_RETENTION_DAYS,
+    day_number,
+    week_start,
+)
+from app.utils.territory_owner import rebuild_territory_owners
+from app.utils.user_stats import rebuild_user_stats
+
+DEFAULT_BATCH = 2000
+COPY_CHUNK_SIZE = 100_000
+# filas pendientes antes de compactar los agregados en memoria
+COMPACT_ROWS = 5_000_000
+SHADOW_SUFFIX = "_rebuild"
+
+TABLES = (TerritoryInfluence.__table__, TerritoryInfluenceBucket.__table__, ActivityFootprint.__table__)
+
+
+class _Totals:
+    """
+    Suma de valores por clave compuesta (varias columnas enteras).
+    Los lotes se acumulan tal cual y se compactan (lexsort + reduceat)
+    cuando crecen, así que la memoria depende de las claves distintas y no
+    del número de actividades.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.compacted = 0
+        self.pending = 0
+
+    def add(self, *keys, values):
+        self.parts.append((keys, values))
+        self.pending += len(values)
+        if self.pending >= max(COMPACT_ROWS, self.compacted):
+            self._compact()
+
+    def _compact(self):
+        if not self.parts:
+            return
+        width = len(self.parts[0][0])
+        keys = [np.concatenate([p[0][i] for p in self.parts]) for i in range(width)]
+        values = np.concatenate([p[1] for p in self.parts])
+
+        if len(values):
+            order = np.lexsort(keys[::-1])
+            keys = [k[order] for k in keys]
+            values = values[order]
+
+            starts = np.ones(len(values), dtype=bool)
+            starts[1:] = np.any([k[1:] != k[:-1] for k in keys], axis=0)
+            starts = np.flatnonzero(starts)
+            keys = [k[starts] for k in keys]
+            values = np.add.reduceat(values, starts)
+
+        self.parts = [(keys, values)]
+        self.compacted, self.pending = len(values), 0
+
+    def result(self):
+        """(columnas de la clave, valores), ordenado por la clave."""
+        self._compact()
+        return self.parts[0] if self.parts else None
+
+
+def _init_worker():
+    # las conexiones del pool son del proceso padre: el hijo abre las suyas
+    engine.dispose(close=False)
+
+
+def _cells(batch):
+    """
+    En el pool: (activity_id, user_key, día, polyline comprimida) -> mismo
+    orden con los hexágonos únicos (uint64 ordenados) en vez de la polyline,
+    y las (activity_id, error) de las polylines que no se han podido leer.
+    """
+    polylines = []
+    for _, _, _, summary in batch:
+        try:
+            polylines.append(unpack_polyline(summary))
+        except Exception as e:
+            polylines.append(e)
+
+    # la tabla de la caché solo en Postgres: en SQLite el padre tiene la
+    # base bloqueada con la carga de los footprints
+    db = SessionLocal() if IS_POSTGRES and cell_cache.CELL_CACHE_DB else None
+    try:
+        readable = [p for p in polylines if not isinstance(p, Exception)]
+        found = iter(cell_cache.lookup_many(readable, db))
+        if db is not None:
+            db.commit()
+    finally:
+        if db is not None:
+            db.close()
+
+    converted = []
+    failed = []
+    for (activity_id, key, day, _), polyline in zip(batch, polylines):
+        value = polyline if isinstance(polyline, Exception) else next(found)
+        if isinstance(value, Exception):
+            failed.append((activity_id, f"{type(value).__name__}: {value}"))
+            cells = np.empty(0, dtype=np.uint64)
+        else:
+            cells = value[0]
+        converted.append((activity_id, key, day, cells))
+    return converted, failed
+
+
+def _converted(batches, workers):
+    """Reparte los lotes en el pool sin tener más de 2 por proceso en vuelo."""
+    with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.apply_async(_cells, (batch,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def _activity_batches(conn, size):
+    query = (
+        select(Activity.id, UserKey.id, ActivityGeometry.summary, Activity.start_date, Activity.created_at)
+        .join(UserKey, UserKey.user_id == Activity.user_id)
+        .join(ActivityGeometry, ActivityGeometry.activity_id == Activity.id)
+    )
+    if IS_POSTGRES:
+        partitions = conn.execution_options(stream_results=True, yield_per=size).execute(query).partitions()
+    else:
+        # pysqlite no tiene cursores de servidor (y un lector abierto
+        # bloquearía las escrituras de la carga)
+        everything = conn.execute(query).all()
+        partitions = (everything[start:start + size] for start in range(0, len(everything), size))
+
+    for rows in partitions:
+        yield [
+            (activity_id, key, day_number(start_date or created_at), summary)
+            for activity_id, key, summary, start_date, created_at in rows
+        ]
+
+
+def _activities_version(conn):
+    return conn.execute(select(func.count(Activity.id), func.max(Activity.created_at))).one()
+
+
+def _shadow(table):
+    """Misma forma que `table`, sin PK, índices ni FKs (se crean tras la carga)."""
+    return Table(
+        f"{table.name}{SHADOW_SUFFIX}",
+        MetaData(),
+        *[
+            Column(
+                c.name,
+                c.type,
+                nullable=c.nullable,
+                server_default=c.server_default.arg if c.server_default is not None else None,
+            )
+            for c in table.columns
+        ],
+    )
+
+
+def _copy_value(value):
+    if value is None:
+        return r"\N"
+    if isinstance(value, bytes):
+        return r"\\x" + value.hex()
+    return str(value)
+
+
+def _load(conn, shadow, columns, rows):
+    """Carga `rows` (tuplas en el orden de `columns`). Devuelve cuántas."""
+    total = 0
+    chunk = []
+
+    def flush():
+        if IS_POSTGRES:
+            buffer = io.StringIO()
+            for row in chunk:
+                buffer.write("\t".join(map(_copy_value, row)))
+                buffer.write("\n")
+            buffer.seek(0)
+            cursor = conn.connection.cursor()
+            cursor.copy_expert(f"COPY {shadow.name} ({', '.join(columns)}) FROM STDIN", buffer)
+        else:
+            conn.execute(insert(shadow), [dict(zip(columns, row)) for row in chunk])
+
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= COPY_CHUNK_SIZE:
+            flush()
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        flush()
+        total += len(chunk)
+    return total
+
+
+def _bucket_days(days, today):
+    """
+    influence_buckets.bucket_day con arrays: día del bucket en el que
+    estaría hoy la influencia de cada actividad (-1 si pasó la retención).
+    """
+    days = np.where(days < today - INFLUENCE_DAILY_DAYS, week_start(days), days)
+    return np.where(days < today - INFLUENCE_RETENTION_DAYS, -1, days)
+
+
+def _rollup_buckets(base, res):
+    """Agrega los buckets (hexágono, día, usuario) de la resolución base a `res`."""
+    (cells, days, users), values = base
+    unique, inverse = np.unique(cells, return_inverse=True)
+    parents = np.fromiter(
+        map(h3_int.cell_to_parent, unique.tolist(), repeat(res)),
+        dtype=np.uint64,
+        count=len(unique),
+    )
+    totals = _Totals()
+    totals.add(parents[inverse], days, users, values=values)
+    return totals.result()
+
+
+def _timed(label, started, rows):
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    print(f"  {label}: {rows} filas en {elapsed:.1f}s ({rows / elapsed:.0f} filas/s)")
+
+
+def _convert(workers, batch, shadows):
+    """Fases 1 y 2: polylines -> agregados en memoria; los footprints se cargan ya."""
+    today = day_number()
+    influence, buckets = _Totals(), _Totals()
+    footprint_columns = ["activity_id", "day", "cells", "counts"]
+    activities = footprints = failures = 0
+    started = time.perf_counter()
+
+    with engine.connect() as read, engine.begin() as write:
+        for converted, failed in _converted(_activity_batches(read, batch), workers):
+            for activity_id, error in failed:
+                print(f"  ⚠️ Actividad {activity_id}: polyline inválida, sin hexágonos ({error})")
+            failures += len(failed)
+
+            converted = [item for item in converted if len(item[3])]
+            if not converted:
+                continue
+
+            lengths = [len(cells) for _, _, _, cells in converted]
+            cells = np.concatenate([cells for _, _, _, cells in converted])
+            users = np.repeat([key for _, key, _, _ in converted], lengths).astype(np.int64)
+            days = np.repeat([day for _, _, day, _ in converted], lengths).astype(np.int64)
+            ones = np.ones(len(cells), dtype=np.int64)
+
+            influence.add(cells, users, values=ones)
+            days = _bucket_days(days, today)
+            kept = days >= 0
+            buckets.add(cells[kept], days[kept], users[kept], values=ones[kept])
+
+            # +1 por hexágono: sin contadores, como en footprints.record_footprints
+            footprints += _load(write, shadows[ActivityFootprint.__tablename__], footprint_columns, (
+                (activity_id, day, cells.astype("<u8").tobytes(), None)
+                for activity_id, _, day, cells in converted
+            ))
+
+            activities += len(converted)
+            if activities // 50_000 != (activities - len(converted)) // 50_000:
+                elapsed = time.perf_counter() - started
+                print(f"  {activities} actividades ({activities / elapsed:.0f} actividades/s)")
+
+    _timed(f"{activities} actividades -> activity_footprints", started, footprints)
+    if failures:
+        print(f"⚠️ {failures} actividades con polyline inválida (sin hexágonos)")
+    return influence.result(), buckets.result()
+
+
+def _load_totals(influence, buckets, shadows):
+    """Fase 3: carga de territory_influence y territory_influence_bucket."""
+    with engine.begin() as conn:
+        started = time.perf_counter()
+        rows = 0
+        if influence is not None:
+            (cells, users), values = influence
+            rows = _load(
+                conn,
+                shadows[TerritoryInfluence.__tablename__],
+                ["territory_id", "user_key", "influence"],
+                zip(cells.astype(np.int64).tolist(), users.tolist(), values.astype(float).tolist()),
+            )
+        _timed("territory_influence", started, rows)
+
+        started = time.perf_counter()
+        rows = 0
+        if buckets is not None:
+            levels = [(geo.H3_RESOLUTION, buckets)]
+            levels += [(res, _rollup_buckets(buckets, res)) for res in geo.ROLLUP_RESOLUTIONS]
+            for res, ((cells, days, users), values) in levels:
+                rows += _load(
+                    conn,
+                    shadows[TerritoryInfluenceBucket.__tablename__],
+                    ["resolution", "territory_id", "day", "user_key", "influence"],
+                    zip(
+                        repeat(res),
+                        cells.astype(np.int64).tolist(),
+                        days.tolist(),
+                        users.tolist(),
+                        values.astype(float).tolist(),
+                    ),
+                )
+        _timed("territory_influence_bucket", started, rows)
+
+
+def _constraints(conn, table):
+    """
+    Índices y FKs de la tabla buena (Postgres), para recrearlos en la
+    sombra con el sufijo y renombrarlos tras el cambio.
+    """
+    indexes = conn.execute(text("""
+        SELECT i.relname, pg_get_indexdef(i.oid)
+        FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = CAST(:t AS regclass)
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+    """), {"t": table.name}).all()
+    foreign_keys = conn.execute(text("""
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = CAST(:t AS regclass) AND contype = 'f'
+    """), {"t": table.name}).all()
+    return indexes, foreign_keys
+
+
+def _prepare(conn, table, shadow):
+    """PK, índices y FKs en la sombra (fuera de la transacción del cambio)."""
+    pk = ", ".join(c.name for c in table.primary_key.columns)
+    conn.execute(text(
+        f"ALTER TABLE {shadow.name} ADD CONSTRAINT {table.name}_pkey{SHADOW_SUFFIX} PRIMARY KEY ({pk})"
+    ))
+
+    indexes, foreign_keys = _constraints(conn, table)
+    for name, definition in indexes:
+        definition = definition.replace(f"INDEX {name} ON", f"INDEX {name}{SHADOW_SUFFIX} ON", 1)
+        definition = re.sub(rf" ON (\S+\.)?{table.name} ", f" ON {shadow.name} ", definition, count=1)
+        conn.execute(text(definition))
+    for name, definition in foreign_keys:
+        conn.execute(text(f"ALTER TABLE {shadow.name} ADD CONSTRAINT {name}{SHADOW_SUFFIX} {definition}"))
+
+    return [name for name, _ in indexes], [name for name, _ in foreign_keys]
+
+
+def _swap(shadows, version):
+    """Cambia todas las tablas a la vez. Devuelve False si hubo actividad nueva."""
+    renames = {}
+    if IS_POSTGRES:
+        with engine.begin() as conn:
+            for table in TABLES:
+                renames[table.name] = _prepare(conn, table, shadows[table.name])
+
+    with engine.begin() as conn:
+        if IS_POSTGRES:
+            conn.execute(text(f"LOCK TABLE {Activity.__tablename__} IN SHARE MODE"))
+            for table in TABLES:
+                conn.execute(text(f"LOCK TABLE {table.name} IN ACCESS EXCLUSIVE MODE"))
+
+        if tuple(_activities_version(conn)) != tuple(version):
+            print("❌ Han cambiado las actividades durante la reconstrucción: relanzar con la app parada")
+            return False
+
+        for table in TABLES:
+            shadow = shadows[table.name]
+            if not IS_POSTGRES:
+                columns = ", ".join(c.name for c in table.columns)
+                conn.execute(table.delete())
+                conn.execute(text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {shadow.name}"))
+                shadow.drop(conn)
+                continue
+
+            indexes, foreign_keys = renames[table.name]
+            conn.execute(text(f"DROP TABLE {table.name}"))
+            conn.execute(text(f"ALTER TABLE {shadow.name} RENAME TO {table.name}"))
+            conn.execute(text(
+                f"ALTER TABLE {table.name} RENAME CONSTRAINT {table.name}_pkey{SHADOW_SUFFIX} TO {table.name}_pkey"
+            ))
+            for name in indexes:
+                conn.execute(text(f"ALTER INDEX {name}{SHADOW_SUFFIX} RENAME TO {name}"))
+            for name in foreign_keys:
+                conn.execute(text(f"ALTER TABLE {table.name} RENAME CONSTRAINT {name}{SHADOW_SUFFIX} TO {name}"))
+
+    return True
+
+
+def main():
+    workers = os.cpu_count() or 1
+    if "--workers" in sys.argv:
+        workers = int(sys.argv[sys.argv.index("--workers") + 1])
+    batch = DEFAULT_BATCH
+    if "--batch" in sys.argv:
+        batch = int(sys.argv[sys.argv.index("--batch") + 1])
+
+    started = time.perf_counter()
+    shadows = {table.name: _shadow(table) for table in TABLES}
+
+    with engine.begin() as conn:
+        # usuarios sin clave entera (no deberían quedar tras migrate_influence_keys)
+        conn.execute(insert(UserKey).from_select(
+            ["user_id"],
+            select(User.id).where(User.id.not_in(select(UserKey.user_id))),
+        ))
+        for shadow in shadows.values():
+            shadow.drop(conn, checkfirst=True)
+            shadow.create(conn)
+        version = _activities_version(conn)
+
+    print(f"🔁 Reconstruyendo influencia (H3 res {geo.H3_RESOLUTION}, {workers} procesos)")
+    influence, buckets = _convert(workers, batch, shadows)
+    _load_totals(influence, buckets, shadows)
+
+    if not _swap(shadows, version):
+        with engine.begin() as conn:
+            for shadow in shadows.values():
+                shadow.drop(conn, checkfirst=True)
+        sys.exit(1)
+    print("✅ Tablas de influencia cambiadas")
+
+    db = SessionLocal()
+    try:
+        print(f"dueños reconstruidos: {rebuild_territory_owners(db)} hexágonos (todas las resoluciones)")
+        print(f"estadísticas reconstruidas: {rebuild_user_stats(db)} usuarios")
+    finally:
+        db.close()
+
+    print(f"⏱️ Total: {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
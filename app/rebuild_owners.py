@@ -0,0 +1,37 @@
+"""
+Recalcula o verifica territory_owner y los rollups por resolución.
+Al reconstruir también recalcula user_stats (hexágonos en propiedad).
+
+    python -m app.rebuild_owners          # reconstruir
+    python -m app.rebuild_owners --check  # solo comparar
+"""
+import sys
+
+from app.database import SessionLocal
+from app.utils.geo import MAP_RESOLUTIONS
+from app.utils.territory_owner import check_territory_owners, rebuild_territory_owners
+from app.utils.user_stats import rebuild_user_stats
+
+
+def main():
+    db = SessionLocal()
+    try:
+        if "--check" in sys.argv:
+            total = 0
+            for res in MAP_RESOLUTIONS:
+                mismatches = check_territory_owners(db, res)
+                for territory_id, expected, actual in mismatches[:50]:
+                    print(f"[res {res}] {territory_id}: esperado={expected} guardado={actual}")
+                print(f"[res {res}] {len(mismatches)} diferencias")
+                total += len(mismatches)
+            sys.exit(1 if total else 0)
+
+        total = rebuild_territory_owners(db)
+        print(f"dueños reconstruidos: {total} hexágonos (todas las resoluciones)")
+        print(f"estadísticas reconstruidas: {rebuild_user_stats(db)} usuarios")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
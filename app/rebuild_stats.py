@@ -0,0 +1,30 @@
+"""
+Recalcula o verifica user_stats a partir de las tablas base.
+
+    python -m app.rebuild_stats          # reconstruir
+    python -m app.rebuild_stats --check  # solo comparar
+"""
+import sys
+
+from app.database import SessionLocal
+from app.utils.user_stats import check_user_stats, rebuild_user_stats
+
+
+def main():
+    db = SessionLocal()
+    try:
+        if "--check" in sys.argv:
+            mismatches = check_user_stats(db)
+            for user_id, field, expected, actual in mismatches[:50]:
+                print(f"{user_id} {field}: esperado={expected} guardado={actual}")
+            print(f"{len(mismatches)} diferencias")
+            sys.exit(1 if mismatches else 0)
+
+        total = rebuild_user_stats(db)
+        print(f"estadísticas reconstruidas: {total} usuarios")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
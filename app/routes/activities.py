@@ -1,22 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+import base64
+import json
+from datetime import datetime, timezone
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import select, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 
-from app.database import SessionLocal
-from app.models import Activity, TerritoryInfluence, User
-from app.utils.geo import polyline_to_h3
-from app.dependencies.auth import get_current_user
+from app.database import SessionLocal, get_db
+from app.models import Activity, ActivityGeometry, UserStats
+from app.utils.activity_upload import (
+    BULK_CHUNK_SIZE,
+    UploadError,
+    convert_items,
+    import_polylines,
+    upload_items,
+)
+from app.utils.cell_cache import polyline_hexes
+from app.utils.footprints import delete_activity as delete_activity_influence, record_footprints
+from app.utils.geometry import pack_polyline, unpack_polyline
+from app.utils.http_cache import is_fresh, make_etag, not_modified
+from app.utils.influence_buckets import day_number
+from app.utils.territory_ingest import apply_influence
+from app.utils.user_stats import record_activities
+from app.dependencies.auth import get_current_user_id
 
 router = APIRouter(prefix="/activities", tags=["activities"])
 
-
-# --- DB dependency ---
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+ACTIVITIES_PAGE_MAX = 200
 
 
 # --- Request schema ---
@@ -24,66 +39,241 @@ class ActivityCreate(BaseModel):
     polyline: str
 
 
+def _save_activity(user_id, polyline, hexes):
+    # en el threadpool, como _import_chunk: los upserts de un track largo son CPU
+    db = SessionLocal()
+    try:
+        # 1️⃣ Create activity
+        activity = Activity(
+            user_id=user_id,
+            start_date=datetime.now(timezone.utc),
+            geometry=ActivityGeometry(summary=pack_polyline(polyline)),
+        )
+        db.add(activity)
+        db.flush()
+
+        # 2️⃣ Update territory influence (un solo upsert) + user_stats + footprint
+        apply_influence(db, user_id, hexes)
+        record_activities(db, user_id, 1)
+        record_footprints(db, [(activity.id, hexes, day_number(activity.start_date))])
+
+        # 3️⃣ Commit once
+        db.commit()
+        return activity.id
+    finally:
+        db.close()
+
+
 @router.post("/")
-def create_activity(
+async def create_activity(
     data: ActivityCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    user_id: str = Depends(get_current_user_id),
 ):
-    # 1️⃣ Create activity
-    activity = Activity(
-        user_id=current_user.id,
-        polyline=data.polyline,
-    )
-    db.add(activity)
-
-    # 2️⃣ Convert polyline → H3
+    # Convert polyline → H3, fuera del event loop
     try:
-        hexes = polyline_to_h3(data.polyline)
+        hexes = await run_in_threadpool(polyline_hexes, data.polyline)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid polyline: {e}")
 
     if not hexes:
         raise HTTPException(status_code=400, detail="No territories generated")
 
-    # 3️⃣ Update territory influence
-    for hex_id in hexes:
-        influence = (
-            db.query(TerritoryInfluence)
-            .filter_by(
-                territory_id=hex_id,
-                user_id=current_user.id,
-            )
-            .first()
-        )
+    activity_id = await run_in_threadpool(_save_activity, user_id, data.polyline, hexes)
+
+    return {
+        "activity_id": activity_id,
+        "hexes_affected": len(hexes),
+    }
 
-        if influence:
-            influence.influence += 1
-        else:
-            influence = TerritoryInfluence(
-                territory_id=hex_id,
-                user_id=current_user.id,
-                influence=1,
-            )
-            db.add(influence)
 
-    # 4️⃣ Commit once
-    db.commit()
-    db.refresh(activity)
+def _import_chunk(user_id, items):
+    # en el threadpool y con sesión síncrona: compilar los INSERT de un
+    # bloque es CPU. 1️⃣ polyline -> hexágonos (una consulta a la caché por
+    # bloque); 2️⃣ un commit por bloque
+    db = SessionLocal()
+    try:
+        items = convert_items(items, db)
+        results = import_polylines(db, user_id, items)
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        print(f"❌ Error guardando {len(items)} actividades de {user_id}: {e}")
+        results = [{"index": item["index"], "error": "Not saved: database error"} for item in items]
+    finally:
+        db.close()
+    return results
+
+
+# Subida masiva (p. ej. migrar desde otra app): NDJSON de polylines o
+# multipart con ficheros GPX, leídos en streaming. Se guarda por bloques de
+# BULK_CHUNK_SIZE actividades, un commit por bloque: si la petición se corta,
+# lo ya respondido como guardado queda guardado.
+@router.post("/bulk")
+async def bulk_upload(
+    request: Request,
+    user_id: str = Depends(get_current_user_id),
+):
+    results = []
+    chunk = []
+    try:
+        async for item in upload_items(request.stream(), request.headers.get("content-type", "")):
+            if "error" in item:
+                results.append(item)
+                continue
+            chunk.append(item)
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                results += await run_in_threadpool(_import_chunk, user_id, chunk)
+                chunk = []
+    except UploadError as e:
+        if not results and not chunk:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        # cuerpo roto a mitad: se guarda lo leído y se informa del resto
+        results.append({"index": None, "error": e.detail})
+
+    if chunk:
+        results += await run_in_threadpool(_import_chunk, user_id, chunk)
 
+    results.sort(key=lambda r: (r["index"] is None, r["index"] or 0))
+    imported = sum(1 for r in results if "activity_id" in r)
     return {
-        "activity_id": activity.id,
-        "hexes_affected": len(hexes),
+        "imported": imported,
+        "failed": len(results) - imported,
+        "items": results,
+    }
+
+
+def _encode_cursor(created_at, activity_id):
+    raw = json.dumps([created_at.isoformat(), activity_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, activity_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(activity_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _activity_dict(row, with_polyline):
+    data = {
+        "id": row.id,
+        "strava_activity_id": row.strava_activity_id,
+        "start_date": row.start_date,
+        "created_at": row.created_at,
     }
+    if with_polyline:
+        data["polyline"] = unpack_polyline(row.summary)
+    return data
 
 
+# Paginación por cursor sobre (created_at, id), de la más reciente a la
+# más antigua. La polyline solo se devuelve con fields=polyline.
 @router.get("/")
-def list_activities(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+async def list_activities(
+    request: Request,
+    cursor: str | None = Query(None),
+    limit: int = Query(50, ge=1, le=ACTIVITIES_PAGE_MAX),
+    fields: str | None = Query(None, description="polyline"),
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
 ):
-    return (
-        db.query(Activity)
-        .filter(Activity.user_id == current_user.id)
-        .all()
+    with_polyline = "polyline" in (fields or "").split(",")
+
+    # versión del listado = user_stats.activities_version (lectura por PK)
+    stats = await db.get(UserStats, user_id)
+    etag = make_etag(
+        user_id,
+        stats.activities_version if stats else 0,
+        cursor,
+        limit,
+        with_polyline,
+    )
+    if is_fresh(request, etag):
+        return not_modified(etag)
+
+    columns = [Activity.id, Activity.strava_activity_id, Activity.start_date, Activity.created_at]
+    query = select(*columns)
+    if with_polyline:
+        query = query.add_columns(ActivityGeometry.summary).outerjoin(
+            ActivityGeometry, ActivityGeometry.activity_id == Activity.id
+        )
+
+    query = (
+        query
+        .where(Activity.user_id == user_id)
+        .order_by(Activity.created_at.desc(), Activity.id.desc())
+        .limit(limit + 1)
     )
+    if cursor:
+        query = query.where(tuple_(Activity.created_at, Activity.id) < _decode_cursor(cursor))
+
+    rows = (await db.execute(query)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    return JSONResponse(
+        content=jsonable_encoder({
+            "items": [_activity_dict(r, with_polyline) for r in rows],
+            "next_cursor": next_cursor,
+        }),
+        headers={"ETag": etag},
+    )
+
+
+# El track completo (si lo tenemos) solo con fields=detail.
+@router.get("/{activity_id}")
+async def get_activity(
+    activity_id: str,
+    fields: str | None = Query(None, description="detail"),
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
+):
+    with_detail = "detail" in (fields or "").split(",")
+
+    columns = [
+        Activity.id,
+        Activity.user_id,
+        Activity.strava_activity_id,
+        Activity.start_date,
+        Activity.created_at,
+        ActivityGeometry.summary,
+    ]
+    if with_detail:
+        columns.append(ActivityGeometry.detail)
+
+    row = (await db.execute(
+        select(*columns)
+        .outerjoin(ActivityGeometry, ActivityGeometry.activity_id == Activity.id)
+        .where(Activity.id == activity_id)
+    )).first()
+
+    if not row or row.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Activity not found")
+
+    data = _activity_dict(row, with_polyline=True)
+    if with_detail:
+        data["detailed_polyline"] = unpack_polyline(row.detail)
+    return data
+
+
+@router.delete("/{activity_id}")
+async def delete_activity(
+    activity_id: str,
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
+):
+    activity = await db.get(Activity, activity_id)
+
+    if not activity or activity.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Activity not found")
+
+    # resta su footprint de la influencia, dueños y estadísticas
+    hexes = await db.run_sync(delete_activity_influence, activity)
+    await db.commit()
+
+    return {"activity_id": activity_id, "hexes_affected": hexes}
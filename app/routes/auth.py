@@ -1,48 +1,56 @@
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from app.database import SessionLocal
-from app.models import User
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db
+from app.models import User, UserKey
 from app.utils.security import (
-    hash_password,
-    verify_password,
+    PasswordHasherBusy,
+    hash_password_async,
+    verify_password_async,
     create_access_token,
 )
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 
-def get_db():
-    db = SessionLocal()
+async def _password_task(coro):
     try:
-        yield db
-    finally:
-        db.close()
+        return await coro
+    except PasswordHasherBusy:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many authentication requests, try again",
+            headers={"Retry-After": "1"},
+        )
 
 
+# bcrypt corre en su propio executor, fuera del event loop
 @router.post("/register")
-def register(
+async def register(
     email: str,
     username: str,
     password: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     # comprobar si existe
-    if db.query(User).filter(User.email == email).first():
+    if await db.scalar(select(User.id).where(User.email == email)):
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    if db.query(User).filter(User.username == username).first():
+    if await db.scalar(select(User.id).where(User.username == username)):
         raise HTTPException(status_code=400, detail="Username already taken")
 
     user = User(
         email=email,
         username=username,
-        password_hash=hash_password(password),
+        password_hash=await _password_task(hash_password_async(password)),
     )
 
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.flush()
+    # clave entera para las tablas de influencia
+    db.add(UserKey(user_id=user.id))
+    await db.commit()
 
     token = create_access_token({"sub": user.id})
 
@@ -55,15 +63,26 @@ def register(
 
 
 @router.post("/login")
-def login(
+async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    user = db.query(User).filter(User.email == form_data.username).first()
+    user = await db.scalar(select(User).where(User.email == form_data.username))
 
-    if not user or not verify_password(form_data.password, user.password_hash):
+    valid, new_hash = (False, None)
+    if user:
+        valid, new_hash = await _password_task(
+            verify_password_async(form_data.password, user.password_hash)
+        )
+
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+    # 🔁 el coste de bcrypt cambió: guardar el hash nuevo
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
+
     token = create_access_token({"sub": user.id})
 
     return {
@@ -71,4 +90,4 @@ def login(
         "token_type": "bearer",
         "user_id": user.id,
         "username": user.username,
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,119 @@
+import h3
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import get_db
+from app.models import RegionStats, TerritoryInfluenceRollup, User, UserKey, UserStats
+from app.utils.geo import ROLLUP_RESOLUTIONS
+
+router = APIRouter(prefix="/leaderboard", tags=["leaderboard"])
+
+
+def _users(table, column):
+    return (
+        select(table.user_id, User.username, column)
+        .join(User, User.id == table.user_id)
+    )
+
+
+def _user_keys(table, column):
+    # tablas de influencia: clave entera -> UUID en el borde de la API
+    return (
+        select(UserKey.user_id, User.username, column)
+        .join(UserKey, UserKey.id == table.user_key)
+        .join(User, User.id == UserKey.user_id)
+    )
+
+
+async def _ranking(db, query, column, tie_break, filters, limit):
+    """
+    Top `limit` de una tabla ya agregada. Con los índices *_rank la
+    consulta solo recorre `limit` entradas.
+    """
+    rows = await db.execute(
+        query
+        .where(*filters, column > 0)
+        .order_by(column.desc(), tie_break)
+        .limit(limit)
+    )
+    return [
+        {"rank": rank, "user_id": r[0], "username": r[1], "value": r[2]}
+        for rank, r in enumerate(rows, start=1)
+    ]
+
+
+def _region(region, lat, lng, res):
+    if region is not None:
+        if not h3.is_valid_cell(region) or h3.get_resolution(region) != res:
+            raise HTTPException(status_code=400, detail=f"region must be an H3 cell at res {res}")
+        return region
+
+    if lat is None or lng is None:
+        raise HTTPException(status_code=400, detail="region or lat and lng are required")
+    return h3.latlng_to_cell(lat, lng, res)
+
+
+# 🏆 PUBLIC: ranking por hexágonos en propiedad y por influencia total
+@router.get("")
+async def get_leaderboard(
+    scope: str = Query("global", pattern="^(global|region)$"),
+    res: int = Query(5, description="resolución H3 de las regiones"),
+    region: str | None = Query(None, description="hexágono H3 de la región (resolución res)"),
+    lat: float | None = Query(None, ge=-90, le=90),
+    lng: float | None = Query(None, ge=-180, le=180),
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+):
+    if scope == "global":
+        return {
+            "scope": scope,
+            "by_hexes": await _ranking(
+                db,
+                _users(UserStats, UserStats.hexes_owned),
+                UserStats.hexes_owned,
+                UserStats.user_id,
+                (),
+                limit,
+            ),
+            "by_influence": await _ranking(
+                db,
+                _users(UserStats, UserStats.influence),
+                UserStats.influence,
+                UserStats.user_id,
+                (),
+                limit,
+            ),
+        }
+
+    if res not in ROLLUP_RESOLUTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"res must be one of {list(ROLLUP_RESOLUTIONS)}",
+        )
+    region = _region(region, lat, lng, res)
+
+    return {
+        "scope": scope,
+        "res": res,
+        "region": region,
+        "by_hexes": await _ranking(
+            db,
+            _users(RegionStats, RegionStats.hexes_owned),
+            RegionStats.hexes_owned,
+            RegionStats.user_id,
+            (RegionStats.resolution == res, RegionStats.region_id == region),
+            limit,
+        ),
+        "by_influence": await _ranking(
+            db,
+            _user_keys(TerritoryInfluenceRollup, TerritoryInfluenceRollup.influence),
+            TerritoryInfluenceRollup.influence,
+            TerritoryInfluenceRollup.user_key,
+            (
+                TerritoryInfluenceRollup.resolution == res,
+                TerritoryInfluenceRollup.territory_id == h3.str_to_int(region),
+            ),
+            limit,
+        ),
+    }
@@ -1,66 +1,41 @@
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
-import requests
 
-from app.dependencies.auth import get_current_user
-from app.database import SessionLocal
-from app.models import User
-from app.utils.strava_import import process_strava_activity
-from app.utils.strava_auth import ensure_valid_strava_token
+from app.dependencies.auth import get_current_user, get_current_user_id
+from app.database import get_db
+from app.models import User, StravaImportJob
+from app.utils.strava_backfill import create_or_get_job, submit_backfill
+from app.utils.strava_client import StravaAPIError, authorize_url, exchange_code
+from app.utils.user_cache import invalidate_user
 
 router = APIRouter(prefix="/strava", tags=["strava"])
 
-STRAVA_CLIENT_ID = os.getenv("STRAVA_CLIENT_ID")
-STRAVA_CLIENT_SECRET = os.getenv("STRAVA_CLIENT_SECRET")
-STRAVA_REDIRECT_URI = os.getenv("STRAVA_REDIRECT_URI")
 FRONTEND_URL = os.getenv(
     "FRONTEND_URL",
     "https://jkortabitarte.github.io/dominion-map"
 )
 
 
-# --- DB dependency ---
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 # --- Step 1: Redirect user to Strava ---
 @router.get("/connect")
-def connect_strava(current_user: User = Depends(get_current_user)):
-    url = (
-        "https://www.strava.com/oauth/authorize"
-        f"?client_id={STRAVA_CLIENT_ID}"
-        "&response_type=code"
-        f"&redirect_uri={STRAVA_REDIRECT_URI}"
-        "&approval_prompt=force"
-        "&scope=activity:read_all"
-        f"&state={current_user.id}"
-    )
-    return {"auth_url": url}
+async def connect_strava(user_id: str = Depends(get_current_user_id)):
+    return {"auth_url": authorize_url(user_id)}
 
 
 # --- Step 2: Strava callback ---
 @router.get("/callback")
-def strava_callback(code: str, state: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == state).first()
+async def strava_callback(code: str, state: str, db: AsyncSession = Depends(get_db)):
+    user = await db.get(User, state)
     if not user:
         raise HTTPException(status_code=400, detail="Invalid state")
 
-    token_res = requests.post(
-        "https://www.strava.com/oauth/token",
-        data={
-            "client_id": STRAVA_CLIENT_ID,
-            "client_secret": STRAVA_CLIENT_SECRET,
-            "code": code,
-            "grant_type": "authorization_code",
-        },
-    ).json()
+    try:
+        token_res = await run_in_threadpool(exchange_code, code)
+    except StravaAPIError:
+        token_res = {}
 
     if "access_token" not in token_res:
         raise HTTPException(
@@ -73,7 +48,8 @@ def strava_callback(code: str, state: str, db: Session = Depends(get_db)):
     user.strava_refresh_token = token_res["refresh_token"]
     user.strava_expires_at = token_res["expires_at"]
 
-    db.commit()
+    await db.commit()
+    invalidate_user(user.id)
 
     # ✅ volver al perfil
     return RedirectResponse(
@@ -81,61 +57,46 @@ def strava_callback(code: str, state: str, db: Session = Depends(get_db)):
     )
 
 
-# --- Step 3: Import activities ---
-@router.post("/import")
-def import_activities(
+# --- Step 3: Import activities (background backfill) ---
+def _job_to_dict(job):
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "pages": job.pages,
+        "imported": job.imported,
+        "skipped": job.skipped,
+        "after_cursor": job.after_cursor,
+        "error": job.error,
+        "updated_at": job.updated_at,
+    }
+
+
+@router.post("/import", status_code=202)
+async def import_activities(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    influence_cache = {}
     if not current_user.strava_access_token:
         raise HTTPException(
             status_code=400,
             detail="Strava not connected",
         )
 
-    try:
-        ensure_valid_strava_token(current_user, db)
-        headers = {
-            "Authorization": f"Bearer {current_user.strava_access_token}"
-        }
-
-        res = requests.get(
-            "https://www.strava.com/api/v3/athlete/activities",
-            headers=headers,
-            params={
-                "per_page": 50,
-                "page": 1,
-            },
-        )
-
-        if res.status_code != 200:
-            print("❌ Strava API response:", res.text)
-            raise HTTPException(status_code=400, detail="Strava API error")
-
-        activities = res.json()
-
-        imported = 0
-        skipped = 0
+    job, created = await db.run_sync(create_or_get_job, current_user)
+    if created:
+        submit_backfill(job.id, interactive=True)
 
-        for act in activities:
-            ok = process_strava_activity(db, current_user, act, influence_cache)
-            if ok:
-                imported += 1
-            else:
-                skipped += 1
+    return _job_to_dict(job)
 
-        db.commit()
 
-        return {
-            "imported": imported,
-            "skipped": skipped,
-            "total_seen": len(activities),
-        }
+@router.get("/import/{job_id}")
+async def get_import_job(
+    job_id: str,
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
+):
+    job = await db.get(StravaImportJob, job_id)
+    if not job or job.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Import job not found")
 
-    except Exception as e:
-        print("❌ Strava import error:", e)
-        raise HTTPException(
-            status_code=500,
-            detail="Internal Strava import error",
-        )
+    return _job_to_dict(job)
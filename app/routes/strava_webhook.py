@@ -1,16 +1,12 @@
-from fastapi import APIRouter, HTTPException, Query, Request
-from app.database import SessionLocal
-from app.models import User, Activity, TerritoryInfluence
-from app.utils.geo import polyline_to_h3
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db
+from app.utils.strava_events import enqueue_event
 import os
-import requests
-import time
 
 router = APIRouter(prefix="/strava", tags=["strava-webhook"])
 
 STRAVA_VERIFY_TOKEN = os.getenv("STRAVA_VERIFY_TOKEN")
-STRAVA_CLIENT_ID = os.getenv("STRAVA_CLIENT_ID")
-STRAVA_CLIENT_SECRET = os.getenv("STRAVA_CLIENT_SECRET")
 
 
 # 🔐 1) Webhook verification (GET)
@@ -28,91 +24,21 @@ def verify_webhook(
 
 
 # 📩 2) Receive events (POST)
+# Solo valida y encola: Strava espera un 200 rápido y el trabajo
+# (token, descarga de la actividad, territorios) lo hacen los workers.
 @router.post("/webhook")
 @router.post("/webhook/")
-async def receive_event(payload: dict):
+async def receive_event(payload: dict, db: AsyncSession = Depends(get_db)):
     if payload.get("object_type") != "activity":
         return {"status": "ignored"}
 
-    if payload.get("aspect_type") != "create":
+    if payload.get("aspect_type") not in ("create", "update", "delete"):
         return {"status": "ignored"}
 
-    athlete_id = payload["owner_id"]
-    activity_id = payload["object_id"]
-    # ❌ Avoid duplicate imports
-    existing = db.query(Activity).filter(
-       Activity.strava_activity_id == activity_id
-    ).first()
+    if not isinstance(payload.get("object_id"), int) or not isinstance(payload.get("owner_id"), int):
+        raise HTTPException(status_code=400, detail="Invalid event")
 
-    if existing:
-       return {"status": "already imported"}
+    if not await db.run_sync(enqueue_event, payload):
+        return {"status": "already queued"}
 
-    db = SessionLocal()
-
-    user = db.query(User).filter(
-        User.strava_athlete_id == athlete_id
-    ).first()
-
-    if not user:
-        return {"status": "user not found"}
-
-    # 🔄 Refresh token if needed
-    if user.strava_expires_at < int(time.time()):
-        refresh = requests.post(
-            "https://www.strava.com/oauth/token",
-            data={
-                "client_id": STRAVA_CLIENT_ID,
-                "client_secret": STRAVA_CLIENT_SECRET,
-                "grant_type": "refresh_token",
-                "refresh_token": user.strava_refresh_token,
-            },
-        ).json()
-
-        user.strava_access_token = refresh["access_token"]
-        user.strava_refresh_token = refresh["refresh_token"]
-        user.strava_expires_at = refresh["expires_at"]
-        db.commit()
-
-    # 📥 Get full activity
-    res = requests.get(
-        f"https://www.strava.com/api/v3/activities/{activity_id}",
-        headers={
-            "Authorization": f"Bearer {user.strava_access_token}"
-        },
-    )
-
-    activity_data = res.json()
-
-    polyline = activity_data.get("map", {}).get("summary_polyline")
-    if not polyline:
-        return {"status": "no polyline"}
-
-    # 💾 Save activity
-    activity = Activity(
-        user_id=user.id,
-        strava_activity_id=activity_id,
-        polyline=polyline,
-    )
-    db.add(activity)
-
-    # 🌍 Territories
-    hexes = polyline_to_h3(polyline)
-
-    for hex_id in hexes:
-        influence = db.query(TerritoryInfluence).filter_by(
-            territory_id=hex_id,
-            user_id=user.id,
-        ).first()
-
-        if influence:
-            influence.influence += 1
-        else:
-            db.add(TerritoryInfluence(
-                territory_id=hex_id,
-                user_id=user.id,
-                influence=1,
-            ))
-
-    db.commit()
-
-    return {"status": "activity imported"}
+    return {"status": "queued"}
@@ -1,42 +1,188 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from app.database import SessionLocal
-from app.models import TerritoryInfluence
+from datetime import date
+
+import h3
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db
+from app.models import MapVersion, TerritoryInfluenceBucket, TerritoryOwner, TerritoryOwnerRollup, UserKey
+from app.utils.geo import H3_RESOLUTION, MAP_RESOLUTIONS, bbox_to_h3, disk_to_h3
+from app.utils.influence_buckets import INFLUENCE_RETENTION_DAYS, day_number, windowed_influence
+from app.utils.http_cache import is_fresh, make_etag, not_modified
+from app.utils.territory_owner import iter_owners
+from app.utils.territory_payload import encode, negotiate
 
 router = APIRouter(prefix="/territories", tags=["territories"])
 
+# tamaño de cada IN (...) contra la clave primaria
+LOOKUP_CHUNK_SIZE = 1000
+
+
+def _requested_cells(bbox, lat, lng, k, res):
+    """
+    None = mundo entero; si no, el set de hexágonos del área pedida.
+    """
+    if bbox is not None:
+        try:
+            min_lng, min_lat, max_lng, max_lat = (float(v) for v in bbox.split(","))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="bbox must be minLng,minLat,maxLng,maxLat")
+        return bbox_to_h3(min_lng, min_lat, max_lng, max_lat, res)
+
+    if lat is not None or lng is not None or k is not None:
+        if lat is None or lng is None:
+            raise HTTPException(status_code=400, detail="lat and lng are required")
+        return disk_to_h3(lat, lng, k or 0, res)
+
+    return None
+
+
+def _in_chunks(cells):
+    """Bloques ordenados de hexágonos; None (mundo entero) = un solo bloque."""
+    if cells is None:
+        yield None
+        return
+    cells = sorted(cells)
+    for start in range(0, len(cells), LOOKUP_CHUNK_SIZE):
+        yield cells[start:start + LOOKUP_CHUNK_SIZE]
+
+
+async def _owner_rows(db, cells, table, filters):
+    """Dueños ya calculados (territory_owner / territory_owner_rollup)."""
+    query = (
+        select(table.territory_id, table.user_id, table.influence)
+        .where(*filters, table.user_id.isnot(None))
+    )
+
+    # búsqueda por clave primaria, en bloques
+    rows = []
+    for chunk in _in_chunks(cells):
+        chunk_query = query if chunk is None else query.where(table.territory_id.in_(chunk))
+        rows.extend(tuple(r) for r in (await db.execute(chunk_query)).all())
+    return rows
+
+
+def _windowed_owners(result, half_life):
+    """Dueños de un bloque de filas de buckets (CPU: se llama en un hilo)."""
+    if half_life:
+        result = windowed_influence(result, half_life=half_life)
+    return [
+        (territory_id, owner, influence)
+        for territory_id, owner, influence, _ in iter_owners(result)
+        if owner is not None
+    ]
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 
+async def _windowed_rows(db, cells, res, since_day, half_life):
+    """
+    Dueños calculados al vuelo desde los buckets diarios: influencia desde
+    `since_day` y/o con decaimiento de semivida `half_life` días. Siempre
+    sobre un área acotada (`cells`, como mucho MAX_AREA_CELLS hexágonos).
+    """
+    bucket = TerritoryInfluenceBucket
+    filters = [bucket.resolution == res]
+    if since_day is not None:
+        filters.append(bucket.day >= since_day)
 
+    if half_life:
+        query = select(bucket.territory_id, UserKey.user_id, bucket.day, bucket.influence)
+    else:
+        query = (
+            select(bucket.territory_id, UserKey.user_id, func.sum(bucket.influence))
+            .group_by(bucket.territory_id, UserKey.user_id)
+        )
+    query = (
+        query.join(UserKey, UserKey.id == bucket.user_key)
+        .where(*filters)
+        .order_by(bucket.territory_id)
+    )
+
+    rows = []
+    for chunk in _in_chunks(cells):
+        chunk_query = query.where(bucket.territory_id.in_([h3.str_to_int(c) for c in chunk]))
+        result = (await db.execute(chunk_query)).all()
+        rows.extend(await run_in_threadpool(_windowed_owners, result, half_life))
+    return rows
+
+
+# JSON por defecto; con Accept: application/msgpack o application/octet-stream
+# se devuelve la codificación columnar (ver app/utils/territory_payload.py).
+# ?since= / ?mode=decay: dueños según la influencia reciente (buckets diarios)
 @router.get("")
-def get_territories(db: Session = Depends(get_db)):
-    rows = (
-        db.query(
-            TerritoryInfluence.territory_id,
-            TerritoryInfluence.user_id,
-            TerritoryInfluence.influence,
+async def get_territories(
+    request: Request,
+    bbox: str | None = Query(None, description="minLng,minLat,maxLng,maxLat"),
+    lat: float | None = Query(None, ge=-90, le=90),
+    lng: float | None = Query(None, ge=-180, le=180),
+    k: int | None = Query(None, ge=0),
+    res: int = Query(H3_RESOLUTION, description="resolución H3 (zoom)"),
+    since: date | None = Query(None, description="solo influencia desde esta fecha"),
+    mode: str = Query("total", pattern="^(total|decay)$"),
+    half_life: float = Query(30, gt=0, description="semivida en días (mode=decay)"),
+    db: AsyncSession = Depends(get_db),
+):
+    if res not in MAP_RESOLUTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"res must be one of {list(MAP_RESOLUTIONS)}",
         )
-        .order_by(
-            TerritoryInfluence.territory_id,
-            TerritoryInfluence.influence.desc(),
+
+    # ⏳ vista por periodo: se responde desde los buckets diarios
+    windowed = since is not None or mode == "decay"
+    # sin área se leerían (y plegarían) todos los buckets del mundo
+    if windowed and bbox is None and lat is None and lng is None and k is None:
+        raise HTTPException(status_code=400, detail="since / mode=decay need bbox or lat,lng")
+    today = day_number()
+    since_day = day_number(since) if since is not None else None
+    if since_day is not None and since_day < today - INFLUENCE_RETENTION_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"since must be within the last {INFLUENCE_RETENTION_DAYS} days",
         )
-        .all()
+
+    # resolución base o agregada (una fila por hexágono padre)
+    if res == H3_RESOLUTION:
+        table, filters = TerritoryOwner, ()
+    else:
+        table, filters = TerritoryOwnerRollup, (TerritoryOwnerRollup.resolution == res,)
+
+    # 🏷️ versión del mapa (map_version, lectura por PK): si el cliente ya
+    # la tiene, 304 sin calcular el área ni leer dueños
+    media_type = negotiate(request.headers.get("accept"))
+    version = await db.scalar(select(MapVersion.version).where(MapVersion.resolution == res))
+    etag = make_etag(
+        "territories", version, res, bbox, lat, lng, k, media_type,
+        *((since_day, mode, half_life, today) if windowed else ()),
     )
+    headers = {"ETag": etag, "Vary": "Accept"}
+    if is_fresh(request, etag):
+        return not_modified(etag, vary="Accept")
 
-    territories = {}
-    for r in rows:
-        if r.territory_id not in territories:
-            territories[r.territory_id] = {
-                "territory_id": r.territory_id,
-                "owner": r.user_id,
-                "influence": r.influence,
-            }
+    try:
+        # polygon_to_cells / grid_disk son CPU: fuera del event loop
+        cells = await run_in_threadpool(_requested_cells, bbox, lat, lng, k, res)
+    except ValueError as e:  # incluye AreaTooLarge
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if windowed:
+        rows = await _windowed_rows(db, cells, res, since_day, half_life if mode == "decay" else None)
+    else:
+        rows = await _owner_rows(db, cells, table, filters)
 
-    return list(territories.values())
+    if media_type:
+        body = await run_in_threadpool(encode, rows, media_type)
+        return Response(content=body, media_type=media_type, headers=headers)
+
+    return JSONResponse(
+        content=[
+            {
+                "territory_id": territory_id,
+                "owner": owner,
+                "influence": influence,
+            }
+            for territory_id, owner, influence in rows
+        ],
+        headers=headers,
+    )
@@ -1,26 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import SessionLocal
-from app.models import User, Activity, TerritoryInfluence
-from app.dependencies.auth import get_current_user
+from app.database import get_db
+from app.models import User, UserStats
+from app.dependencies.auth import get_current_user, get_current_user_id
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
-# --- DB dependency ---
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 # 🔐 PRIVATE: current user profile
 @router.get("/me")
-def get_me(current_user: User = Depends(get_current_user)):
+async def get_me(current_user: User = Depends(get_current_user)):
     return {
         "id": current_user.id,
         "username": current_user.username,
@@ -32,8 +22,8 @@ def get_me(current_user: User = Depends(get_current_user)):
 
 # 🌍 PUBLIC: get user by id (limited info)
 @router.get("/{user_id}")
-def get_user(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def get_user(user_id: str, db: AsyncSession = Depends(get_db)):
+    user = await db.get(User, user_id)
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -44,40 +34,27 @@ def get_user(user_id: str, db: Session = Depends(get_db)):
         # ❗ Nada sensible aquí
     }
 
-# 🔐 PRIVATE: current user statistics
+# 🔐 PRIVATE: current user statistics (fila precalculada en user_stats)
 @router.get("/me/stats")
-def get_my_stats(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+async def get_my_stats(
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
 ):
-    activities_count = (
-        db.query(func.count(Activity.id))
-        .filter(Activity.user_id == current_user.id)
-        .scalar()
-    )
-
-    hexes_count = (
-        db.query(func.count(TerritoryInfluence.territory_id))
-        .filter(TerritoryInfluence.user_id == current_user.id)
-        .scalar()
-    )
+    stats = await db.get(UserStats, user_id)
 
-    total_influence = (
-        db.query(func.coalesce(func.sum(TerritoryInfluence.influence), 0))
-        .filter(TerritoryInfluence.user_id == current_user.id)
-        .scalar()
-    )
-
-    last_activity = (
-        db.query(Activity.created_at)
-        .filter(Activity.user_id == current_user.id)
-        .order_by(Activity.created_at.desc())
-        .first()
-    )
+    if not stats:
+        return {
+            "activities": 0,
+            "hexes": 0,
+            "hexes_owned": 0,
+            "influence": 0,
+            "last_activity": None,
+        }
 
     return {
-        "activities": activities_count,
-        "hexes": hexes_count,
-        "influence": total_influence,
-        "last_activity": last_activity[0] if last_activity else None,
-    }
\ No newline at end of file
+        "activities": stats.activities,
+        "hexes": stats.hexes,
+        "hexes_owned": stats.hexes_owned,
+        "influence": stats.influence,
+        "last_activity": stats.last_activity_at,
+    }
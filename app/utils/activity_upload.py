@@ -0,0 +1,319 @@
+"""
+Subida masiva de actividades (POST /activities/bulk), p. ej. para migrar
+a un usuario desde otra app en una sola petición.
+
+El cuerpo se lee en streaming y se trocea en items:
+- NDJSON: una actividad por línea, {"polyline": "...", "start_date": "..."}
+  (start_date opcional, ISO 8601).
+- multipart/form-data con ficheros GPX: cada fichero se parsea según llega
+  (python-multipart + XMLPullParser) y cada <trk> / <rte> es una actividad.
+
+Cada item es un dict con "index" y "polyline" / "start_date", o con
+"error" si no se ha podido leer. Los items válidos se convierten a
+hexágonos y se guardan por bloques (import_polylines), una transacción por
+bloque.
+"""
+import json
+import os
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from xml.etree.ElementTree import ParseError, XMLPullParser
+
+import numpy as np
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+
+from app.models import Activity
+from app.utils.cell_cache import hexes_many
+from app.utils.footprints import record_footprints
+from app.utils.geometry import geometry_row, polyline_from_coords, record_geometries
+from app.utils.influence_buckets import day_number
+from app.utils.territory_ingest import apply_influence
+from app.utils.user_stats import record_activities
+
+# actividades por transacción
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "200"))
+# tamaño máximo de una línea NDJSON / de un fichero GPX
+BULK_ITEM_MAX_BYTES = int(os.getenv("BULK_ITEM_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+class UploadError(Exception):
+    """El cuerpo no se puede leer (formato o tamaño): se responde 4xx."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _start_date(value):
+    if not value:
+        return None
+    start = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+
+
+# --- NDJSON ---
+
+def _ndjson_item(index, line):
+    try:
+        data = json.loads(line)
+        polyline = data.get("polyline") if isinstance(data, dict) else None
+        if not isinstance(polyline, str) or not polyline:
+            return {"index": index, "error": "Missing polyline"}
+        return {"index": index, "polyline": polyline, "start_date": _start_date(data.get("start_date"))}
+    except (ValueError, TypeError, AttributeError) as e:
+        return {"index": index, "error": f"Invalid line: {e}"}
+
+
+async def ndjson_items(stream):
+    """Items de un cuerpo NDJSON (`stream`: iterador asíncrono de bytes)."""
+    index = 0
+    pending = b""
+    async for chunk in stream:
+        *lines, pending = (pending + chunk).split(b"\n")
+        if len(pending) > BULK_ITEM_MAX_BYTES:
+            raise UploadError(413, f"Line {index + len(lines)} is too long")
+        for line in lines:
+            if line.strip():
+                yield _ndjson_item(index, line)
+                index += 1
+    if pending.strip():
+        yield _ndjson_item(index, pending)
+
+
+# --- GPX ---
+
+def _local(tag):
+    # GPX 1.0 / 1.1 y extensiones: solo importa el nombre sin namespace
+    return tag.rsplit("}", 1)[-1]
+
+
+class _GpxFile:
+    """
+    Parser incremental de un fichero GPX: se le pasan los bytes según
+    llegan y devuelve las actividades (un <trk> o <rte> cada una) en cuanto
+    se cierran, sin guardar el fichero entero.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.size = 0
+        self.error = None
+        self._parser = XMLPullParser(events=("start", "end"))
+        self._points = []
+        self._start = None
+        self._in_point = False
+
+    def feed(self, data):
+        if self.error:
+            return []
+        self.size += len(data)
+        if self.size > BULK_ITEM_MAX_BYTES:
+            self.error = "File is too large"
+            return []
+        try:
+            self._parser.feed(data)
+            return self._read_events()
+        except (ParseError, ValueError, TypeError) as e:
+            self.error = f"Invalid GPX: {e}"
+            return []
+
+    def close(self):
+        if self.error:
+            return []
+        try:
+            self._parser.close()
+            return self._read_events()
+        except (ParseError, ValueError, TypeError) as e:
+            self.error = f"Invalid GPX: {e}"
+            return []
+
+    def _read_events(self):
+        tracks = []
+        for event, elem in self._parser.read_events():
+            tag = _local(elem.tag)
+            if event == "start":
+                if tag in ("trkpt", "rtept"):
+                    self._points.append((float(elem.get("lat")), float(elem.get("lon"))))
+                    self._in_point = True
+                continue
+
+            if tag == "time" and self._in_point and self._start is None and elem.text:
+                self._start = _start_date(elem.text.strip())
+            elif tag in ("trkpt", "rtept"):
+                self._in_point = False
+                # no acumular el árbol: solo interesan las coordenadas
+                elem.clear()
+            elif tag in ("trk", "rte"):
+                if self._points:
+                    tracks.append((self._points, self._start))
+                self._points, self._start = [], None
+                elem.clear()
+        return tracks
+
+
+class _GpxUpload:
+    """Callbacks de python-multipart: un _GpxFile por cada fichero del form."""
+
+    def __init__(self):
+        self.items = []
+        self._index = 0
+        self._file = None
+        self._tracks = 0
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+
+    def _emit(self, tracks):
+        for points, start in tracks:
+            item = {"index": self._index, "file": self._file.filename}
+            try:
+                item["polyline"] = polyline_from_coords(np.array(points, dtype=np.float64))
+                item["start_date"] = start
+            except ValueError as e:
+                item["error"] = f"Invalid GPX: {e}"
+            self.items.append(item)
+            self._index += 1
+            self._tracks += 1
+
+    def on_part_begin(self):
+        self._headers = {}
+
+    def on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        filename = options.get(b"filename")
+        # los campos normales del formulario se ignoran
+        self._file = _GpxFile(filename.decode(errors="replace")) if filename is not None else None
+        self._tracks = 0
+
+    def on_part_data(self, data, start, end):
+        if self._file:
+            self._emit(self._file.feed(data[start:end]))
+
+    def on_part_end(self):
+        if not self._file:
+            return
+        self._emit(self._file.close())
+        error = self._file.error or (None if self._tracks else "No tracks in file")
+        if error:
+            self.items.append({"index": self._index, "file": self._file.filename, "error": error})
+            self._index += 1
+        self._file = None
+
+
+async def gpx_items(stream, content_type):
+    """Items de un multipart/form-data con ficheros GPX."""
+    _, options = parse_options_header(content_type)
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise UploadError(400, "Missing multipart boundary")
+
+    upload = _GpxUpload()
+    parser = MultipartParser(boundary, {
+        name: getattr(upload, name)
+        for name in (
+            "on_part_begin", "on_part_data", "on_part_end", "on_header_field",
+            "on_header_value", "on_header_end", "on_headers_finished",
+        )
+    })
+    try:
+        async for chunk in stream:
+            parser.write(chunk)
+            items, upload.items = upload.items, []
+            for item in items:
+                yield item
+        parser.finalize()
+    except ValueError as e:
+        # python-multipart: MultipartParseError y derivados
+        raise UploadError(400, f"Invalid multipart body: {e}")
+    for item in upload.items:
+        yield item
+
+
+def upload_items(stream, content_type):
+    """Items del cuerpo según su Content-Type."""
+    media_type, _ = parse_options_header(content_type)
+    if media_type in (b"application/x-ndjson", b"application/jsonl"):
+        return ndjson_items(stream)
+    if media_type == b"multipart/form-data":
+        return gpx_items(stream, content_type)
+    raise UploadError(415, "Use application/x-ndjson or multipart/form-data with GPX files")
+
+
+# --- Guardado ---
+
+def convert_items(items, db=None):
+    """
+    Polyline -> hexágonos de un bloque de items, con una sola consulta a la
+    caché (`db` opcional, ver cell_cache.lookup_many). Los que fallan pasan
+    a tener "error".
+    """
+    for item, hexes in zip(items, hexes_many([item["polyline"] for item in items], db)):
+        if isinstance(hexes, Exception):
+            item["error"] = f"Invalid polyline: {hexes}"
+            continue
+        item["hexes"] = hexes
+        if not item["hexes"]:
+            item["error"] = "No territories generated"
+    return items
+
+
+def _result(item):
+    result = {"index": item["index"]}
+    if "file" in item:
+        result["file"] = item["file"]
+    if "error" in item:
+        result["error"] = item["error"]
+    else:
+        result["activity_id"] = item["activity_id"]
+        result["hexes_affected"] = len(item["hexes"])
+    return result
+
+
+def import_polylines(db, user_id, items):
+    """
+    Guarda un bloque de items ya convertidos (convert_items): actividades,
+    geometría, influencia (un único upsert), footprints y user_stats, como
+    import_strava_page pero sin id de Strava. Devuelve el resultado de cada
+    item. No hace commit.
+    """
+    now = datetime.now(timezone.utc)
+    activities = []
+    geometries = []
+    footprints = []
+    hex_counter = Counter()
+    by_day = defaultdict(Counter)
+
+    for item in items:
+        if "error" in item:
+            continue
+        item["activity_id"] = str(uuid.uuid4())
+        start = item.get("start_date") or now
+        activities.append({"id": item["activity_id"], "user_id": user_id, "start_date": start, "created_at": now})
+        geometries.append(geometry_row(item["activity_id"], item["polyline"]))
+
+        day = day_number(start)
+        hex_counter.update(item["hexes"])
+        by_day[day].update(item["hexes"])
+        footprints.append((item["activity_id"], item["hexes"], day))
+
+    if activities:
+        db.execute(Activity.__table__.insert().values(activities))
+        record_geometries(db, geometries)
+        apply_influence(db, user_id, hex_counter, by_day)
+        record_footprints(db, footprints)
+        record_activities(db, user_id, len(activities))
+
+    return [_result(item) for item in items]
@@ -0,0 +1,216 @@
+"""
+Memoización de polyline -> hexágonos H3.
+
+Dos niveles:
+  1. LRU en memoria acotada por bytes (CELL_CACHE_MAX_BYTES).
+  2. Opcional (CELL_CACHE_DB=1): tabla polyline_cells con los arrays
+     empaquetados, compartida entre procesos y reinicios.
+
+La clave es un hash de la polyline, de H3_RESOLUTION y de
+geo.POLYLINE_H3_VERSION, así que cambiar la resolución o el algoritmo
+invalida la caché sin borrar nada (las filas viejas dejan de leerse).
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.database import insert_for
+from app.models import PolylineCells
+from app.utils import geo
+
+CELL_CACHE_MAX_BYTES = int(os.getenv("CELL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CELL_CACHE_DB = os.getenv("CELL_CACHE_DB", "0") == "1"
+
+# coste aproximado de la entrada (clave, tupla, cabeceras de numpy)
+ENTRY_OVERHEAD_BYTES = 256
+LOOKUP_CHUNK_SIZE = 1000
+
+_lock = threading.Lock()
+_entries: "OrderedDict[str, tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+_bytes = 0
+_stats = {"hits": 0, "db_hits": 0, "misses": 0, "evictions": 0}
+
+
+def cache_key(polyline_str, res=None):
+    res = geo.H3_RESOLUTION if res is None else res
+    digest = hashlib.blake2b(
+        f"{geo.POLYLINE_H3_VERSION}:{res}:{polyline_str}".encode(),
+        digest_size=16,
+    )
+    return digest.hexdigest()
+
+
+def pack(cells, counts):
+    return cells.astype("<u8").tobytes(), counts.astype("<u4").tobytes()
+
+
+def unpack(cells_blob, counts_blob):
+    return (
+        np.frombuffer(cells_blob, dtype="<u8").astype(np.uint64),
+        np.frombuffer(counts_blob, dtype="<u4").astype(np.uint32),
+    )
+
+
+def _entry_size(value):
+    cells, counts = value
+    return cells.nbytes + counts.nbytes + ENTRY_OVERHEAD_BYTES
+
+
+def _get_memory(key):
+    with _lock:
+        value = _entries.get(key)
+        if value is not None:
+            _entries.move_to_end(key)
+        return value
+
+
+def _put_memory(key, value):
+    global _bytes
+    size = _entry_size(value)
+    if size > CELL_CACHE_MAX_BYTES:
+        return
+
+    # compartidos entre llamadas: nadie debe modificarlos
+    for array in value:
+        array.setflags(write=False)
+
+    with _lock:
+        old = _entries.pop(key, None)
+        if old is not None:
+            _bytes -= _entry_size(old)
+
+        _entries[key] = value
+        _bytes += size
+
+        while _bytes > CELL_CACHE_MAX_BYTES:
+            _, evicted = _entries.popitem(last=False)
+            _bytes -= _entry_size(evicted)
+            _stats["evictions"] += 1
+
+
+def _count(stat, n=1):
+    with _lock:
+        _stats[stat] += n
+
+
+def _store_db(db, rows):
+    insert = insert_for(db)
+    for start in range(0, len(rows), LOOKUP_CHUNK_SIZE):
+        stmt = insert(PolylineCells).values(
+            rows[start:start + LOOKUP_CHUNK_SIZE]
+        ).on_conflict_do_nothing(index_elements=[PolylineCells.key])
+        db.execute(stmt)
+
+
+def polyline_cells(polyline_str, db=None):
+    """
+    (cells uint64, counts uint32) de la polyline, usando la caché.
+    Con `db` y CELL_CACHE_DB activo también consulta / rellena la tabla
+    (sin commit: va en la transacción del llamador).
+    """
+    value = lookup_many([polyline_str], db)[0]
+    if isinstance(value, Exception):
+        raise value
+    return value
+
+
+def lookup_many(polylines, db=None):
+    """
+    Versión por lotes de polyline_cells: una sola consulta a la tabla
+    para todas las polylines que no estén en memoria. Una polyline
+    inválida no tumba el lote: en su posición va la excepción.
+    """
+    res = geo.H3_RESOLUTION
+    keys = [cache_key(p, res) for p in polylines]
+    results = [_get_memory(key) for key in keys]
+
+    missing = [i for i, value in enumerate(results) if value is None]
+    _count("hits", len(polylines) - len(missing))
+
+    use_db = db is not None and CELL_CACHE_DB
+    if missing and use_db:
+        wanted = {keys[i] for i in missing}
+        found = {}
+        wanted_list = list(wanted)
+        for start in range(0, len(wanted_list), LOOKUP_CHUNK_SIZE):
+            for row in db.query(PolylineCells).filter(
+                PolylineCells.key.in_(wanted_list[start:start + LOOKUP_CHUNK_SIZE])
+            ):
+                found[row.key] = unpack(row.cells, row.counts)
+
+        still_missing = []
+        for i in missing:
+            value = found.get(keys[i])
+            if value is None:
+                still_missing.append(i)
+                continue
+            results[i] = value
+            _put_memory(keys[i], value)
+        _count("db_hits", len(missing) - len(still_missing))
+        missing = still_missing
+
+    _count("misses", len(missing))
+
+    new_rows = {}
+    for i in missing:
+        try:
+            value = tuple(geo.polyline_to_h3_counts(polylines[i], res))
+        except Exception as e:
+            results[i] = e
+            continue
+        results[i] = value
+        _put_memory(keys[i], value)
+        if use_db:
+            cells_blob, counts_blob = pack(*value)
+            new_rows[keys[i]] = {
+                "key": keys[i],
+                "resolution": res,
+                "cells": cells_blob,
+                "counts": counts_blob,
+            }
+
+    if new_rows:
+        _store_db(db, list(new_rows.values()))
+
+    return results
+
+
+def _hexes(cells):
+    return {f"{cell:x}" for cell in cells.tolist()}
+
+
+def polyline_hexes(polyline_str, db=None) -> set[str]:
+    """Equivalente cacheado de geo.polyline_to_h3."""
+    cells, _ = polyline_cells(polyline_str, db)
+    return _hexes(cells)
+
+
+def hexes_many(polylines, db=None):
+    """
+    Versión por lotes de polyline_hexes (ver lookup_many): set de
+    hexágonos de cada polyline, o la excepción si no se ha podido leer.
+    """
+    return [
+        value if isinstance(value, Exception) else _hexes(value[0])
+        for value in lookup_many(polylines, db)
+    ]
+
+
+def stats():
+    with _lock:
+        return {
+            **_stats,
+            "entries": len(_entries),
+            "bytes": _bytes,
+            "max_bytes": CELL_CACHE_MAX_BYTES,
+        }
+
+
+def clear():
+    global _bytes
+    with _lock:
+        _entries.clear()
+        _bytes = 0
@@ -0,0 +1,151 @@
+"""
+Footprint de cada actividad (tabla activity_footprints): los hexágonos
+exactos que sumó y en qué bucket diario, empaquetados como en la caché
+de celdas (uint64 / uint32 little-endian).
+
+Con él, borrar o editar una actividad resta exactamente lo que se sumó,
+en vez de volver a decodificar la polyline y esperar que salga lo mismo.
+"""
+from collections import Counter
+from collections.abc import Mapping
+
+import h3
+import numpy as np
+
+from app.database import insert_for
+from app.models import ActivityFootprint, TerritoryInfluenceBucket
+from app.utils.cell_cache import polyline_hexes
+from app.utils.geo import H3_RESOLUTION
+from app.utils.geometry import set_geometry, summary_polyline
+from app.utils.influence_buckets import bucket_day, day_number
+from app.utils.territory_ingest import apply_influence, remove_influence
+from app.utils.user_keys import user_key
+from app.utils.user_stats import record_activities, record_activity_edit
+
+CHUNK_SIZE = 1000
+
+
+def _pack(cells):
+    counts = cells if isinstance(cells, Mapping) else Counter(cells)
+    items = sorted((h3.str_to_int(hex_id), count) for hex_id, count in counts.items())
+    packed_cells = np.array([c for c, _ in items], dtype="<u8").tobytes()
+    values = [n for _, n in items]
+    # lo normal es +1 por hexágono: entonces no se guardan los contadores
+    if all(n == 1 for n in values):
+        return packed_cells, None
+    return packed_cells, np.array(values, dtype="<u4").tobytes()
+
+
+def _unpack(footprint):
+    cells = np.frombuffer(footprint.cells, dtype="<u8").tolist()
+    if footprint.counts is None:
+        counts = [1] * len(cells)
+    else:
+        counts = np.frombuffer(footprint.counts, dtype="<u4").tolist()
+    return Counter({h3.int_to_str(cell): count for cell, count in zip(cells, counts)})
+
+
+def record_footprints(db, footprints):
+    """
+    `footprints`: lista de (activity_id, hexágonos, día). Un único INSERT
+    por bloque; si la actividad ya tenía footprint, se sustituye.
+    No hace commit.
+    """
+    rows = []
+    for activity_id, cells, day in footprints:
+        packed_cells, packed_counts = _pack(cells)
+        rows.append({
+            "activity_id": activity_id,
+            "day": day,
+            "cells": packed_cells,
+            "counts": packed_counts,
+        })
+
+    insert = insert_for(db)
+    for start in range(0, len(rows), CHUNK_SIZE):
+        stmt = insert(ActivityFootprint).values(rows[start:start + CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ActivityFootprint.activity_id],
+            set_={
+                "day": stmt.excluded.day,
+                "cells": stmt.excluded.cells,
+                "counts": stmt.excluded.counts,
+            },
+        )
+        db.execute(stmt)
+
+
+def _activity_day(activity):
+    return day_number(activity.start_date or activity.created_at)
+
+
+def _bucket_day(db, key, day):
+    """
+    Bucket en el que está hoy la influencia de `day`: el diario, el semanal
+    si ya se compactó, o ninguno si pasó la retención.
+    """
+    target = bucket_day(day)
+    if target is None or target == day:
+        return target
+
+    bucket = TerritoryInfluenceBucket
+    still_daily = (
+        db.query(bucket.day)
+        .filter(
+            bucket.resolution == H3_RESOLUTION,
+            bucket.user_key == key,
+            bucket.day == day,
+        )
+        .first()
+    )
+    # ingests anteriores a bucket_day: aún en el diario si no se ha compactado
+    return day if still_daily else target
+
+
+def _subtract(db, activity):
+    """Resta la contribución de la actividad y borra su footprint."""
+    footprint = db.get(ActivityFootprint, activity.id)
+    if footprint is not None:
+        counts, day = _unpack(footprint), footprint.day
+        db.delete(footprint)
+    elif (polyline := summary_polyline(activity)):
+        # actividades anteriores a los footprints: se recalcula la polyline
+        counts, day = Counter(polyline_hexes(polyline, db)), _activity_day(activity)
+    else:
+        return 0
+
+    return remove_influence(db, activity.user_id, counts, _bucket_day(db, user_key(db, activity.user_id), day))
+
+
+def delete_activity(db, activity):
+    """Borra una actividad y resta su influencia. No hace commit."""
+    removed = _subtract(db, activity)
+    db.delete(activity)
+    # record_activities recalcula last_activity_at sin esta actividad
+    db.flush()
+    record_activities(db, activity.user_id, -1)
+    return removed
+
+
+def replace_polyline(db, activity, polyline, start_date=None, detail=None):
+    """
+    Cambia el recorrido de una actividad (resumen y, si viene, track
+    completo): resta el footprint anterior y suma el nuevo. No hace commit.
+    """
+    _subtract(db, activity)
+    db.flush()
+
+    if polyline:
+        set_geometry(activity, polyline, detail)
+    else:
+        activity.geometry = None
+    if start_date is not None:
+        activity.start_date = start_date
+
+    hexes = polyline_hexes(polyline, db) if polyline else set()
+    day = _activity_day(activity)
+    apply_influence(db, activity.user_id, hexes, {day: Counter(hexes)})
+    if hexes:
+        record_footprints(db, [(activity.id, hexes, day)])
+    record_activity_edit(db, activity.user_id)
+    return len(hexes)
@@ -1,19 +1,209 @@
-import polyline
+import math
+import os
+from collections import Counter
+from itertools import repeat
+
+import numpy as np
 import h3
+import h3.api.basic_int as h3_int
 
 H3_RESOLUTION = 9  # buen equilibrio ciudad / barrio
 
+# resoluciones agregadas para el mapa con poco zoom (más gruesas que H3_RESOLUTION)
+ROLLUP_RESOLUTIONS = tuple(
+    int(r) for r in os.getenv("H3_ROLLUP_RESOLUTIONS", "5,7").split(",") if r
+)
+MAP_RESOLUTIONS = (*ROLLUP_RESOLUTIONS, H3_RESOLUTION)
+
+# versión del cálculo polyline -> hexágonos (va en la clave de la caché
+# polyline_cells): subirla al cambiar el resultado de coords_to_h3_path
+POLYLINE_H3_VERSION = 1
+
+
+# bytes válidos de una polyline: 63 + 6 bits
+_POLYLINE_BYTES = bytes(range(63, 127))
+
+
+def decode_polyline_array(polyline_str: str, precision: int = 5) -> np.ndarray:
+    """
+    Decodifica una polyline de Google/Strava directamente a un array
+    (n, 2) de [lat, lon] en float64, sin bucles en Python.
+    ValueError si no es una polyline válida (como geometry._polyline_values).
+    """
+    data = polyline_str.encode("ascii")
+    if not data:
+        return np.empty((0, 2), dtype=np.float64)
+    if data.translate(None, _POLYLINE_BYTES):
+        raise ValueError("polyline has characters outside '?'..'~'")
+    if data[-1] - 63 & 0x20:
+        raise ValueError("polyline is truncated")
+
+    chunks = np.frombuffer(data, dtype=np.uint8).astype(np.int64)
+    chunks -= 63
+
+    # cada valor termina en el primer byte sin el bit de continuación (0x20)
+    ends = np.flatnonzero(chunks < 0x20)
+    n = ends.size
+    if n % 2:
+        raise ValueError("polyline has an odd number of values")
+
+    starts = np.empty(n, dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    # posición de cada byte dentro de su valor: 5 bits por byte
+    shifts = np.arange(chunks.size)
+    shifts -= np.repeat(starts, ends - starts + 1)
+    shifts *= 5
+
+    chunks &= 0x1F
+    chunks <<= shifts
+    values = np.add.reduceat(chunks, starts)
+
+    deltas = (values >> 1) ^ -(values & 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / 10 ** precision
+
+
+EARTH_RADIUS_M = 6371007.2
+# margen sobre el lado más corto: H3 no es una malla regular
+EDGE_SAFETY = 0.8
+# zona (resolución del padre) en la que se reutiliza la longitud de lado
+EDGE_REGION_RES = 3
+_edge_degrees = {}
+
+
+def _near_degrees(cell, res):
+    """
+    Distancia (en grados de latitud) por debajo de la cual dos vértices en
+    hexágonos distintos son seguro vecinos: entre dos hexágonos no contiguos
+    hay al menos un lado de por medio. Se cachea por zona.
+    """
+    region = h3_int.cell_to_parent(cell, min(EDGE_REGION_RES, res))
+    value = _edge_degrees.get(region)
+    if value is None:
+        edge = min(h3_int.edge_length(e, "m") for e in h3_int.origin_to_directed_edges(cell))
+        value = math.degrees(EDGE_SAFETY * edge / EARTH_RADIUS_M)
+        _edge_degrees[region] = value
+    return value
+
+
+def _h3_path(coords: np.ndarray, res: int) -> list[int]:
+    n = len(coords)
+    if n == 0:
+        return []
+
+    lats, lngs = coords[:, 0].tolist(), coords[:, 1].tolist()
+    cells = list(map(h3_int.latlng_to_cell, lats, lngs, repeat(res, n)))
+
+    # distancias al cuadrado en grados, con la longitud escalada por cos(lat)
+    near = _near_degrees(cells[0], res) ** 2
+    scale = math.cos(math.radians(lats[0])) ** 2
+
+    prev = cells[0]
+    path = [prev]
+    for i in range(1, n):
+        cell = cells[i]
+        if cell == prev:
+            continue
+        d_lat, d_lng = lats[i] - lats[i - 1], lngs[i] - lngs[i - 1]
+        # grid_path_cells (y are_neighbor_cells) solo para saltos largos
+        if d_lat * d_lat + d_lng * d_lng * scale >= near and not h3_int.are_neighbor_cells(prev, cell):
+            try:
+                path.extend(h3_int.grid_path_cells(prev, cell)[1:-1])
+            except Exception:
+                # caras del icosaedro / pentágonos: sin relleno en ese tramo
+                pass
+        path.append(cell)
+        prev = cell
+    return path
+
+
+def coords_to_h3_path(coords: np.ndarray, res: int = H3_RESOLUTION) -> np.ndarray:
+    """
+    Recorrido de hexágonos (uint64, en orden) que atraviesa una lista de
+    coordenadas, rellenando con grid_path_cells los huecos entre vértices
+    que caen en hexágonos no contiguos.
+    """
+    return np.array(_h3_path(coords, res), dtype=np.uint64)
+
+
+def polyline_to_h3_counts(polyline_str: str, res: int = H3_RESOLUTION) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Hexágonos (uint64) y número de veces que el recorrido entra en cada uno.
+    """
+    path = coords_to_h3_path(decode_polyline_array(polyline_str), res)
+    return np.unique(path, return_counts=True)
+
 
 def polyline_to_h3(polyline_str: str) -> set[str]:
     """
     Convierte una polyline de Strava/Google en un set de hexágonos H3
     """
-    coords = polyline.decode(polyline_str)  # [(lat, lon), ...]
+    # f"{cell:x}" es lo mismo que int_to_str, sin la llamada a la librería
+    return {f"{cell:x}" for cell in _h3_path(decode_polyline_array(polyline_str), H3_RESOLUTION)}
+
+
+def parent_counts(counts, res):
+    """Agrega un mapping hex -> valor a sus padres en la resolución `res`."""
+    parents = Counter()
+    for hex_id, value in counts.items():
+        parents[h3.cell_to_parent(hex_id, res)] += value
+    return parents
+
+
+def polylines_to_h3(polylines: list[str]) -> list[Counter]:
+    """
+    Versión por lotes: para cada polyline, Counter hex -> entradas.
+    """
+    # "%x" % cell == int_to_str(cell); map evita el generador en el conteo
+    return [
+        Counter(map("%x".__mod__, _h3_path(decode_polyline_array(polyline_str), H3_RESOLUTION)))
+        for polyline_str in polylines
+    ]
+
+
+# 🗺️ Consultas por zona: límite de hexágonos por petición
+MAX_AREA_CELLS = int(os.getenv("MAX_AREA_CELLS", "20000"))
+
+
+class AreaTooLarge(ValueError):
+    pass
+
+
+def _estimated_cells(min_lng, min_lat, max_lng, max_lat, res):
+    mid_lat = math.radians((min_lat + max_lat) / 2)
+    height_km = (max_lat - min_lat) * 111.32
+    width_km = (max_lng - min_lng) * 111.32 * math.cos(mid_lat)
+    return height_km * width_km / h3.average_hexagon_area(res, unit="km^2")
+
+
+def bbox_to_h3(min_lng, min_lat, max_lng, max_lat, res=H3_RESOLUTION) -> set[str]:
+    """
+    Hexágonos que cubren un rectángulo (viewport del mapa).
+    Se amplía un borde de hexágono para no perder los que solo asoman.
+    """
+    if min_lng >= max_lng or min_lat >= max_lat:
+        raise ValueError("bbox must be minLng,minLat,maxLng,maxLat")
+
+    pad = h3.average_hexagon_edge_length(res, unit="km") / 111.32
+    min_lat, max_lat = max(min_lat - pad, -90), min(max_lat + pad, 90)
+    min_lng, max_lng = max(min_lng - pad, -180), min(max_lng + pad, 180)
+
+    if _estimated_cells(min_lng, min_lat, max_lng, max_lat, res) > MAX_AREA_CELLS:
+        raise AreaTooLarge("Area too large for this resolution")
+
+    poly = h3.LatLngPoly([
+        (min_lat, min_lng),
+        (min_lat, max_lng),
+        (max_lat, max_lng),
+        (max_lat, min_lng),
+    ])
+    return set(h3.polygon_to_cells(poly, res))
 
-    hexes: set[str] = set()
 
-    for lat, lon in coords:
-        hex_id = h3.latlng_to_cell(lat, lon, H3_RESOLUTION)
-        hexes.add(hex_id)
+def disk_to_h3(lat, lng, k, res=H3_RESOLUTION) -> set[str]:
+    """Hexágonos a distancia <= k del punto."""
+    if 3 * k * (k + 1) + 1 > MAX_AREA_CELLS:
+        raise AreaTooLarge("Radius too large for this resolution")
 
-    return hexes
+    return set(h3.grid_disk(h3.latlng_to_cell(lat, lng, res), k))
@@ -0,0 +1,128 @@
+"""
+Recorridos de las actividades (tabla activity_geometry), fuera de la
+tabla caliente `activities`.
+
+Formato: un byte de formato + zlib de
+- FORMAT_VARINT: los valores de la polyline (deltas en zigzag, que es lo
+  que codifica el formato de Google) en varints de 7 bits en vez de
+  grupos de 5 bits en ASCII. Vuelve a dar exactamente la misma polyline.
+- FORMAT_TEXT: el texto tal cual, para polylines que no son canónicas
+  (no se podrían reconstruir idénticas).
+
+Se guarda el resumen de Strava (map.summary_polyline, el que cuenta para
+la influencia) y, si viene, el track completo (map.polyline).
+"""
+import zlib
+
+import numpy as np
+
+from app.models import ActivityGeometry
+
+FORMAT_TEXT = 0
+FORMAT_VARINT = 1
+
+ZLIB_LEVEL = 6
+CHUNK_SIZE = 1000
+
+
+def _split(values, bits):
+    """
+    Parte cada valor en grupos de `bits` bits, el menos significativo
+    primero. Devuelve (grupos, es_el_último_del_valor).
+    """
+    sizes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 64 // bits):
+        sizes += values >= (1 << (bits * k))
+
+    owner = np.repeat(np.arange(len(values)), sizes)
+    position = np.arange(len(owner)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    groups = (values[owner] >> (bits * position)) & ((1 << bits) - 1)
+    return groups, position == sizes[owner] - 1
+
+
+def _join(groups, last, bits):
+    """Inverso de _split."""
+    ends = np.flatnonzero(last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    owner = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = bits * (np.arange(len(groups)) - starts[owner])
+    # los valores de una polyline caben de sobra en la mantisa de un float64
+    return np.bincount(owner, weights=groups << shifts, minlength=len(ends)).astype(np.int64)
+
+
+def _polyline_values(polyline_str):
+    """Valores (zigzag) de una polyline, o None si no es válida."""
+    try:
+        chunks = np.frombuffer(polyline_str.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    except UnicodeEncodeError:
+        return None
+    if chunks.size == 0 or chunks.min() < 0 or chunks.max() > 63 or chunks[-1] & 0x20:
+        return None
+    return _join(chunks & 0x1F, (chunks & 0x20) == 0, 5)
+
+
+def _polyline_text(values):
+    groups, last = _split(values, 5)
+    return (groups + np.where(last, 0, 0x20) + 63).astype(np.uint8).tobytes().decode("ascii")
+
+
+def polyline_from_coords(coords, precision=5):
+    """Array (n, 2) de [lat, lon] -> polyline de Google (inverso de geo.decode_polyline_array)."""
+    if coords.ndim != 2 or coords.shape[1] != 2 or not np.isfinite(coords).all():
+        raise ValueError("coordinates must be finite (lat, lon) pairs")
+    if len(coords) == 0:
+        return ""
+    scaled = np.round(coords * 10 ** precision).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=0).ravel()
+    return _polyline_text(np.where(deltas < 0, ~(deltas << 1), deltas << 1))
+
+
+def pack_polyline(polyline_str):
+    values = _polyline_values(polyline_str)
+    if values is None or _polyline_text(values) != polyline_str:
+        return bytes([FORMAT_TEXT]) + zlib.compress(polyline_str.encode(), ZLIB_LEVEL)
+
+    groups, last = _split(values, 7)
+    varints = (groups | np.where(last, 0, 0x80)).astype(np.uint8).tobytes()
+    return bytes([FORMAT_VARINT]) + zlib.compress(varints, ZLIB_LEVEL)
+
+
+def unpack_polyline(blob):
+    if blob is None:
+        return None
+    data = zlib.decompress(blob[1:])
+    if blob[0] == FORMAT_TEXT:
+        return data.decode()
+
+    varints = np.frombuffer(data, dtype=np.uint8).astype(np.int64)
+    return _polyline_text(_join(varints & 0x7F, (varints & 0x80) == 0, 7))
+
+
+def geometry_row(activity_id, summary, detail=None):
+    return {
+        "activity_id": activity_id,
+        "summary": pack_polyline(summary),
+        "detail": pack_polyline(detail) if detail else None,
+    }
+
+
+def record_geometries(db, rows):
+    """`rows`: dicts de geometry_row. Inserta por bloques. No hace commit."""
+    table = ActivityGeometry.__table__
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.execute(table.insert().values(rows[start:start + CHUNK_SIZE]))
+
+
+def summary_polyline(activity):
+    """Polyline resumen de una actividad (carga su geometría; sesión síncrona)."""
+    return unpack_polyline(activity.geometry.summary) if activity.geometry else None
+
+
+def set_geometry(activity, summary, detail=None):
+    """Sustituye el recorrido de una actividad. No hace commit."""
+    row = geometry_row(activity.id, summary, detail)
+    if activity.geometry is None:
+        activity.geometry = ActivityGeometry(**row)
+    else:
+        activity.geometry.summary = row["summary"]
+        activity.geometry.detail = row["detail"]
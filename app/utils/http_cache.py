@@ -0,0 +1,35 @@
+"""
+GET condicionales: ETag débil a partir de una "versión" barata de leer
+(contadores, map_version...) y 304 si el cliente ya la tiene.
+"""
+import hashlib
+
+from fastapi import Response
+
+
+def make_etag(*parts):
+    digest = hashlib.blake2b(
+        "|".join(str(p) for p in parts).encode(),
+        digest_size=12,
+    ).hexdigest()
+    return f'W/"{digest}"'
+
+
+def is_fresh(request, etag):
+    """True si el If-None-Match de la petición incluye `etag`."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # la comparación de If-None-Match es débil: W/ no cuenta
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+def not_modified(etag, vary=None):
+    """304 con los headers de caché que llevaría el 200 (ETag y Vary)."""
+    headers = {"ETag": etag}
+    if vary:
+        headers["Vary"] = vary
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,144 @@
+"""
+Influencia por periodos (tabla territory_influence_bucket).
+
+Además del total acumulado, cada ingest suma la influencia en un bucket
+por día de la actividad, para la resolución base y las de
+ROLLUP_RESOLUTIONS. Con eso GET /territories responde "desde tal fecha"
+(?since=) o con influencia que decae con el tiempo (?mode=decay) sin
+volver a leer polylines.
+
+Los días se guardan como enteros (días desde 1970-01-01), así que toda
+la aritmética de fechas es portable entre Postgres y SQLite.
+
+Compactación (python -m app.compact_buckets):
+- los buckets diarios de más de INFLUENCE_DAILY_DAYS días se funden en
+  uno semanal (el del lunes de su semana);
+- los de más de INFLUENCE_RETENTION_DAYS días se borran (el total sigue
+  en territory_influence).
+"""
+import os
+from collections import defaultdict
+from datetime import date, datetime, timezone
+
+from app.database import insert_for
+from app.models import TerritoryInfluenceBucket
+
+INFLUENCE_DAILY_DAYS = int(os.getenv("INFLUENCE_DAILY_DAYS", "90"))
+INFLUENCE_RETENTION_DAYS = int(os.getenv("INFLUENCE_RETENTION_DAYS", "730"))
+
+CHUNK_SIZE = 5000
+
+_EPOCH = date(1970, 1, 1)
+
+
+def day_number(value=None):
+    """date / datetime (None = hoy, UTC) -> días desde 1970-01-01."""
+    if value is None:
+        value = datetime.now(timezone.utc)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        value = value.date()
+    return (value - _EPOCH).days
+
+
+def week_start(day):
+    # 1970-01-01 fue jueves: (day + 3) % 7 == 0 los lunes
+    return day - (day + 3) % 7
+
+
+def bucket_day(day, today=None):
+    """
+    Bucket en el que estaría hoy la influencia de `day` tras la
+    compactación: el diario, el semanal o None si pasó la retención.
+    """
+    today = day_number() if today is None else today
+    if day < today - INFLUENCE_DAILY_DAYS:
+        day = week_start(day)
+    # como compact_buckets: la retención mira el día del bucket
+    return None if day < today - INFLUENCE_RETENTION_DAYS else day
+
+
+def decay_weight(day, today, half_life):
+    """Peso de un bucket: la mitad cada `half_life` días."""
+    return 0.5 ** ((today - day) / half_life)
+
+
+def windowed_influence(rows, today=None, half_life=None):
+    """
+    `rows`: (territory_id, user_id, day, influence) ordenadas por territory_id.
+    Genera (territory_id, user_id, influence) sumando los buckets de cada
+    par hexágono / usuario, con decaimiento si se pide `half_life`.
+    """
+    today = day_number() if today is None else today
+    current, totals = None, defaultdict(float)
+
+    for territory_id, user_id, day, influence in rows:
+        if territory_id != current:
+            for user, total in totals.items():
+                yield current, user, total
+            current, totals = territory_id, defaultdict(float)
+
+        weight = decay_weight(day, today, half_life) if half_life else 1.0
+        totals[user_id] += (influence or 0) * weight
+
+    for user, total in totals.items():
+        yield current, user, total
+
+
+def _merge_day(db, day, target):
+    """Suma los buckets de `day` en los de `target` y los borra."""
+    table = TerritoryInfluenceBucket
+    rows = [
+        {
+            "resolution": r.resolution,
+            "territory_id": r.territory_id,
+            "day": target,
+            "user_key": r.user_key,
+            "influence": r.influence,
+        }
+        for r in db.query(
+            table.resolution, table.territory_id, table.user_key, table.influence
+        ).filter(table.day == day)
+    ]
+
+    insert = insert_for(db)
+    for start in range(0, len(rows), CHUNK_SIZE):
+        stmt = insert(table).values(rows[start:start + CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.resolution, table.territory_id, table.day, table.user_key],
+            set_={"influence": table.influence + stmt.excluded.influence},
+        )
+        db.execute(stmt)
+
+    db.query(table).filter(table.day == day).delete()
+    return len(rows)
+
+
+def compact_buckets(db, today=None):
+    """
+    Aplica la retención y funde los buckets diarios antiguos en semanales.
+    Un commit por día procesado. Devuelve (borrados, fundidos).
+    """
+    table = TerritoryInfluenceBucket
+    today = day_number() if today is None else today
+
+    deleted = db.query(table).filter(table.day < today - INFLUENCE_RETENTION_DAYS).delete()
+    db.commit()
+
+    # días antiguos que no son inicio de semana
+    days = [
+        day
+        for (day,) in db.query(table.day)
+        .filter(table.day < today - INFLUENCE_DAILY_DAYS)
+        .distinct()
+        .order_by(table.day)
+        if day != week_start(day)
+    ]
+
+    merged = 0
+    for day in days:
+        merged += _merge_day(db, day, week_start(day))
+        db.commit()
+
+    return deleted, merged
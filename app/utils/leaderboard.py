@@ -0,0 +1,93 @@
+"""
+Rankings por región (tabla region_stats).
+
+Igual que user_stats, se mantiene con incrementos en el ingest: solo se
+tocan las filas de los usuarios cuyo número de hexágonos en propiedad
+cambió, en las regiones (padres H3 de ROLLUP_RESOLUTIONS) afectadas.
+"""
+from collections import Counter
+
+import h3
+
+from app.database import insert_for
+from app.models import RegionStats, TerritoryOwner
+from app.utils.geo import ROLLUP_RESOLUTIONS
+
+CHUNK_SIZE = 5000
+
+
+def _region_deltas(changes):
+    """(resolution, region_id, user_id) -> variación de hexágonos en propiedad."""
+    deltas = Counter()
+    for territory_id, before, after in changes:
+        for res in ROLLUP_RESOLUTIONS:
+            region = h3.cell_to_parent(territory_id, res)
+            if before is not None:
+                deltas[(res, region, before)] -= 1
+            if after is not None:
+                deltas[(res, region, after)] += 1
+    return deltas
+
+
+def _rows(counts):
+    # orden fijo de la clave: los ingest concurrentes bloquean en el mismo orden
+    return [
+        {"resolution": res, "region_id": region, "user_id": user_id, "hexes_owned": value}
+        for (res, region, user_id), value in sorted(counts.items())
+        if value
+    ]
+
+
+def record_region_owners(db, changes):
+    """
+    Aplica a region_stats los cambios de dueño de refresh_owners (resolución
+    base). No hace commit.
+    """
+    rows = _rows(_region_deltas(changes))
+    insert = insert_for(db)
+    for start in range(0, len(rows), CHUNK_SIZE):
+        stmt = insert(RegionStats).values(rows[start:start + CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[RegionStats.resolution, RegionStats.region_id, RegionStats.user_id],
+            set_={"hexes_owned": RegionStats.hexes_owned + stmt.excluded.hexes_owned},
+        )
+        db.execute(stmt)
+
+
+def compute_region_stats(db):
+    counts = Counter()
+    owners = (
+        db.query(TerritoryOwner.territory_id, TerritoryOwner.user_id)
+        .filter(TerritoryOwner.user_id.isnot(None))
+        .execution_options(yield_per=CHUNK_SIZE)
+    )
+    for territory_id, user_id in owners:
+        for res in ROLLUP_RESOLUTIONS:
+            counts[(res, h3.cell_to_parent(territory_id, res), user_id)] += 1
+    return counts
+
+
+def rebuild_region_stats(db):
+    """Recalcula region_stats desde territory_owner. No hace commit."""
+    rows = _rows(compute_region_stats(db))
+
+    db.query(RegionStats).delete()
+    insert = insert_for(db)
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.execute(insert(RegionStats).values(rows[start:start + CHUNK_SIZE]))
+
+    return len(rows)
+
+
+def check_region_stats(db):
+    """Diferencias ((resolution, region_id, user_id), esperado, guardado)."""
+    expected = compute_region_stats(db)
+    stored = {
+        (row.resolution, row.region_id, row.user_id): row.hexes_owned
+        for row in db.query(RegionStats)
+    }
+    return [
+        (key, expected.get(key, 0), stored.get(key, 0))
+        for key in expected.keys() | stored.keys()
+        if expected.get(key, 0) != stored.get(key, 0)
+    ]
@@ -0,0 +1,201 @@
+"""
+Métricas de rendimiento en formato Prometheus (GET /metrics).
+
+- Latencia por ruta (plantilla de la ruta, no la URL concreta).
+- Consultas SQL y tiempo en base de datos por petición, vía eventos
+  del engine.
+- Espera para conseguir una conexión del pool.
+- Latencia y status de las llamadas salientes a Strava, presupuesto de
+  rate limit restante, cola por prioridad y esperas.
+- Contadores de la caché polyline -> hexágonos.
+
+Las métricas son por proceso: con varios workers de uvicorn, cada uno
+expone las suyas.
+"""
+import os
+import time
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+# peticiones con al menos estas consultas se escriben en el log (0 = nunca)
+SLOW_REQUEST_QUERY_THRESHOLD = int(os.getenv("SLOW_REQUEST_QUERY_THRESHOLD", "0"))
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Latencia de las peticiones HTTP",
+    ["method", "route", "status"],
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Consultas SQL por petición",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100, 250),
+)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_seconds",
+    "Tiempo en base de datos por petición",
+    ["method", "route"],
+)
+DB_QUERIES = Counter(
+    "db_queries_total",
+    "Consultas SQL ejecutadas (peticiones y workers)",
+    ["engine"],
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Espera para obtener una conexión del pool",
+    ["engine"],
+)
+STRAVA_LATENCY = Histogram(
+    "strava_request_duration_seconds",
+    "Latencia de las llamadas a Strava",
+    ["endpoint", "status"],
+)
+STRAVA_WAIT = Histogram(
+    "strava_ratelimit_wait_seconds",
+    "Espera por presupuesto de rate limit antes de llamar a Strava",
+    ["priority"],
+    buckets=(0.001, 0.01, 0.1, 1, 5, 30, 60, 300, 900),
+)
+
+
+class _RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_request_stats: ContextVar[_RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+# --- Base de datos ---
+def instrument_engine(engine, name):
+    """
+    `engine` es un Engine síncrono (para el asíncrono, async_engine.sync_engine).
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        DB_QUERIES.labels(name).inc()
+
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+
+    # SQLAlchemy no tiene evento "antes del checkout": se envuelve la
+    # obtención de conexión del pool (incluye abrir una nueva si hace falta)
+    pool = engine.pool
+    do_get = pool._do_get
+
+    def _timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.labels(name).observe(time.perf_counter() - start)
+
+    pool._do_get = _timed_do_get
+
+
+# --- HTTP ---
+async def metrics_middleware(request, call_next):
+    stats = _RequestStats()
+    token = _request_stats.set(stats)
+    start = time.perf_counter()
+    status = 500
+
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        _request_stats.reset(token)
+
+        route = request.scope.get("route")
+        route = getattr(route, "path", "unmatched")
+        method = request.method
+
+        REQUEST_LATENCY.labels(method, route, str(status)).observe(elapsed)
+        REQUEST_QUERIES.labels(method, route).observe(stats.queries)
+        REQUEST_DB_TIME.labels(method, route).observe(stats.db_time)
+
+        if SLOW_REQUEST_QUERY_THRESHOLD and stats.queries >= SLOW_REQUEST_QUERY_THRESHOLD:
+            print(
+                f"⚠️ {method} {request.url.path}: {stats.queries} queries, "
+                f"{stats.db_time * 1000:.1f} ms en DB, {elapsed * 1000:.1f} ms total"
+            )
+
+
+# --- Strava ---
+def observe_strava(endpoint, status, seconds):
+    STRAVA_LATENCY.labels(endpoint, str(status)).observe(seconds)
+
+
+def observe_strava_wait(priority, seconds):
+    STRAVA_WAIT.labels(priority).observe(seconds)
+
+
+class _StravaRateCollector:
+    def describe(self):
+        # sin esto REGISTRY.register llamaría a collect() mientras
+        # strava_client (que importa este módulo) aún se está cargando
+        return []
+
+    def collect(self):
+        from app.utils.strava_client import rate_limiter
+
+        stats = rate_limiter.stats()
+        limit = GaugeMetricFamily("strava_ratelimit_limit", "Límite de la ventana", labels=["window"])
+        remaining = GaugeMetricFamily("strava_ratelimit_remaining", "Peticiones restantes", labels=["window"])
+        for window, values in stats["windows"].items():
+            limit.add_metric([window], values["limit"])
+            remaining.add_metric([window], values["remaining"])
+        yield limit
+        yield remaining
+
+        waiting = GaugeMetricFamily("strava_ratelimit_waiting", "Llamadas esperando presupuesto", labels=["priority"])
+        deferred = CounterMetricFamily("strava_ratelimit_deferred", "Llamadas aplazadas sin presupuesto", labels=["priority"])
+        for priority, n in stats["waiting"].items():
+            waiting.add_metric([priority], n)
+        for priority, n in stats["deferred"].items():
+            deferred.add_metric([priority], n)
+        yield waiting
+        yield deferred
+
+
+REGISTRY.register(_StravaRateCollector())
+
+
+# --- Caché de celdas ---
+class _CellCacheCollector:
+    def collect(self):
+        from app.utils import cell_cache
+
+        stats = cell_cache.stats()
+        for name in ("hits", "db_hits", "misses", "evictions"):
+            yield CounterMetricFamily(
+                f"cell_cache_{name}",
+                f"Caché polyline -> hexágonos: {name}",
+                value=stats[name],
+            )
+        yield GaugeMetricFamily("cell_cache_entries", "Entradas en memoria", value=stats["entries"])
+        yield GaugeMetricFamily("cell_cache_bytes", "Bytes en memoria", value=stats["bytes"])
+
+
+REGISTRY.register(_CellCacheCollector())
+
+
+def render_metrics():
+    return generate_latest(), CONTENT_TYPE_LATEST
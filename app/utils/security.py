@@ -1,9 +1,35 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
 from jose import jwt
 from app.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# coste de bcrypt: al cambiarlo, los hashes antiguos se rehacen en el login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# bcrypt va en hilos propios para no agotar el threadpool de FastAPI
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# peticiones que pueden esperar turno antes de responder 503
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+)
+
+_password_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash",
+)
+_password_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+
+class PasswordHasherBusy(Exception):
+    pass
 
 
 def hash_password(password: str) -> str:
@@ -14,6 +40,29 @@ def verify_password(password: str, hashed: str) -> bool:
     return pwd_context.verify(password, hashed)
 
 
+async def _run_password_task(fn, *args):
+    # control de admisión: si la cola está llena, fallar rápido
+    if not _password_slots.acquire(blocking=False):
+        raise PasswordHasherBusy()
+
+    try:
+        return await asyncio.wrap_future(_password_executor.submit(fn, *args))
+    finally:
+        _password_slots.release()
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_password_task(pwd_context.hash, password)
+
+
+async def verify_password_async(password: str, hashed: str) -> tuple[bool, str | None]:
+    """
+    Devuelve (válida, nuevo_hash). `nuevo_hash` no es None cuando el hash
+    guardado usa otro coste y hay que reemplazarlo.
+    """
+    return await _run_password_task(pwd_context.verify_and_update, password, hashed)
+
+
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -0,0 +1,254 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+from app.database import SessionLocal
+from app.models import StravaImportJob, User
+from app.utils.strava_client import (
+    PRIORITY_BACKFILL,
+    PRIORITY_INTERACTIVE,
+    StravaRateLimited,
+    ensure_valid_token,
+    get_athlete_activities,
+)
+from app.utils.strava_import import import_strava_page
+
+BACKFILL_WORKERS = int(os.getenv("STRAVA_BACKFILL_WORKERS", "2"))
+BACKFILL_PAGE_SIZE = 200  # máximo que permite Strava
+
+ACTIVE_STATUSES = ("pending", "running")
+
+# un job "running" cuyo locked_at no se ha renovado en este tiempo es de un
+# proceso que murió: se puede volver a reclamar
+BACKFILL_LOCK_TIMEOUT = timedelta(seconds=int(os.getenv("STRAVA_BACKFILL_LOCK_TIMEOUT", "300")))
+
+# Hilos propios: un backfill largo no ocupa el threadpool de FastAPI
+_executor = ThreadPoolExecutor(
+    max_workers=BACKFILL_WORKERS,
+    thread_name_prefix="strava-backfill",
+)
+
+
+def _start_epoch(strava_activity):
+    start = strava_activity.get("start_date")
+    if not start:
+        return None
+    return int(datetime.fromisoformat(start.replace("Z", "+00:00")).timestamp())
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _active_job(db, user_id):
+    return (
+        db.query(StravaImportJob)
+        .filter(
+            StravaImportJob.user_id == user_id,
+            StravaImportJob.status.in_(ACTIVE_STATUSES),
+        )
+        .first()
+    )
+
+
+def create_or_get_job(db, user):
+    """
+    Devuelve (job, creado): el job activo del usuario o uno nuevo que
+    continúa desde el último cursor guardado.
+    """
+    active = _active_job(db, user.id)
+    if active:
+        return active, False
+
+    last = (
+        db.query(StravaImportJob.after_cursor)
+        .filter(StravaImportJob.user_id == user.id)
+        .order_by(StravaImportJob.after_cursor.desc())
+        .first()
+    )
+
+    job = StravaImportJob(
+        user_id=user.id,
+        status="pending",
+        after_cursor=last[0] if last else 0,
+    )
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        # otra petición lo ha creado a la vez (índice único de jobs activos)
+        db.rollback()
+        active = _active_job(db, user.id)
+        if active:
+            return active, False
+        raise
+    db.refresh(job)
+    return job, True
+
+
+def _claim(db, job_id):
+    """
+    Reserva el job para este proceso: un único UPDATE condicional, así que
+    de varios procesos (o réplicas) que lo intenten a la vez solo uno lo
+    consigue. Vale un job pendiente o uno "running" con el lock caducado.
+    """
+    now = _now()
+    claimed = (
+        db.query(StravaImportJob)
+        .filter(
+            StravaImportJob.id == job_id,
+            or_(
+                StravaImportJob.status == "pending",
+                and_(
+                    StravaImportJob.status == "running",
+                    or_(
+                        StravaImportJob.locked_at.is_(None),
+                        StravaImportJob.locked_at < now - BACKFILL_LOCK_TIMEOUT,
+                    ),
+                ),
+            ),
+        )
+        .update({"status": "running", "locked_at": now}, synchronize_session=False)
+    )
+    db.commit()
+    return claimed == 1
+
+
+def _heartbeat(job_id, stop):
+    """
+    Renueva locked_at mientras el job se ejecuta, también durante las
+    esperas del rate limit (el backfill puede esperar sin límite).
+    Sesión propia: la del job puede estar a mitad de una página.
+    """
+    while not stop.wait(BACKFILL_LOCK_TIMEOUT.total_seconds() / 3):
+        db = SessionLocal()
+        try:
+            db.query(StravaImportJob).filter(
+                StravaImportJob.id == job_id,
+                StravaImportJob.status == "running",
+            ).update({"locked_at": _now()}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            print("❌ Strava backfill heartbeat error:", e)
+            db.rollback()
+        finally:
+            db.close()
+
+
+def _check_later(job_id):
+    """
+    El job lo tiene otro proceso: se vuelve a intentar cuando su lock
+    caducaría, por si ese proceso muere sin terminarlo.
+    """
+    timer = threading.Timer(BACKFILL_LOCK_TIMEOUT.total_seconds(), submit_backfill, (job_id,))
+    timer.daemon = True
+    timer.start()
+
+
+def run_backfill(job_id, interactive=False):
+    """
+    `interactive`: el usuario acaba de pedir el import; la primera página
+    va con prioridad interactiva y el resto como backfill (ver el rate
+    limit en strava_client).
+    """
+    db = SessionLocal()
+    stop = threading.Event()
+    try:
+        if not _claim(db, job_id):
+            job = db.get(StravaImportJob, job_id)
+            if job and job.status in ACTIVE_STATUSES:
+                _check_later(job_id)
+            return
+
+        threading.Thread(
+            target=_heartbeat,
+            args=(job_id, stop),
+            name=f"strava-backfill-heartbeat-{job_id}",
+            daemon=True,
+        ).start()
+
+        job = db.get(StravaImportJob, job_id)
+        user = db.get(User, job.user_id)
+
+        while True:
+            # con `after` Strava devuelve las actividades de más antigua a más reciente
+            try:
+                # el refresco del token también gasta presupuesto
+                ensure_valid_token(db, user)
+                activities = get_athlete_activities(
+                    user.strava_access_token,
+                    after=job.after_cursor,
+                    per_page=BACKFILL_PAGE_SIZE,
+                    priority=PRIORITY_INTERACTIVE if interactive and job.pages == 0 else PRIORITY_BACKFILL,
+                )
+            except StravaRateLimited as e:
+                # sin presupuesto: el job se aplaza, no falla. rollback: un
+                # refresco a medias suelta el FOR UPDATE del usuario
+                db.rollback()
+                time.sleep(e.retry_after)
+                continue
+            if not activities:
+                break
+
+            imported, skipped = import_strava_page(db, user, activities)
+
+            epochs = [e for e in map(_start_epoch, activities) if e is not None]
+            # -1: otras actividades con el mismo segundo de inicio entran en la
+            # siguiente página; el control de duplicados las descarta
+            next_cursor = max(epochs, default=job.after_cursor) - 1
+            job.after_cursor = max(next_cursor, job.after_cursor + 1)
+            job.pages += 1
+            job.imported += imported
+            job.skipped += skipped
+
+            # actividades, influencia y cursor en la misma transacción
+            db.commit()
+
+            if len(activities) < BACKFILL_PAGE_SIZE:
+                break
+
+        job.status = "done"
+        job.locked_at = None
+        db.commit()
+
+    except Exception as e:
+        print("❌ Strava backfill error:", e)
+        db.rollback()
+        job = db.get(StravaImportJob, job_id)
+        if job:
+            job.status = "failed"
+            job.error = str(e)
+            job.locked_at = None
+            db.commit()
+    finally:
+        stop.set()
+        db.close()
+
+
+def submit_backfill(job_id, interactive=False):
+    _executor.submit(run_backfill, job_id, interactive)
+
+
+def resume_backfills():
+    """
+    Relanza los jobs que quedaron a medias (p. ej. tras un reinicio). Con
+    varios procesos todos lo intentan: _claim deja pasar solo a uno.
+    """
+    db = SessionLocal()
+    try:
+        job_ids = [
+            row[0]
+            for row in db.query(StravaImportJob.id)
+            .filter(StravaImportJob.status.in_(ACTIVE_STATUSES))
+            .all()
+        ]
+    finally:
+        db.close()
+
+    for job_id in job_ids:
+        submit_backfill(job_id)
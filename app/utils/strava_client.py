@@ -0,0 +1,434 @@
+"""
+Cliente único de Strava: todas las llamadas a la API y a OAuth pasan por
+aquí (sesión keep-alive compartida, timeouts, refresco de tokens y
+reparto del rate limit).
+
+Las URLs base se pueden cambiar por entorno (STRAVA_API_URL,
+STRAVA_OAUTH_URL) para apuntar a un servidor falso en local.
+"""
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.database import SessionLocal
+from app.models import User
+from app.utils.metrics import observe_strava, observe_strava_wait
+from app.utils.user_cache import invalidate_user
+
+STRAVA_API_URL = os.getenv("STRAVA_API_URL", "https://www.strava.com/api/v3")
+STRAVA_OAUTH_URL = os.getenv("STRAVA_OAUTH_URL", "https://www.strava.com/oauth")
+STRAVA_CLIENT_ID = os.getenv("STRAVA_CLIENT_ID")
+STRAVA_CLIENT_SECRET = os.getenv("STRAVA_CLIENT_SECRET")
+STRAVA_REDIRECT_URI = os.getenv("STRAVA_REDIRECT_URI")
+STRAVA_POOL_SIZE = int(os.getenv("STRAVA_POOL_SIZE", "10"))
+
+# (connect, read) en segundos
+REQUEST_TIMEOUT = (5, 30)
+
+# un token se considera caducado este margen antes de su expires_at
+TOKEN_EXPIRY_MARGIN = 60
+# el refresco en segundo plano renueva los que caducan en menos de esto
+TOKEN_REFRESH_AHEAD = int(os.getenv("STRAVA_TOKEN_REFRESH_AHEAD", str(30 * 60)))
+TOKEN_REFRESH_INTERVAL = int(os.getenv("STRAVA_TOKEN_REFRESH_INTERVAL", str(5 * 60)))
+
+# 🔌 Sesión compartida: reutiliza conexiones keep-alive con Strava
+session = requests.Session()
+session.mount(
+    "https://",
+    HTTPAdapter(pool_connections=STRAVA_POOL_SIZE, pool_maxsize=STRAVA_POOL_SIZE),
+)
+session.mount(
+    "http://",
+    HTTPAdapter(pool_connections=STRAVA_POOL_SIZE, pool_maxsize=STRAVA_POOL_SIZE),
+)
+
+
+class StravaAPIError(Exception):
+    def __init__(self, status_code, body):
+        super().__init__(f"Strava API error {status_code}: {body}")
+        self.status_code = status_code
+
+
+class StravaRateLimited(StravaAPIError):
+    """
+    Sin presupuesto de API para esta prioridad (o 429 de Strava).
+    `retry_after`: segundos hasta que tiene sentido reintentar.
+    """
+
+    def __init__(self, retry_after, body="rate limit"):
+        super().__init__(429, body)
+        self.retry_after = retry_after
+
+
+# --- Rate limit ---
+# Prioridades (menor = más urgente)
+PRIORITY_WEBHOOK = 0       # eventos en tiempo real
+PRIORITY_INTERACTIVE = 1   # el usuario está esperando (primera página de un import)
+PRIORITY_BACKFILL = 2      # resto del backfill histórico
+PRIORITY_NAMES = {PRIORITY_WEBHOOK: "webhook", PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKFILL: "backfill"}
+
+# fracción del límite de cada ventana que una prioridad deja para las de encima
+RATE_RESERVE = {
+    PRIORITY_WEBHOOK: 0.0,
+    PRIORITY_INTERACTIVE: float(os.getenv("STRAVA_RESERVE_INTERACTIVE", "0.1")),
+    PRIORITY_BACKFILL: float(os.getenv("STRAVA_RESERVE_BACKFILL", "0.3")),
+}
+# espera máxima por presupuesto antes de rendirse (None = esperar lo que haga falta)
+RATE_MAX_WAIT = {
+    PRIORITY_WEBHOOK: float(os.getenv("STRAVA_MAX_WAIT_WEBHOOK", "5")),
+    PRIORITY_INTERACTIVE: float(os.getenv("STRAVA_MAX_WAIT_INTERACTIVE", "30")),
+    PRIORITY_BACKFILL: None,
+}
+
+# ventanas de Strava: cada 15 minutos (en punto, y cuarto...) y diaria (00:00 UTC).
+# Límites iniciales = los de lectura por defecto; la primera respuesta trae los reales.
+RATE_WINDOWS = {
+    "15min": (15 * 60, int(os.getenv("STRAVA_RATE_LIMIT_15MIN", "100"))),
+    "daily": (24 * 60 * 60, int(os.getenv("STRAVA_RATE_LIMIT_DAILY", "1000"))),
+}
+
+
+def _parse_rate_headers(headers):
+    """
+    {ventana: (límite, uso)} de las cabeceras X-RateLimit-* y
+    X-ReadRateLimit-* (la de lectura es más estricta); por ventana se
+    queda la pareja con menos margen.
+    """
+    windows = {}
+    for prefix in ("X-RateLimit", "X-ReadRateLimit"):
+        limits = headers.get(f"{prefix}-Limit")
+        usage = headers.get(f"{prefix}-Usage")
+        if not limits or not usage:
+            continue
+        try:
+            pairs = zip(RATE_WINDOWS, map(int, limits.split(",")), map(int, usage.split(",")))
+        except ValueError:
+            continue
+        for window, limit, used in pairs:
+            if window not in windows or limit - used < windows[window][0] - windows[window][1]:
+                windows[window] = (limit, used)
+    return windows
+
+
+class _RateLimiter:
+    """
+    Token bucket por ventana (15 minutos y diaria), sincronizado con las
+    cabeceras de cada respuesta: el límite es de toda la aplicación, así
+    que lo que gasten otros procesos aparece en la siguiente sincronización.
+    Entre respuestas se descuenta localmente una petición por llamada.
+
+    Cada prioridad solo gasta mientras quede más de su reserva
+    (RATE_RESERVE) y nunca adelanta a una más urgente que esté esperando.
+    Sin presupuesto se espera (como mucho RATE_MAX_WAIT) en vez de fallar.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._windows = {
+            name: {"period": period, "limit": limit, "used": 0, "id": None}
+            for name, (period, limit) in RATE_WINDOWS.items()
+        }
+        self._waiting = {priority: 0 for priority in PRIORITY_NAMES}
+        self._deferred = {priority: 0 for priority in PRIORITY_NAMES}
+
+    def _roll(self, now):
+        for window in self._windows.values():
+            window_id = int(now // window["period"])
+            if window_id != window["id"]:
+                window["id"], window["used"] = window_id, 0
+
+    def _reset_in(self, now, blocked):
+        return min((now // w["period"] + 1) * w["period"] - now for w in blocked)
+
+    def _blocking(self, priority):
+        """Ventanas en las que `priority` ya no puede gastar."""
+        return [
+            w for w in self._windows.values()
+            if w["limit"] - w["used"] <= RATE_RESERVE[priority] * w["limit"]
+        ]
+
+    def acquire(self, priority):
+        max_wait = RATE_MAX_WAIT[priority]
+        start = time.monotonic()
+
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.time()
+                    self._roll(now)
+                    blocked = self._blocking(priority)
+                    ahead = any(self._waiting[p] for p in PRIORITY_NAMES if p < priority)
+                    if not blocked and not ahead:
+                        for window in self._windows.values():
+                            window["used"] += 1
+                        break
+
+                    wait = self._reset_in(now, blocked) if blocked else 1.0
+                    if max_wait is not None:
+                        left = max_wait - (time.monotonic() - start)
+                        if left <= 0:
+                            self._deferred[priority] += 1
+                            raise StravaRateLimited(wait)
+                        wait = min(wait, left)
+                    self._cond.wait(wait)
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+        observe_strava_wait(PRIORITY_NAMES[priority], time.monotonic() - start)
+
+    def sync(self, headers):
+        windows = _parse_rate_headers(headers)
+        if not windows:
+            return
+
+        with self._cond:
+            self._roll(time.time())
+            for name, (limit, used) in windows.items():
+                window = self._windows[name]
+                window["limit"] = limit
+                # las peticiones propias aún en vuelo no salen en la cabecera
+                window["used"] = max(window["used"], used)
+            self._cond.notify_all()
+
+    def retry_after(self):
+        with self._cond:
+            now = time.time()
+            self._roll(now)
+            blocked = self._blocking(PRIORITY_WEBHOOK)
+            return self._reset_in(now, blocked or self._windows.values())
+
+    def exhausted(self):
+        """Tras un 429: da la ventana de 15 minutos por gastada."""
+        with self._cond:
+            self._roll(time.time())
+            window = self._windows["15min"]
+            window["used"] = max(window["used"], window["limit"])
+
+    def stats(self):
+        with self._cond:
+            self._roll(time.time())
+            return {
+                "windows": {
+                    name: {"limit": w["limit"], "remaining": max(w["limit"] - w["used"], 0)}
+                    for name, w in self._windows.items()
+                },
+                "waiting": {PRIORITY_NAMES[p]: n for p, n in self._waiting.items()},
+                "deferred": {PRIORITY_NAMES[p]: n for p, n in self._deferred.items()},
+            }
+
+
+rate_limiter = _RateLimiter()
+
+
+def _request(endpoint, method, url, priority=PRIORITY_WEBHOOK, **kwargs):
+    """
+    `endpoint`: nombre corto para las métricas (sin ids en la etiqueta).
+    `priority`: clase en el reparto del rate limit (PRIORITY_*); OAuth usa
+    la máxima, porque sin token no sale ninguna otra llamada.
+    """
+    rate_limiter.acquire(priority)
+
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    start = time.perf_counter()
+    try:
+        res = session.request(method, url, **kwargs)
+    except requests.RequestException:
+        observe_strava(endpoint, "error", time.perf_counter() - start)
+        raise
+    observe_strava(endpoint, res.status_code, time.perf_counter() - start)
+    rate_limiter.sync(res.headers)
+
+    if res.status_code == 429:
+        rate_limiter.exhausted()
+        raise StravaRateLimited(rate_limiter.retry_after(), res.text)
+    if res.status_code != 200:
+        raise StravaAPIError(res.status_code, res.text)
+
+    return res.json()
+
+
+def _auth(access_token):
+    return {"Authorization": f"Bearer {access_token}"}
+
+
+# --- OAuth ---
+def authorize_url(state):
+    params = {
+        "client_id": STRAVA_CLIENT_ID,
+        "response_type": "code",
+        "redirect_uri": STRAVA_REDIRECT_URI,
+        "approval_prompt": "force",
+        "scope": "activity:read_all",
+        "state": state,
+    }
+    return f"{STRAVA_OAUTH_URL}/authorize?{urlencode(params, safe=':/')}"
+
+
+def exchange_code(code):
+    return _request(
+        "oauth_token",
+        "POST",
+        f"{STRAVA_OAUTH_URL}/token",
+        data={
+            "client_id": STRAVA_CLIENT_ID,
+            "client_secret": STRAVA_CLIENT_SECRET,
+            "code": code,
+            "grant_type": "authorization_code",
+        },
+    )
+
+
+def _refresh(refresh_token):
+    return _request(
+        "oauth_refresh",
+        "POST",
+        f"{STRAVA_OAUTH_URL}/token",
+        data={
+            "client_id": STRAVA_CLIENT_ID,
+            "client_secret": STRAVA_CLIENT_SECRET,
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+        },
+    )
+
+
+# --- Refresco de tokens (single-flight por usuario) ---
+_refresh_locks: dict[str, threading.Lock] = {}
+_refresh_locks_guard = threading.Lock()
+
+
+def _refresh_lock(user_id):
+    with _refresh_locks_guard:
+        return _refresh_locks.setdefault(user_id, threading.Lock())
+
+
+def _expiring(user, margin):
+    return bool(user.strava_expires_at) and user.strava_expires_at <= int(time.time()) + margin
+
+
+def ensure_valid_token(db, user, margin=TOKEN_EXPIRY_MARGIN):
+    """
+    Garantiza que `user` tiene un access token válido durante `margin`
+    segundos. Solo un refresco por usuario a la vez: el lock cubre los
+    hilos de este proceso y el FOR UPDATE sobre la fila, al resto de
+    procesos. Quien llega tarde recarga la fila y ve el token nuevo.
+    """
+    if not _expiring(user, margin):
+        return
+
+    with _refresh_lock(user.id):
+        user = (
+            db.query(User)
+            .filter(User.id == user.id)
+            .with_for_update()
+            .populate_existing()
+            .one()
+        )
+
+        if not _expiring(user, margin):
+            db.commit()
+            return
+
+        res = _refresh(user.strava_refresh_token)
+        if "access_token" not in res:
+            db.rollback()
+            raise Exception("Failed to refresh Strava token")
+
+        user.strava_access_token = res["access_token"]
+        user.strava_refresh_token = res["refresh_token"]
+        user.strava_expires_at = res["expires_at"]
+
+        db.commit()
+        invalidate_user(user.id)
+
+
+def refresh_expiring_tokens(db, ahead=TOKEN_REFRESH_AHEAD):
+    """Renueva los tokens que caducan en menos de `ahead` segundos."""
+    users = (
+        db.query(User)
+        .filter(
+            User.strava_refresh_token.isnot(None),
+            User.strava_expires_at <= int(time.time()) + ahead,
+        )
+        .all()
+    )
+
+    refreshed = 0
+    for user in users:
+        try:
+            ensure_valid_token(db, user, margin=ahead)
+            refreshed += 1
+        except Exception as e:
+            db.rollback()
+            print("❌ Strava token refresh error:", user.id, e)
+
+    return refreshed
+
+
+_stop = threading.Event()
+_refresher = None
+
+
+def _refresher_loop():
+    while not _stop.is_set():
+        db = SessionLocal()
+        try:
+            refresh_expiring_tokens(db)
+        except Exception as e:
+            print("❌ Strava token refresher error:", e)
+        finally:
+            db.close()
+
+        _stop.wait(TOKEN_REFRESH_INTERVAL)
+
+
+def start_token_refresher():
+    global _refresher
+    _stop.clear()
+    _refresher = threading.Thread(
+        target=_refresher_loop,
+        name="strava-token-refresher",
+        daemon=True,
+    )
+    _refresher.start()
+
+
+def stop_token_refresher():
+    _stop.set()
+    if _refresher:
+        _refresher.join(timeout=10)
+
+
+# --- API ---
+def get_athlete_activities(access_token, after=None, before=None, page=1, per_page=200,
+                           priority=PRIORITY_BACKFILL):
+    params = {"page": page, "per_page": per_page}
+    if after is not None:
+        params["after"] = after
+    if before is not None:
+        params["before"] = before
+
+    return _request(
+        "athlete_activities",
+        "GET",
+        f"{STRAVA_API_URL}/athlete/activities",
+        headers=_auth(access_token),
+        params=params,
+        priority=priority,
+    )
+
+
+def get_activity(access_token, activity_id, priority=PRIORITY_WEBHOOK):
+    return _request(
+        "activity",
+        "GET",
+        f"{STRAVA_API_URL}/activities/{activity_id}",
+        headers=_auth(access_token),
+        priority=priority,
+    )
@@ -0,0 +1,420 @@
+import json
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, case, false, or_, true
+
+from app.database import SessionLocal, insert_for
+from app.models import Activity, StravaEvent, User
+from app.utils.footprints import delete_activity, replace_polyline
+from app.utils.geometry import set_geometry, summary_polyline
+from app.utils.strava_client import StravaAPIError, StravaRateLimited, ensure_valid_token, get_activity
+from app.utils.strava_import import activity_start_date, import_strava_page
+
+EVENT_WORKERS = int(os.getenv("STRAVA_EVENT_WORKERS", "2"))
+EVENT_BATCH_SIZE = int(os.getenv("STRAVA_EVENT_BATCH_SIZE", "20"))
+EVENT_POLL_SECONDS = float(os.getenv("STRAVA_EVENT_POLL_SECONDS", "2"))
+EVENT_MAX_ATTEMPTS = 8
+EVENT_BACKOFF_BASE = 30         # segundos: 30s, 1m, 2m, 4m...
+EVENT_BACKOFF_MAX = 60 * 60
+EVENT_LOCK_TIMEOUT = timedelta(minutes=10)
+
+# errores de Strava que no se arreglan reintentando
+PERMANENT_STATUS_CODES = {401, 403, 404}
+# al actualizar: la actividad ya no es visible (borrada o sin permiso)
+GONE_STATUS_CODES = {403, 404}
+# borrado de una actividad que otro worker está importando: se reintenta
+DELETE_RETRY_SECONDS = 5
+
+_stop = threading.Event()
+_threads: list[threading.Thread] = []
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def enqueue_event(db, payload):
+    """
+    Guarda el evento en la cola. Devuelve False si ya estaba encolado.
+
+    Una actividad puede editarse muchas veces: un "update" repetido
+    reabre el evento existente (se procesa una vez con el estado final
+    de Strava) en vez de descartarse. Si un worker lo está procesando no
+    se toca su estado (otro worker lo cogería a la vez): se marca `rerun`
+    y claim_events lo vuelve a dar cuando ese worker termine.
+    """
+    stmt = insert_for(db)(StravaEvent).values(
+        object_id=payload["object_id"],
+        owner_id=payload["owner_id"],
+        aspect_type=payload["aspect_type"],
+        event_time=payload.get("event_time"),
+        updates=json.dumps(payload.get("updates") or {}),
+        status="pending",
+        attempts=0,
+        next_attempt_at=_now(),
+    )
+    if payload["aspect_type"] == "update":
+        processing = StravaEvent.status == "processing"
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[StravaEvent.object_id, StravaEvent.aspect_type],
+            set_={
+                "event_time": stmt.excluded.event_time,
+                "updates": stmt.excluded.updates,
+                "status": case((processing, StravaEvent.status), else_="pending"),
+                "rerun": case((processing, true()), else_=false()),
+                "attempts": case((processing, StravaEvent.attempts), else_=0),
+                "next_attempt_at": stmt.excluded.next_attempt_at,
+                "last_error": None,
+            },
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(
+            index_elements=[StravaEvent.object_id, StravaEvent.aspect_type],
+        )
+    result = db.execute(stmt)
+    db.commit()
+    return result.rowcount == 1
+
+
+def claim_events(db, limit=EVENT_BATCH_SIZE):
+    """
+    Reserva un lote de eventos listos. En Postgres usa SKIP LOCKED para que
+    varios workers (o procesos) no cojan los mismos eventos.
+    """
+    now = _now()
+    events = (
+        db.query(StravaEvent)
+        .filter(or_(
+            and_(StravaEvent.status == "pending", StravaEvent.next_attempt_at <= now),
+            # eventos de un worker que murió a medias
+            and_(StravaEvent.status == "processing", StravaEvent.locked_at < now - EVENT_LOCK_TIMEOUT),
+            # "update" reabierto mientras otro worker lo procesaba
+            and_(StravaEvent.rerun == true(), StravaEvent.status != "processing"),
+        ))
+        .order_by(StravaEvent.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+    for event in events:
+        if event.rerun:
+            event.rerun = False
+            event.attempts = 0
+        event.status = "processing"
+        event.locked_at = now
+        event.attempts += 1
+    db.commit()
+
+    return events
+
+
+def _retry_later(event, error):
+    event.last_error = str(error)
+    event.locked_at = None
+    if event.attempts >= EVENT_MAX_ATTEMPTS:
+        event.status = "failed"
+        return
+
+    delay = min(EVENT_BACKOFF_BASE * 2 ** (event.attempts - 1), EVENT_BACKOFF_MAX)
+    event.status = "pending"
+    event.next_attempt_at = _now() + timedelta(seconds=delay)
+
+
+def _finish(event, note=None):
+    event.status = "done"
+    event.locked_at = None
+    event.last_error = note
+
+
+def _defer(event, error):
+    """Sin presupuesto de API: vuelve a la cola sin gastar un intento."""
+    event.status = "pending"
+    event.locked_at = None
+    event.last_error = str(error)
+    event.attempts = max(event.attempts - 1, 0)
+    event.next_attempt_at = _now() + timedelta(seconds=error.retry_after)
+
+
+def _postpone(event, note, seconds):
+    """Vuelve a la cola en `seconds` sin gastar un intento."""
+    event.status = "pending"
+    event.locked_at = None
+    event.last_error = note
+    event.attempts = max(event.attempts - 1, 0)
+    event.next_attempt_at = _now() + timedelta(seconds=seconds)
+
+
+def _fail(event, error):
+    event.status = "failed"
+    event.locked_at = None
+    event.last_error = str(error)
+
+
+def _process_deletes(db, events):
+    """
+    Borrados: no hace falta token ni llamar a Strava, se resta el
+    footprint de la actividad y se borra. Un commit por evento.
+
+    Si la actividad no está pero hay un create/update suyo en cola o en
+    curso, otro worker puede estar importándola: el borrado se reintenta
+    hasta que ese evento termine. Los imports que empiecen después ya ven
+    el evento "delete" y no la importan (ver import_strava_page).
+    """
+    object_ids = [event.object_id for event in events]
+    activities = {
+        activity.strava_activity_id: activity
+        for activity in db.query(Activity)
+        .filter(Activity.strava_activity_id.in_(object_ids))
+        .all()
+    }
+    in_flight = {
+        row[0]
+        for row in db.query(StravaEvent.object_id)
+        .filter(
+            StravaEvent.object_id.in_(object_ids),
+            StravaEvent.aspect_type != "delete",
+            or_(StravaEvent.status.in_(["pending", "processing"]), StravaEvent.rerun == true()),
+        )
+        .all()
+    } if object_ids else set()
+
+    for event in events:
+        activity = activities.get(event.object_id)
+        if activity is None:
+            if event.object_id in in_flight:
+                _postpone(event, "waiting for import", DELETE_RETRY_SECONDS)
+            else:
+                _finish(event, "not imported")
+            db.commit()
+            continue
+        try:
+            delete_activity(db, activity)
+            _finish(event)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            _retry_later(event, e)
+            db.commit()
+
+
+def _made_private(event):
+    # Strava manda los cambios como texto: {"private": "true"}
+    try:
+        updates = json.loads(event.updates or "{}")
+    except ValueError:
+        return False
+    return str(updates.get("private", "")).lower() == "true"
+
+
+def _process_update(db, user, event, stored):
+    """
+    Procesa un evento "update". Devuelve la actividad de Strava si no la
+    teníamos y hay que importarla; None si ya queda resuelto.
+
+    Con el scope activity:read_all una actividad privada sigue siendo
+    visible (200), así que la privacidad se mira en el propio evento y en
+    activity["private"]: las privadas dejan de contar para el territorio.
+    """
+    if _made_private(event):
+        if stored is not None:
+            delete_activity(db, stored)
+        _finish(event, "private")
+        return None
+
+    try:
+        activity = get_activity(user.strava_access_token, event.object_id)
+    except StravaRateLimited:
+        raise
+    except StravaAPIError as e:
+        if e.status_code in GONE_STATUS_CODES:
+            # borrada o ya no visible: se resta si la teníamos
+            if stored is not None:
+                delete_activity(db, stored)
+            _finish(event, "gone")
+        elif e.status_code in PERMANENT_STATUS_CODES:
+            _fail(event, e)
+        else:
+            _retry_later(event, e)
+        return None
+
+    if activity.get("private"):
+        if stored is not None:
+            delete_activity(db, stored)
+        _finish(event, "private")
+        return None
+
+    if stored is None:
+        return activity
+
+    polyline = activity.get("map", {}).get("summary_polyline")
+    detail = activity.get("map", {}).get("polyline")
+    if polyline == summary_polyline(stored):
+        # importada desde el listado (sin track completo): se completa ahora
+        if detail and stored.geometry.detail is None:
+            set_geometry(stored, polyline, detail)
+        _finish(event, "no changes")
+        return None
+
+    replace_polyline(db, stored, polyline, activity_start_date(activity), detail)
+    _finish(event)
+    return None
+
+
+def process_events(db, events):
+    """
+    Procesa un lote: un refresco de token por atleta y un único
+    import (duplicados + upsert de influencia) por atleta, con un commit
+    por atleta para que un fallo no arrastre al resto del lote.
+
+    Borrados y ediciones restan el footprint guardado de la actividad
+    (ver app/utils/footprints.py), así que los totales vuelven exactamente
+    a donde estaban. Sin presupuesto de API (rate limit) los eventos se
+    aplazan sin gastar intentos.
+    """
+    _process_deletes(db, [event for event in events if event.aspect_type == "delete"])
+    events = [event for event in events if event.aspect_type != "delete"]
+
+    by_owner = defaultdict(list)
+    for event in events:
+        by_owner[event.owner_id].append(event)
+
+    object_ids = [event.object_id for event in events]
+    stored = {
+        activity.strava_activity_id: activity
+        for activity in db.query(Activity)
+        .filter(Activity.strava_activity_id.in_(object_ids))
+        .all()
+    }
+
+    users = {
+        user.strava_athlete_id: user
+        for user in db.query(User)
+        .filter(User.strava_athlete_id.in_(list(by_owner)))
+        .all()
+    }
+
+    # tras quedarse sin presupuesto, el resto del lote se aplaza sin llamar
+    rate_limited = None
+
+    for owner_id, owner_events in by_owner.items():
+        user = users.get(owner_id)
+        if not user:
+            for event in owner_events:
+                _finish(event, "user not found")
+            db.commit()
+            continue
+
+        try:
+            if rate_limited:
+                raise rate_limited
+            ensure_valid_token(db, user)
+        except StravaRateLimited as e:
+            rate_limited = e
+            for event in owner_events:
+                _defer(event, e)
+            db.commit()
+            continue
+        except Exception as e:
+            for event in owner_events:
+                _retry_later(event, e)
+            db.commit()
+            continue
+
+        fetched = []
+        for event in owner_events:
+            if rate_limited:
+                _defer(event, rate_limited)
+                continue
+            if event.aspect_type == "update":
+                try:
+                    activity = _process_update(db, user, event, stored.get(event.object_id))
+                    if activity is not None:
+                        fetched.append((event, activity))
+                    db.commit()
+                except StravaRateLimited as e:
+                    rate_limited = e
+                    _defer(event, e)
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    _retry_later(event, e)
+                    db.commit()
+                continue
+
+            if event.object_id in stored:
+                _finish(event, "already imported")
+                continue
+            try:
+                fetched.append((event, get_activity(user.strava_access_token, event.object_id)))
+            except StravaRateLimited as e:
+                rate_limited = e
+                _defer(event, e)
+            except StravaAPIError as e:
+                if e.status_code in PERMANENT_STATUS_CODES:
+                    _fail(event, e)
+                else:
+                    _retry_later(event, e)
+            except Exception as e:
+                _retry_later(event, e)
+
+        db.commit()
+        if not fetched:
+            continue
+
+        try:
+            import_strava_page(db, user, [activity for _, activity in fetched])
+            for event, activity in fetched:
+                if activity.get("private"):
+                    _finish(event, "private")
+                elif activity.get("map", {}).get("summary_polyline"):
+                    _finish(event)
+                else:
+                    _finish(event, "no polyline")
+            # actividades, influencia y estado de los eventos juntos
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            for event, _ in fetched:
+                _retry_later(event, e)
+            db.commit()
+
+
+def _worker_loop():
+    while not _stop.is_set():
+        db = SessionLocal()
+        try:
+            events = claim_events(db)
+            if events:
+                process_events(db, events)
+        except Exception as e:
+            print("❌ Strava event worker error:", e)
+            db.rollback()
+            events = None
+        finally:
+            db.close()
+
+        if not events:
+            _stop.wait(EVENT_POLL_SECONDS)
+
+
+def start_event_workers():
+    _stop.clear()
+    for i in range(EVENT_WORKERS):
+        thread = threading.Thread(
+            target=_worker_loop,
+            name=f"strava-events-{i}",
+            daemon=True,
+        )
+        thread.start()
+        _threads.append(thread)
+
+
+def stop_event_workers():
+    _stop.set()
+    for thread in _threads:
+        thread.join(timeout=10)
+    _threads.clear()
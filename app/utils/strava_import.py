@@ -1,59 +1,116 @@
-from collections import Counter
-from app.models import Activity, TerritoryInfluence
-from app.utils.geo import polyline_to_h3
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
 
+from app.database import insert_for
+from app.models import Activity, StravaEvent
+from app.utils.cell_cache import hexes_many
+from app.utils.footprints import record_footprints
+from app.utils.geometry import geometry_row, record_geometries
+from app.utils.influence_buckets import day_number
+from app.utils.territory_ingest import apply_influence
+from app.utils.user_stats import record_activities
 
-def process_strava_activity(db, user, strava_activity, influence_cache):
-    polyline = strava_activity.get("map", {}).get("summary_polyline")
-    if not polyline:
-        return False
 
-    # evitar duplicados de actividad
-    existing = (
-        db.query(Activity)
-        .filter(Activity.strava_activity_id == strava_activity["id"])
-        .first()
-    )
-    if existing:
-        return False
-
-    # guardar actividad
-    activity = Activity(
-        user_id=user.id,
-        strava_activity_id=strava_activity["id"],
-        polyline=polyline,
-    )
-    db.add(activity)
+def activity_start_date(strava_activity):
+    start = strava_activity.get("start_date")
+    if not start:
+        return None
+    return datetime.fromisoformat(start.replace("Z", "+00:00"))
+
+
+def import_strava_page(db, user, strava_activities):
+    """
+    Importa una página de actividades de Strava.
 
-    hexes = polyline_to_h3(polyline)
-    hex_counter = Counter(hexes)
+    Las actividades se insertan con un único
+    INSERT ... ON CONFLICT (strava_activity_id) DO NOTHING RETURNING, así
+    que si la misma actividad llega a la vez por el webhook y por el
+    backfill solo una transacción la importa (y suma su influencia); la
+    otra la cuenta como saltada. La consulta previa solo evita decodificar
+    polylines que ya están guardadas.
 
-    for hex_id, count in hex_counter.items():
-        key = (hex_id, user.id)
+    No se importan las actividades privadas (con el scope activity:read_all
+    Strava también las devuelve) ni las que ya tienen un evento "delete" en
+    la cola: si el borrado llegó antes de que terminara el import, el
+    evento hace de lápida.
 
-        if key in influence_cache:
-            influence_cache[key].influence += count
+    La influencia de todas las actividades nuevas se aplica en un único
+    upsert y cada actividad guarda su footprint para poder restarla después.
+    El recorrido va a activity_geometry: el resumen y, si viene (actividad
+    detallada, p. ej. desde el webhook), el track completo.
+    Devuelve (importadas, saltadas). No hace commit.
+    """
+    ids = [act["id"] for act in strava_activities]
+    existing = {
+        row[0]
+        for row in db.query(Activity.strava_activity_id)
+        .filter(Activity.strava_activity_id.in_(ids))
+        .all()
+    } if ids else set()
+    deleted = {
+        row[0]
+        for row in db.query(StravaEvent.object_id)
+        .filter(StravaEvent.aspect_type == "delete", StravaEvent.object_id.in_(ids))
+        .all()
+    } if ids else set()
+
+    candidates = {}
+    tracks = {}
+    for act in strava_activities:
+        polyline = act.get("map", {}).get("summary_polyline")
+        if not polyline or act.get("private") or act["id"] in existing | deleted or act["id"] in candidates:
             continue
+        candidates[act["id"]] = {
+            "id": str(uuid.uuid4()),
+            "user_id": user.id,
+            "strava_activity_id": act["id"],
+            "start_date": activity_start_date(act) or datetime.now(timezone.utc),
+            "created_at": datetime.now(timezone.utc),
+        }
+        tracks[act["id"]] = (polyline, act["map"].get("polyline"))
+
+    if not candidates:
+        return 0, len(strava_activities)
+
+    # guardar actividades: solo las que no haya insertado otra transacción
+    stmt = (
+        insert_for(db)(Activity)
+        .values(list(candidates.values()))
+        .on_conflict_do_nothing(index_elements=[Activity.strava_activity_id])
+        .returning(Activity.strava_activity_id)
+    )
+    inserted = [strava_id for (strava_id,) in db.execute(stmt)]
+
+    hex_counter = Counter()
+    by_day = defaultdict(Counter)
+    footprints = []
+    geometries = []
+
+    # toda la página en una sola consulta a la caché
+    page_hexes = hexes_many([tracks[strava_id][0] for strava_id in inserted], db)
+
+    for strava_id, hexes in zip(inserted, page_hexes):
+        if isinstance(hexes, Exception):
+            raise hexes
+        row = candidates[strava_id]
+        summary, detail = tracks[strava_id]
+        geometries.append(geometry_row(row["id"], summary, detail))
+
+        day = day_number(row["start_date"])
+        hex_counter.update(hexes)
+        by_day[day].update(hexes)
+        if hexes:
+            footprints.append((row["id"], hexes, day))
+
+    record_geometries(db, geometries)
+    apply_influence(db, user.id, hex_counter, by_day)
+    record_footprints(db, footprints)
+    record_activities(db, user.id, len(inserted))
+
+    return len(inserted), len(strava_activities) - len(inserted)
+
 
-        influence = (
-            db.query(TerritoryInfluence)
-            .filter_by(
-                territory_id=hex_id,
-                user_id=user.id,
-            )
-            .first()
-        )
-
-        if influence:
-            influence.influence += count
-            influence_cache[key] = influence
-        else:
-            influence = TerritoryInfluence(
-                territory_id=hex_id,
-                user_id=user.id,
-                influence=count,
-            )
-            db.add(influence)
-            influence_cache[key] = influence
-
-    return True
+def process_strava_activity(db, user, strava_activity):
+    imported, _ = import_strava_page(db, user, [strava_activity])
+    return imported == 1
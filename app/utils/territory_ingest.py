@@ -0,0 +1,255 @@
+from collections import Counter
+from collections.abc import Mapping
+
+import h3
+from sqlalchemy import text
+
+from app.database import insert_for
+from app.models import TerritoryInfluence, TerritoryInfluenceBucket, TerritoryInfluenceRollup
+from app.utils.geo import H3_RESOLUTION, MAP_RESOLUTIONS, ROLLUP_RESOLUTIONS, parent_counts
+from app.utils.influence_buckets import bucket_day, day_number
+from app.utils.leaderboard import record_region_owners
+from app.utils.territory_owner import mark_map_changed, refresh_owners
+from app.utils.user_keys import user_key
+from app.utils.user_stats import record_influence
+
+# Postgres admite como mucho 65535 parámetros por sentencia (hasta 5 por fila)
+UPSERT_CHUNK_SIZE = 5000
+
+# por debajo de esto una fila de influencia se considera vacía y se borra
+INFLUENCE_EPSILON = 1e-9
+
+
+def _upsert_increments(db, table, rows, key_columns):
+    insert = insert_for(db)
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        stmt = insert(table).values(rows[start:start + UPSERT_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={"influence": table.influence + stmt.excluded.influence},
+        )
+        db.execute(stmt)
+
+
+def _prune(db, table, key, cells, *filters):
+    """
+    Borra las filas del usuario que se han quedado sin influencia tras una
+    resta. Devuelve cuántas.
+    """
+    cells = sorted(cells)
+    deleted = 0
+    for start in range(0, len(cells), UPSERT_CHUNK_SIZE):
+        deleted += (
+            db.query(table)
+            .filter(
+                *filters,
+                table.user_key == key,
+                table.territory_id.in_(cells[start:start + UPSERT_CHUNK_SIZE]),
+                table.influence <= INFLUENCE_EPSILON,
+            )
+            .delete(synchronize_session=False)
+        )
+    return deleted
+
+
+def _lock_cells(db, counts):
+    """
+    Serializa los ingests concurrentes que tocan los mismos hexágonos (o
+    sus padres en los rollups): advisory locks de transacción de Postgres,
+    uno por hexágono y pedidos en orden, así que no hay interbloqueos.
+
+    Los incrementos ya son atómicos (ON CONFLICT DO UPDATE); lo que
+    protege el lock es lo que se lee y se vuelve a escribir en la misma
+    transacción: los dueños, las celdas nuevas del usuario y region_stats.
+    SQLite ya serializa las escrituras: no hace nada.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+
+    cells = {h3.str_to_int(hex_id) for hex_id in counts}
+    for res in ROLLUP_RESOLUTIONS:
+        cells.update(h3.str_to_int(parent) for parent in parent_counts(counts, res))
+
+    cells = sorted(cells)
+    for start in range(0, len(cells), UPSERT_CHUNK_SIZE):
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(k) FROM unnest(CAST(:keys AS bigint[])) AS k ORDER BY k"),
+            {"keys": cells[start:start + UPSERT_CHUNK_SIZE]},
+        )
+
+
+def _existing_cells(db, key, cells):
+    """Hexágonos (enteros) de `cells` en los que el usuario ya tenía influencia."""
+    cells = sorted(cells)
+    existing = set()
+    for start in range(0, len(cells), UPSERT_CHUNK_SIZE):
+        chunk = cells[start:start + UPSERT_CHUNK_SIZE]
+        existing.update(
+            row[0]
+            for row in db.query(TerritoryInfluence.territory_id).filter(
+                TerritoryInfluence.user_key == key,
+                TerritoryInfluence.territory_id.in_(chunk),
+            )
+        )
+    return existing
+
+
+def _compacted(by_day):
+    """
+    Al sumar, cada día va directamente al bucket en el que lo dejaría
+    compact_buckets (semanal, o ninguno si pasó la retención): así
+    footprints._bucket_day encuentra lo mismo al restar.
+    """
+    today = day_number()
+    merged = {}
+    for day, counts in by_day.items():
+        target = bucket_day(day, today)
+        if target is None:
+            continue
+        if target in merged:
+            merged[target] = Counter(merged[target])
+            merged[target].update(counts)
+        else:
+            merged[target] = counts
+    return merged
+
+
+def _record_buckets(db, key, by_day, removing):
+    """Suma (o resta) la influencia en los buckets diarios de cada resolución."""
+    table = TerritoryInfluenceBucket
+    rows = []
+    for day, counts in by_day.items():
+        for res in (H3_RESOLUTION, *ROLLUP_RESOLUTIONS):
+            level_counts = counts if res == H3_RESOLUTION else parent_counts(counts, res)
+            rows.extend(
+                {
+                    "resolution": res,
+                    "territory_id": h3.str_to_int(hex_id),
+                    "day": day,
+                    "user_key": key,
+                    "influence": count,
+                }
+                for hex_id, count in level_counts.items()
+            )
+
+    _upsert_increments(
+        db,
+        table,
+        rows,
+        [table.resolution, table.territory_id, table.day, table.user_key],
+    )
+
+    if removing:
+        for day in by_day:
+            for res in (H3_RESOLUTION, *ROLLUP_RESOLUTIONS):
+                _prune(
+                    db,
+                    table,
+                    key,
+                    {r["territory_id"] for r in rows if r["day"] == day and r["resolution"] == res},
+                    table.resolution == res,
+                    table.day == day,
+                )
+
+
+def _apply(db, user_id, counts, by_day, removing):
+    """
+    Aplica un delta de influencia (todo positivo o, al restar, todo
+    negativo) a todas las tablas derivadas. Ver apply_influence.
+    """
+    key = user_key(db, user_id)
+    _lock_cells(db, counts)
+    int_counts = {h3.str_to_int(hex_id): count for hex_id, count in counts.items()}
+
+    if removing:
+        hexes_delta = 0
+    else:
+        hexes_delta = len(counts) - len(_existing_cells(db, key, int_counts.keys()))
+
+    _upsert_increments(
+        db,
+        TerritoryInfluence,
+        [
+            {"territory_id": hex_id, "user_key": key, "influence": count}
+            for hex_id, count in int_counts.items()
+        ],
+        [TerritoryInfluence.territory_id, TerritoryInfluence.user_key],
+    )
+    if removing:
+        hexes_delta = -_prune(db, TerritoryInfluence, key, int_counts.keys())
+
+    owner_changes = refresh_owners(db, counts.keys())
+    record_influence(db, user_id, hexes_delta, sum(counts.values()), owner_changes)
+    record_region_owners(db, owner_changes)
+
+    for res in ROLLUP_RESOLUTIONS:
+        table = TerritoryInfluenceRollup
+        parents = parent_counts(counts, res)
+        int_parents = {h3.str_to_int(parent): count for parent, count in parents.items()}
+        _upsert_increments(
+            db,
+            table,
+            [
+                {
+                    "resolution": res,
+                    "territory_id": parent,
+                    "user_key": key,
+                    "influence": count,
+                }
+                for parent, count in int_parents.items()
+            ],
+            [table.resolution, table.territory_id, table.user_key],
+        )
+        if removing:
+            _prune(db, table, key, int_parents.keys(), table.resolution == res)
+        refresh_owners(db, parents.keys(), resolution=res)
+
+    if by_day is None:
+        by_day = {day_number(): counts}
+    if not removing:
+        by_day = _compacted(by_day)
+    _record_buckets(db, key, by_day, removing)
+
+    # la versión se incrementa después del commit, fuera de esta transacción
+    mark_map_changed(db, MAP_RESOLUTIONS)
+
+    return len(counts)
+
+
+def apply_influence(db, user_id, cells, by_day=None):
+    """
+    Suma la influencia de un usuario en un conjunto de hexágonos H3.
+
+    `cells` puede ser un set de hexágonos (+1 por hexágono) o un mapping
+    hex -> incremento, con los hexágonos en formato string; se guardan
+    como enteros (h3.str_to_int). Todo se escribe con un único
+    INSERT ... ON CONFLICT (territory_id, user_key) DO UPDATE por bloque,
+    así que el coste en round trips no depende del número de hexágonos.
+    Después actualiza los rollups de ROLLUP_RESOLUTIONS, los dueños
+    (solo de los hexágonos tocados), user_stats y region_stats.
+
+    `by_day` (día -> mapping hex -> incremento) reparte la misma influencia
+    en los buckets diarios; por defecto todo cuenta para hoy.
+    No hace commit: el llamador decide la transacción.
+    """
+    counts = cells if isinstance(cells, Mapping) else Counter(cells)
+    if not counts:
+        return 0
+
+    return _apply(db, user_id, counts, by_day, removing=False)
+
+
+def remove_influence(db, user_id, counts, day):
+    """
+    Resta exactamente lo que sumó una actividad (su footprint): mismo
+    upsert en bloque con incrementos negativos y después se borran las
+    filas que quedan a cero. Los dueños y las estadísticas se recalculan
+    solo para esos hexágonos; los que se quedan sin influencia conservan
+    su fila en territory_owner con dueño NULL.
+    `day` es el bucket diario en el que se sumó. No hace commit.
+    """
+    if not counts:
+        return 0
+
+    negative = {hex_id: -count for hex_id, count in counts.items()}
+    return _apply(db, user_id, negative, {day: negative} if day is not None else {}, removing=True)
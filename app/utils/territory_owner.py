@@ -0,0 +1,343 @@
+from collections import defaultdict
+
+import h3
+from sqlalchemy import event, func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.database import insert_for
+from app.models import (
+    MapVersion,
+    TerritoryInfluence,
+    TerritoryInfluenceRollup,
+    TerritoryOwner,
+    TerritoryOwnerRollup,
+    UserKey,
+)
+from app.utils.geo import H3_RESOLUTION, ROLLUP_RESOLUTIONS, parent_counts
+
+# tamaño de los IN (...) y de los inserts en bloque
+CHUNK_SIZE = 5000
+
+# clave de Session.info con las resoluciones a incrementar tras el commit
+_MAP_CHANGED = "map_versions_changed"
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class _Level:
+    """
+    Tablas de influencia / dueño de una resolución: la base
+    (territory_influence / territory_owner) o una agregada (*_rollup).
+    """
+
+    def __init__(self, resolution):
+        self.resolution = resolution
+        self.is_base = resolution == H3_RESOLUTION
+        self.influence = TerritoryInfluence if self.is_base else TerritoryInfluenceRollup
+        self.owner = TerritoryOwner if self.is_base else TerritoryOwnerRollup
+
+    def filter(self, table):
+        if self.is_base:
+            return ()
+        return (table.resolution == self.resolution,)
+
+    def key_columns(self, table):
+        if self.is_base:
+            return [table.territory_id]
+        return [table.resolution, table.territory_id]
+
+    def row(self, values):
+        if not self.is_base:
+            values["resolution"] = self.resolution
+        return values
+
+    def influence_rows(self, db):
+        """
+        (territory_id, user_id, influence) de la tabla de influencia, con las
+        claves enteras ya unidas a user_keys (el UUID decide los empates).
+        """
+        table = self.influence
+        return (
+            db.query(table.territory_id, UserKey.user_id, table.influence)
+            .join(UserKey, UserKey.id == table.user_key)
+            .filter(*self.filter(table))
+            .order_by(table.territory_id)
+        )
+
+
+def _level(resolution):
+    return _Level(H3_RESOLUTION if resolution is None else resolution)
+
+
+def _rank(rows):
+    """
+    Orden de propiedad: más influencia primero; en caso de empate gana el
+    user_id menor, para que el resultado sea determinista.
+    """
+    return sorted(rows, key=lambda r: (-r[1], r[0]))
+
+
+def owner_from_candidates(candidates):
+    """
+    `candidates`: lista de (user_id, influence) de un hexágono.
+    Devuelve (owner, influence, margin).
+    """
+    ranked = _rank([c for c in candidates if c[1] and c[1] > 0])
+    if not ranked:
+        return None, 0.0, 0.0
+
+    owner, top = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    return owner, top, top - runner_up
+
+
+def iter_owners(rows):
+    """
+    `rows` ordenadas por territory_id (entero): (territory_id, user_id, influence).
+    Genera (territory_id, owner, influence, margin) por hexágono, con el
+    hexágono ya en formato string. También lo usa GET /territories para
+    las vistas por periodo.
+    """
+    current = None
+    candidates = []
+    for territory_id, user_id, influence in rows:
+        if territory_id != current:
+            if current is not None:
+                yield (h3.int_to_str(current), *owner_from_candidates(candidates))
+            current = territory_id
+            candidates = []
+        candidates.append((user_id, influence))
+
+    if current is not None:
+        yield (h3.int_to_str(current), *owner_from_candidates(candidates))
+
+
+def _upsert_owners(db, level, owners):
+    insert = insert_for(db)
+    table = level.owner
+    for chunk in _chunks(owners):
+        stmt = insert(table).values([
+            level.row({
+                "territory_id": territory_id,
+                "user_id": owner,
+                "influence": influence,
+                "margin": margin,
+            })
+            for territory_id, owner, influence, margin in chunk
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=level.key_columns(table),
+            set_={
+                "user_id": stmt.excluded.user_id,
+                "influence": stmt.excluded.influence,
+                "margin": stmt.excluded.margin,
+                # onupdate no se aplica en ON CONFLICT DO UPDATE
+                "updated_at": func.now(),
+            },
+        )
+        db.execute(stmt)
+
+
+def bump_map_versions(db, resolutions):
+    """
+    Incrementa la versión del mapa de cada resolución, siempre en el mismo
+    orden. No hace commit: lo normal es no llamarla directamente sino
+    apuntar el cambio con mark_map_changed.
+    """
+    insert = insert_for(db)
+    for resolution in sorted(resolutions):
+        stmt = insert(MapVersion).values(resolution=resolution, version=1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[MapVersion.resolution],
+            set_={"version": MapVersion.version + 1},
+        )
+        db.execute(stmt)
+
+
+def mark_map_changed(db, resolutions):
+    """
+    Apunta que el mapa de esas resoluciones cambió en la transacción de `db`.
+    Las versiones se incrementan justo después de su commit, en una
+    transacción propia (ver _bump_after_commit); si hay rollback se olvidan.
+    """
+    db.info.setdefault(_MAP_CHANGED, set()).update(resolutions)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_after_commit(session):
+    resolutions = session.info.pop(_MAP_CHANGED, None)
+    if not resolutions:
+        return
+
+    # transacción corta y aparte: los ingests no se serializan en las filas
+    # de map_version. Va después del commit de los datos, así nadie puede
+    # guardar la versión nueva con el mapa viejo.
+    try:
+        with Session(bind=session.get_bind()) as bump:
+            bump_map_versions(bump, resolutions)
+            bump.commit()
+    except SQLAlchemyError as e:
+        # los datos ya están guardados: no se propaga (el que llamó
+        # reintentaría un ingest que ya se aplicó)
+        print(f"⚠️ No se pudo incrementar map_version {sorted(resolutions)}: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_map_changes(session):
+    session.info.pop(_MAP_CHANGED, None)
+
+
+def refresh_owners(db, cells, resolution=None):
+    """
+    Recalcula el dueño solo de los hexágonos indicados. Se llama desde el
+    ingest, dentro de su transacción.
+
+    Devuelve los cambios de dueño: lista de (territory_id, antes, después).
+    """
+    level = _level(resolution)
+    table = level.influence
+    owner_table = level.owner
+
+    owners = []
+    previous = {}
+    for chunk in _chunks(sorted(cells)):
+        previous.update(
+            db.query(owner_table.territory_id, owner_table.user_id)
+            .filter(*level.filter(owner_table), owner_table.territory_id.in_(chunk))
+            .all()
+        )
+        rows = (
+            level.influence_rows(db)
+            .filter(table.territory_id.in_([h3.str_to_int(cell) for cell in chunk]))
+            .all()
+        )
+        seen = set()
+        for owner in iter_owners(rows):
+            seen.add(owner[0])
+            owners.append(owner)
+        # hexágonos sin ninguna influencia: quedan sin dueño
+        owners.extend((cell, None, 0.0, 0.0) for cell in chunk if cell not in seen)
+
+    _upsert_owners(db, level, owners)
+
+    return [
+        (territory_id, previous.get(territory_id), owner)
+        for territory_id, owner, _, _ in owners
+        if previous.get(territory_id) != owner
+    ]
+
+
+def _stream_influence(db, level):
+    return level.influence_rows(db).execution_options(yield_per=CHUNK_SIZE)
+
+
+def rebuild_rollups(db):
+    """
+    Recalcula territory_influence_rollup agregando territory_influence
+    a cada resolución de ROLLUP_RESOLUTIONS.
+    """
+    db.query(TerritoryInfluenceRollup).delete()
+
+    # índice (user_key, territory_id)
+    rows = (
+        db.query(
+            TerritoryInfluence.territory_id,
+            TerritoryInfluence.user_key,
+            TerritoryInfluence.influence,
+        )
+        .order_by(TerritoryInfluence.user_key)
+        .execution_options(yield_per=CHUNK_SIZE)
+    )
+
+    # agregado por usuario: la memoria no crece con el total de filas
+    def flush(key, counts):
+        insert = insert_for(db)
+        for res in ROLLUP_RESOLUTIONS:
+            parents = parent_counts(counts, res)
+            for chunk in _chunks(parents.items()):
+                db.execute(insert(TerritoryInfluenceRollup).values([
+                    {
+                        "resolution": res,
+                        "territory_id": h3.str_to_int(parent),
+                        "user_key": key,
+                        "influence": influence,
+                    }
+                    for parent, influence in chunk
+                ]))
+
+    current, counts = None, defaultdict(float)
+    for territory_id, key, influence in rows:
+        if key != current:
+            if current is not None:
+                flush(current, counts)
+            current, counts = key, defaultdict(float)
+        counts[h3.int_to_str(territory_id)] += influence or 0
+
+    if current is not None:
+        flush(current, counts)
+
+
+def rebuild_territory_owners(db):
+    """
+    Recalcula desde cero los rollups y las tablas de dueños de todas las
+    resoluciones a partir de territory_influence.
+    """
+    rebuild_rollups(db)
+
+    total = 0
+    for resolution in (H3_RESOLUTION, *ROLLUP_RESOLUTIONS):
+        level = _level(resolution)
+        db.query(level.owner).filter(*level.filter(level.owner)).delete()
+
+        batch = []
+        for owner in iter_owners(_stream_influence(db, level)):
+            batch.append(owner)
+            if len(batch) >= CHUNK_SIZE:
+                _upsert_owners(db, level, batch)
+                total += len(batch)
+                batch = []
+
+        _upsert_owners(db, level, batch)
+        total += len(batch)
+
+    mark_map_changed(db, (H3_RESOLUTION, *ROLLUP_RESOLUTIONS))
+    db.commit()
+    return total
+
+
+def check_territory_owners(db, resolution=None):
+    """
+    Compara la tabla de dueños de una resolución con lo que saldría de su
+    tabla de influencia. Devuelve las diferencias (territory_id, esperado, guardado).
+    """
+    level = _level(resolution)
+    owner_table = level.owner
+
+    stored = {
+        row.territory_id: (row.user_id, row.influence, row.margin)
+        for row in db.query(
+            owner_table.territory_id,
+            owner_table.user_id,
+            owner_table.influence,
+            owner_table.margin,
+        ).filter(*level.filter(owner_table), owner_table.user_id.isnot(None))
+    }
+
+    mismatches = []
+    for territory_id, owner, influence, margin in iter_owners(_stream_influence(db, level)):
+        expected = (owner, influence, margin)
+        actual = stored.pop(territory_id, None)
+        if owner is None and actual is None:
+            continue
+        if actual != expected:
+            mismatches.append((territory_id, expected, actual))
+
+    # dueños guardados para hexágonos que ya no tienen influencia
+    mismatches.extend((territory_id, None, actual) for territory_id, actual in stored.items())
+
+    return mismatches
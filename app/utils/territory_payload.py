@@ -0,0 +1,125 @@
+"""
+Codificación columnar del mapa de territorios (GET /territories).
+
+En vez de repetir por fila el hexágono, el UUID del dueño y los nombres
+de campo, se envían tres columnas:
+
+- cells:     uint64 little-endian (índice H3 en binario)
+- owner:     uint32 little-endian, índice en la tabla `users`
+- influence: float32 little-endian
+
+Formatos (según Accept):
+
+- application/msgpack:
+    {"v": 1, "users": [...], "cells": bytes, "owner": bytes, "influence": bytes}
+- application/octet-stream (buffer crudo, las columnas quedan alineadas
+  para leerlas con typed arrays sin copiar):
+    b"DMT1" | u32 n_cells | u32 n_users | u32 0
+    | cells u64[n] | owner u32[n] | influence f32[n]
+    | users: UUIDs en UTF-8 separados por "\\n"
+"""
+import struct
+
+import h3
+import msgpack
+import numpy as np
+
+MSGPACK = "application/msgpack"
+RAW = "application/octet-stream"
+
+_MAGIC = b"DMT1"
+
+
+# formatos que se sirven y los media types que los piden (None = JSON);
+# a igualdad total gana el primero
+_FORMATS = (
+    (None, ("application/json",)),
+    (MSGPACK, (MSGPACK, "application/x-msgpack")),
+    (RAW, (RAW,)),
+)
+
+
+def _media_ranges(accept):
+    """(media range, q) de cada elemento de un header Accept."""
+    for part in accept.lower().split(","):
+        media_range, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        yield media_range.strip(), q
+
+
+def _specificity(media_range, names):
+    if media_range in names:
+        return 2
+    if media_range == "application/*":
+        return 1
+    if media_range == "*/*":
+        return 0
+    return None
+
+
+def negotiate(accept):
+    """
+    Formato de respuesta para un header Accept (None = JSON). La q de cada
+    formato es la del media range más específico que lo cubre; gana la q
+    más alta, luego el tipo pedido explícitamente y luego el que aparece
+    antes. Con q=0 el formato no se sirve; si no se acepta ninguno, JSON.
+    """
+    ranges = list(_media_ranges(accept or ""))
+    best, best_key = None, None
+    for media_type, names in _FORMATS:
+        match = None
+        for position, (media_range, q) in enumerate(ranges):
+            specificity = _specificity(media_range, names)
+            if specificity is not None:
+                match = max(match or (specificity, q, -position), (specificity, q, -position))
+        if match is None or match[1] <= 0:
+            continue
+        specificity, q, position = match
+        key = (q, specificity, position)
+        if best_key is None or key > best_key:
+            best, best_key = media_type, key
+    return best
+
+
+def _columns(rows):
+    """rows: (territory_id, user_id, influence)."""
+    users = {}
+    cells = np.empty(len(rows), dtype="<u8")
+    owner = np.empty(len(rows), dtype="<u4")
+    influence = np.empty(len(rows), dtype="<f4")
+
+    for i, (territory_id, user_id, value) in enumerate(rows):
+        cells[i] = h3.str_to_int(territory_id)
+        owner[i] = users.setdefault(user_id, len(users))
+        influence[i] = value
+
+    return list(users), cells, owner, influence
+
+
+def encode(rows, media_type):
+    users, cells, owner, influence = _columns(rows)
+
+    if media_type == MSGPACK:
+        return msgpack.packb({
+            "v": 1,
+            "users": users,
+            "cells": cells.tobytes(),
+            "owner": owner.tobytes(),
+            "influence": influence.tobytes(),
+        })
+
+    return b"".join((
+        _MAGIC,
+        struct.pack("<III", len(cells), len(users), 0),
+        cells.tobytes(),
+        owner.tobytes(),
+        influence.tobytes(),
+        "\n".join(users).encode(),
+    ))
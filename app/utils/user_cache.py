@@ -0,0 +1,52 @@
+"""
+Caché en memoria de usuarios autenticados, por `sub` del JWT.
+
+Acotada por tamaño (USER_CACHE_SIZE) y por tiempo (USER_CACHE_TTL): el TTL
+limita lo que puede quedar desactualizado un proceso cuando el cambio se
+hizo en otro. En este proceso, quien cambie tokens de Strava o datos del
+perfil debe llamar a invalidate_user().
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+_lock = threading.Lock()
+_entries: "OrderedDict[str, tuple[float, object]]" = OrderedDict()
+
+
+def get_user(user_id):
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry is None:
+            return None
+
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del _entries[user_id]
+            return None
+
+        _entries.move_to_end(user_id)
+        return user
+
+
+def put_user(user):
+    """`user` debe estar desligado de su sesión (db.expunge)."""
+    with _lock:
+        _entries[user.id] = (time.monotonic() + USER_CACHE_TTL, user)
+        _entries.move_to_end(user.id)
+        while len(_entries) > USER_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+def invalidate_user(user_id):
+    with _lock:
+        _entries.pop(user_id, None)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
@@ -0,0 +1,23 @@
+"""
+Claves enteras de usuario (tabla user_keys) para las tablas de influencia.
+
+La clave se crea al registrar el usuario; `user_key` la crea si falta
+(usuarios anteriores a la migración). No se cachea: un INSERT dentro de
+una transacción que luego hace rollback dejaría la caché apuntando a una
+clave que no existe.
+"""
+from sqlalchemy import select
+
+from app.database import insert_for
+from app.models import UserKey
+
+
+def user_key(db, user_id):
+    """UserKey.id de `user_id`, creándola si no existe. No hace commit."""
+    key = db.scalar(select(UserKey.id).where(UserKey.user_id == user_id))
+    if key is not None:
+        return key
+
+    insert = insert_for(db)
+    db.execute(insert(UserKey).values(user_id=user_id).on_conflict_do_nothing())
+    return db.scalar(select(UserKey.id).where(UserKey.user_id == user_id))
@@ -0,0 +1,175 @@
+"""
+Estadísticas por usuario (tabla user_stats).
+
+El ingest las actualiza con incrementos dentro de su misma transacción,
+así que /users/me/stats no agrega nada al leer. Si alguna vez se
+desincronizan, `rebuild_user_stats` las recalcula desde las tablas base
+(python -m app.rebuild_stats).
+"""
+import math
+from collections import Counter
+
+from sqlalchemy import func
+
+from app.database import insert_for
+from app.models import Activity, TerritoryInfluence, TerritoryOwner, UserKey, UserStats
+from app.utils.leaderboard import check_region_stats, rebuild_region_stats
+
+CHUNK_SIZE = 5000
+
+_COUNTERS = ("activities", "hexes", "hexes_owned", "influence")
+
+
+def _row(user_id, **values):
+    row = {"user_id": user_id, "last_activity_at": None, "activities_version": 0}
+    row.update({name: 0 for name in _COUNTERS})
+    row.update(values)
+    return row
+
+
+def _upsert_increments(db, rows):
+    if not rows:
+        return
+
+    insert = insert_for(db)
+    # orden fijo por user_id: dos ingest concurrentes bloquean filas en el mismo orden
+    rows = sorted(rows, key=lambda r: r["user_id"])
+    for start in range(0, len(rows), CHUNK_SIZE):
+        stmt = insert(UserStats).values(rows[start:start + CHUNK_SIZE])
+        set_ = {
+            name: getattr(UserStats, name) + getattr(stmt.excluded, name)
+            for name in _COUNTERS
+        }
+        set_["last_activity_at"] = func.coalesce(
+            stmt.excluded.last_activity_at, UserStats.last_activity_at
+        )
+        set_["activities_version"] = UserStats.activities_version + stmt.excluded.activities_version
+        set_["updated_at"] = func.now()
+        stmt = stmt.on_conflict_do_update(index_elements=[UserStats.user_id], set_=set_)
+        db.execute(stmt)
+
+
+def owned_deltas(changes):
+    """
+    `changes`: (territory_id, antes, después) de refresh_owners.
+    Devuelve user_id -> variación de hexágonos en propiedad.
+    """
+    deltas = Counter()
+    for _, before, after in changes:
+        if before is not None:
+            deltas[before] -= 1
+        if after is not None:
+            deltas[after] += 1
+    return deltas
+
+
+def record_activities(db, user_id, count):
+    """
+    Suma `count` actividades nuevas. Negativo al borrar: las actividades
+    ya tienen que estar borradas (flush), porque last_activity_at se
+    recalcula con la más reciente que quede. No hace commit.
+    """
+    if count > 0:
+        _upsert_increments(db, [
+            _row(user_id, activities=count, last_activity_at=func.now(), activities_version=1)
+        ])
+    elif count < 0:
+        _upsert_increments(db, [_row(user_id, activities=count, activities_version=1)])
+        last_activity_at = (
+            db.query(func.max(Activity.created_at))
+            .filter(Activity.user_id == user_id)
+            .scalar_subquery()
+        )
+        db.query(UserStats).filter(UserStats.user_id == user_id).update(
+            {UserStats.last_activity_at: last_activity_at},
+            synchronize_session=False,
+        )
+
+
+def record_activity_edit(db, user_id):
+    """Una actividad cambió de recorrido: nueva versión del listado. No hace commit."""
+    _upsert_increments(db, [_row(user_id, activities_version=1)])
+
+
+def record_influence(db, user_id, new_hexes, influence, owner_changes):
+    """
+    Suma la influencia aplicada por un ingest y los cambios de dueño que
+    provocó (pueden afectar a otros usuarios). No hace commit.
+    """
+    deltas = owned_deltas(owner_changes)
+    rows = {user_id: _row(user_id, hexes=new_hexes, influence=influence)}
+    for other, delta in deltas.items():
+        if delta:
+            rows.setdefault(other, _row(other))["hexes_owned"] = delta
+
+    _upsert_increments(db, list(rows.values()))
+
+
+def compute_user_stats(db):
+    """user_id -> fila de estadísticas, agregando las tablas base."""
+    stats = {}
+
+    for user_id, activities, last_activity_at in db.query(
+        Activity.user_id, func.count(Activity.id), func.max(Activity.created_at)
+    ).group_by(Activity.user_id):
+        stats[user_id] = _row(user_id, activities=activities, last_activity_at=last_activity_at)
+
+    for user_id, hexes, influence in db.query(
+        UserKey.user_id,
+        func.count(TerritoryInfluence.territory_id),
+        func.coalesce(func.sum(TerritoryInfluence.influence), 0),
+    ).join(UserKey, UserKey.id == TerritoryInfluence.user_key).group_by(UserKey.user_id):
+        row = stats.setdefault(user_id, _row(user_id))
+        row["hexes"], row["influence"] = hexes, float(influence)
+
+    for user_id, owned in db.query(
+        TerritoryOwner.user_id, func.count(TerritoryOwner.territory_id)
+    ).filter(TerritoryOwner.user_id.isnot(None)).group_by(TerritoryOwner.user_id):
+        stats.setdefault(user_id, _row(user_id))["hexes_owned"] = owned
+
+    return stats
+
+
+def rebuild_user_stats(db):
+    """
+    Recalcula user_stats y region_stats desde cero y hace commit.
+    Devuelve el nº de usuarios.
+    """
+    stats = list(compute_user_stats(db).values())
+
+    # la versión del listado nunca vuelve atrás (ETags ya servidos)
+    versions = dict(db.query(UserStats.user_id, UserStats.activities_version))
+    for row in stats:
+        row["activities_version"] = versions.get(row["user_id"], 0) + 1
+
+    db.query(UserStats).delete()
+    insert = insert_for(db)
+    for start in range(0, len(stats), CHUNK_SIZE):
+        db.execute(insert(UserStats).values(stats[start:start + CHUNK_SIZE]))
+    rebuild_region_stats(db)
+
+    db.commit()
+    return len(stats)
+
+
+def check_user_stats(db):
+    """
+    Compara user_stats y region_stats con las tablas base.
+    Devuelve las diferencias (user_id, campo, esperado, guardado).
+    """
+    expected = compute_user_stats(db)
+    stored = {row.user_id: row for row in db.query(UserStats)}
+
+    mismatches = []
+    for user_id in expected.keys() | stored.keys():
+        want = expected.get(user_id) or _row(user_id)
+        have = stored.get(user_id)
+        for name in _COUNTERS:
+            actual = getattr(have, name) if have is not None else 0
+            if not math.isclose(want[name], actual, rel_tol=1e-9, abs_tol=1e-6):
+                mismatches.append((user_id, name, want[name], actual))
+
+    for (res, region, user_id), want, actual in check_region_stats(db):
+        mismatches.append((user_id, f"hexes_owned[res {res} {region}]", want, actual))
+
+    return mismatches
@@ -0,0 +1,68 @@
+"""
+Throughput de polyline -> H3: función original vs motor vectorizado.
+
+    python -m benchmarks.bench_geo
+"""
+import os
+import random
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import h3
+import polyline
+
+from app.utils.geo import H3_RESOLUTION, polyline_to_h3, polylines_to_h3
+from benchmarks.bench_ingest import synthetic_polyline
+
+
+def legacy_polyline_to_h3(polyline_str):
+    """Implementación anterior: decode puro Python + una celda por vértice."""
+    hexes = set()
+    for lat, lon in polyline.decode(polyline_str):
+        hexes.add(h3.latlng_to_cell(lat, lon, H3_RESOLUTION))
+    return hexes
+
+
+def sample_polylines(n, seed=42):
+    """Polylines tipo summary_polyline: 5-20 km con un vértice cada ~100-400 m."""
+    rng = random.Random(seed)
+    return [
+        synthetic_polyline(
+            km=rng.uniform(5, 20),
+            step_m=rng.uniform(100, 400),
+            lat=43.3 + rng.uniform(-0.2, 0.2),
+            lng=-2.0 + rng.uniform(-0.2, 0.2),
+        )
+        for _ in range(n)
+    ]
+
+
+def throughput(fn, polylines, repeat=3):
+    """Mejor de `repeat` pasadas, para que no cuente el calentamiento."""
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(polylines)
+        best = max(best, len(polylines) / (time.perf_counter() - start))
+    return best
+
+
+def main(n=2000):
+    polylines = sample_polylines(n)
+
+    legacy = throughput(lambda ps: [legacy_polyline_to_h3(p) for p in ps], polylines)
+    engine = throughput(lambda ps: [polyline_to_h3(p) for p in ps], polylines)
+    counts = throughput(polylines_to_h3, polylines)
+
+    legacy_cells = sum(len(legacy_polyline_to_h3(p)) for p in polylines)
+    engine_cells = sum(len(polyline_to_h3(p)) for p in polylines)
+
+    print(f"polylines: {n}")
+    print(f"legacy      : {legacy:8.0f} polylines/s, {legacy_cells} hexágonos")
+    print(f"engine (set): {engine:8.0f} polylines/s, {engine_cells} hexágonos (con relleno de huecos)")
+    print(f"engine (cnt): {counts:8.0f} polylines/s")
+
+
+if __name__ == "__main__":
+    main()
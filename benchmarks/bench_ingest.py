@@ -0,0 +1,91 @@
+"""
+Round trips por actividad: bucle por hexágono (antiguo) vs upsert en bloque.
+
+    python -m benchmarks.bench_ingest
+"""
+import math
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import h3
+import polyline
+from sqlalchemy import event
+
+from app.database import Base, SessionLocal, engine
+from app.models import TerritoryInfluence, User
+from app.utils.geo import polyline_to_h3
+from app.utils.territory_ingest import apply_influence
+from app.utils.user_keys import user_key
+
+
+def synthetic_polyline(km=10.0, step_m=20.0, lat=43.3, lng=-2.0):
+    """Recorrido serpenteante de `km` kilómetros con un punto cada `step_m`."""
+    points = []
+    heading = 0.0
+    for i in range(int(km * 1000 / step_m)):
+        heading += 0.02 * math.sin(i / 40)
+        lat += step_m / 111_000 * math.cos(heading)
+        lng += step_m / (111_000 * math.cos(math.radians(lat))) * math.sin(heading)
+        points.append((lat, lng))
+    return polyline.encode(points)
+
+
+def legacy_ingest(db, user_id, hexes):
+    key = user_key(db, user_id)
+    for hex_id in hexes:
+        influence = db.query(TerritoryInfluence).filter_by(
+            territory_id=h3.str_to_int(hex_id),
+            user_key=key,
+        ).first()
+
+        if influence:
+            influence.influence += 1
+        else:
+            db.add(TerritoryInfluence(
+                territory_id=h3.str_to_int(hex_id),
+                user_key=key,
+                influence=1,
+            ))
+    db.flush()
+
+
+def count_statements(fn):
+    statements = 0
+
+    def on_execute(*args):
+        nonlocal statements
+        statements += 1
+
+    event.listen(engine, "before_cursor_execute", on_execute)
+    try:
+        fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", on_execute)
+    return statements
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = User(email="bench@example.com", username="bench", password_hash="x")
+    db.add(user)
+    db.commit()
+
+    hexes = polyline_to_h3(synthetic_polyline())
+    print(f"hexágonos por actividad: {len(hexes)}")
+
+    for label, fn in (("legacy", legacy_ingest), ("bulk", apply_influence)):
+        for run in ("insert", "update"):
+            n = count_statements(lambda: fn(db, user.id, hexes))
+            db.commit()
+            print(f"{label:>6} ({run}): {n} sentencias SQL")
+
+        db.query(TerritoryInfluence).delete()
+        db.commit()
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
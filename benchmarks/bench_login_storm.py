@@ -0,0 +1,71 @@
+"""
+Latencia de GET /territories con y sin una tormenta de logins.
+
+Contra un servidor arrancado (uvicorn app.main:app) con un usuario ya
+registrado:
+
+    python -m benchmarks.bench_login_storm http://localhost:8000 email password
+"""
+import statistics
+import sys
+import threading
+import time
+
+import requests
+
+
+def sample_latency(base_url, seconds, session):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        session.get(f"{base_url}/territories", params={"res": 5}, timeout=30)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def login_storm(base_url, email, password, stop, codes):
+    session = requests.Session()
+    while not stop.is_set():
+        res = session.post(
+            f"{base_url}/auth/login",
+            data={"username": email, "password": password},
+            timeout=30,
+        )
+        codes.append(res.status_code)
+
+
+def report(label, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{label:>14}: n={len(latencies)} "
+        f"p50={statistics.median(latencies):.1f}ms p95={p95:.1f}ms"
+    )
+
+
+def main(base_url, email, password, clients=64, seconds=10):
+    session = requests.Session()
+    report("sin logins", sample_latency(base_url, seconds, session))
+
+    stop = threading.Event()
+    codes = []
+    threads = [
+        threading.Thread(target=login_storm, args=(base_url, email, password, stop, codes))
+        for _ in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        report(f"{clients} logins", sample_latency(base_url, seconds, session))
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    print("respuestas de /auth/login:", {c: codes.count(c) for c in set(codes)})
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:4])
@@ -0,0 +1,164 @@
+"""
+Ingest concurrente: N procesos importan a la vez las mismas actividades
+(un mismo atleta, páginas en distinto orden) y las de otros atletas que
+pisan los mismos hexágonos. Al final comprueba que cada actividad se
+importó una sola vez y que la influencia, los dueños y las estadísticas
+son exactos.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.stress_ingest [--workers 8] [--activities 400]
+
+Borra y recrea las tablas: usar una base de datos de pruebas.
+"""
+import multiprocessing
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///stress_ingest.sqlite")
+
+import h3
+from sqlalchemy import func
+from sqlalchemy.exc import DBAPIError
+
+from app.database import Base, SessionLocal, engine
+from app.models import Activity, TerritoryInfluence, User, UserKey, UserStats
+from app.utils.geo import MAP_RESOLUTIONS, polyline_to_h3
+from app.utils.strava_import import import_strava_page
+from app.utils.territory_owner import check_territory_owners
+from app.utils.user_stats import check_user_stats
+from benchmarks.bench_ingest import synthetic_polyline
+
+PAGE_SIZE = 10
+ATHLETES = 3
+
+
+def strava_activity(strava_id):
+    # recorridos que se solapan entre atletas: mismos hexágonos en disputa
+    return {
+        "id": strava_id,
+        "start_date": f"2024-01-{1 + strava_id % 28:02d}T08:00:00Z",
+        "map": {"summary_polyline": synthetic_polyline(2 + strava_id % 5, lat=43.3 + (strava_id % 7) * 1e-3)},
+    }
+
+
+def athlete_activities(athlete, count):
+    return [athlete * 1_000_000 + i for i in range(count)]
+
+
+def worker(seed, user_ids, count, results):
+    engine.dispose(close=False)
+    rng = random.Random(seed)
+    db = SessionLocal()
+    users = {u.strava_athlete_id: u for u in db.query(User).filter(User.id.in_(user_ids))}
+
+    pages = []
+    for athlete, user in users.items():
+        ids = athlete_activities(athlete, count)
+        rng.shuffle(ids)
+        pages += [(user, ids[i:i + PAGE_SIZE]) for i in range(0, len(ids), PAGE_SIZE)]
+    rng.shuffle(pages)
+
+    imported = retries = 0
+    for user, ids in pages:
+        page = [strava_activity(i) for i in ids]
+        while True:
+            try:
+                imported += import_strava_page(db, user, page)[0]
+                db.commit()
+                break
+            except DBAPIError:
+                # interbloqueo / base ocupada: se reintenta como un evento
+                db.rollback()
+                retries += 1
+    db.close()
+    results.put((imported, retries))
+
+
+def expected_influence(count):
+    expected = Counter()
+    for athlete in range(1, ATHLETES + 1):
+        for strava_id in athlete_activities(athlete, count):
+            for hex_id in polyline_to_h3(strava_activity(strava_id)["map"]["summary_polyline"]):
+                expected[(h3.str_to_int(hex_id), athlete)] += 1
+    return expected
+
+
+def check(count):
+    db = SessionLocal()
+    errors = []
+
+    activities = db.query(func.count(Activity.id)).scalar()
+    if activities != ATHLETES * count:
+        errors.append(f"actividades: esperado={ATHLETES * count} guardado={activities}")
+
+    athletes = dict(
+        db.query(UserKey.id, User.strava_athlete_id).join(User, User.id == UserKey.user_id)
+    )
+    stored = Counter({
+        (territory_id, athletes[key]): influence
+        for territory_id, key, influence in db.query(
+            TerritoryInfluence.territory_id, TerritoryInfluence.user_key, TerritoryInfluence.influence
+        )
+    })
+    expected = expected_influence(count)
+    wrong = [k for k in expected.keys() | stored.keys() if expected[k] != stored[k]]
+    if wrong:
+        errors.append(f"influencia: {len(wrong)} filas distintas de {len(expected)}")
+
+    for stats in db.query(UserStats):
+        if stats.activities != count:
+            errors.append(f"user_stats.activities {stats.user_id}: esperado={count} guardado={stats.activities}")
+
+    errors += [f"user_stats: {m}" for m in check_user_stats(db)]
+    for res in MAP_RESOLUTIONS:
+        errors += [f"dueños res {res}: {m}" for m in check_territory_owners(db, res)]
+
+    db.close()
+    return errors
+
+
+def main(workers=8, count=400):
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    users = [
+        User(email=f"stress{i}@example.com", username=f"stress{i}", password_hash="x", strava_athlete_id=i)
+        for i in range(1, ATHLETES + 1)
+    ]
+    db.add_all(users)
+    db.commit()
+    user_ids = [u.id for u in users]
+    db.close()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    processes = [ctx.Process(target=worker, args=(seed, user_ids, count, results)) for seed in range(workers)]
+
+    start = time.perf_counter()
+    for p in processes:
+        p.start()
+    outcomes = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    imported = sum(i for i, _ in outcomes)
+    retries = sum(r for _, r in outcomes)
+    print(
+        f"{workers} procesos x {ATHLETES * count} actividades: {imported} importadas, "
+        f"{retries} reintentos, {elapsed:.1f}s"
+    )
+
+    errors = check(count)
+    for error in errors[:50]:
+        print("❌", error)
+    print("✅ totales exactos" if not errors else f"{len(errors)} errores")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+    main(int(args.get("--workers", 8)), int(args.get("--activities", 400)))
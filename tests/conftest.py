@@ -0,0 +1,38 @@
+import os
+import tempfile
+
+import pytest
+
+from tests.fake_strava import FakeStrava
+
+# la app lee la configuración al importarse: base de datos temporal y
+# Strava falso antes de importar nada de app.*
+_strava = FakeStrava().start()
+_db_dir = tempfile.mkdtemp()
+# check_same_thread: las pruebas de concurrencia comparten el pool entre hilos
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_db_dir}/test.sqlite?check_same_thread=false")
+os.environ["STRAVA_API_URL"] = f"{_strava.url}/api/v3"
+os.environ["STRAVA_OAUTH_URL"] = f"{_strava.url}/oauth"
+
+
+@pytest.fixture(scope="session")
+def fake_strava_server():
+    yield _strava
+    _strava.stop()
+
+
+@pytest.fixture
+def fake_strava(fake_strava_server):
+    fake_strava_server.reset()
+    return fake_strava_server
+
+
+@pytest.fixture
+def db():
+    from app.database import Base, SessionLocal, engine
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    yield session
+    session.close()
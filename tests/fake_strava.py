@@ -0,0 +1,131 @@
+"""
+Servidor falso de Strava para pruebas locales: OAuth (/oauth/token) y
+API (/api/v3/...), con retardos configurables y cabeceras de rate limit.
+
+    python -m tests.fake_strava [--port 8765]
+
+y arrancar la app con STRAVA_API_URL=http://127.0.0.1:8765/api/v3 y
+STRAVA_OAUTH_URL=http://127.0.0.1:8765/oauth.
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+TOKEN_LIFETIME = 6 * 60 * 60
+# recorrido corto cualquiera (Bizkaia)
+ACTIVITY_POLYLINE = "ceyhG~wdPsA_CeB{C}AoC"
+
+
+class FakeStrava(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # peticiones recibidas: (método, ruta, parámetros)
+            self.calls = []
+            self.refresh_delay = 0.0
+            self.api_delay = 0.0
+            self.rate_limit = (600, 30000)
+            self.rate_usage = [0, 0]
+            self.status = None
+            self._tokens = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, path):
+        with self.lock:
+            return sum(1 for _, p, _ in self.calls if p == path)
+
+    def new_token(self):
+        with self.lock:
+            self._tokens += 1
+            n = self._tokens
+        return {
+            "token_type": "Bearer",
+            "access_token": f"access-{n}",
+            "refresh_token": f"refresh-{n}",
+            "expires_at": int(time.time()) + TOKEN_LIFETIME,
+            "expires_in": TOKEN_LIFETIME,
+        }
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-strava", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        server = self.server
+        with server.lock:
+            server.rate_usage = [used + 1 for used in server.rate_usage]
+            usage = ",".join(map(str, server.rate_usage))
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-RateLimit-Limit", ",".join(map(str, server.rate_limit)))
+        self.send_header("X-RateLimit-Usage", usage)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _record(self, params):
+        path = urlparse(self.path).path
+        with self.server.lock:
+            self.server.calls.append((self.command, path, params))
+        return path
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        params = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        path = self._record(params)
+
+        if path != "/oauth/token":
+            return self._reply(404, {"message": "Record Not Found"})
+        time.sleep(self.server.refresh_delay)
+        if self.server.status:
+            return self._reply(self.server.status, {"message": "error"})
+        self._reply(200, self.server.new_token())
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = self._record({k: v[0] for k, v in parse_qs(url.query).items()})
+        time.sleep(self.server.api_delay)
+        if self.server.status:
+            return self._reply(self.server.status, {"message": "error"})
+
+        if path.startswith("/api/v3/activities/"):
+            activity_id = int(path.rsplit("/", 1)[-1])
+            return self._reply(200, {
+                "id": activity_id,
+                "private": False,
+                "start_date": "2024-01-01T08:00:00Z",
+                "map": {"summary_polyline": ACTIVITY_POLYLINE},
+            })
+        if path == "/api/v3/athlete/activities":
+            return self._reply(200, [])
+        self._reply(404, {"message": "Record Not Found"})
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[sys.argv.index("--port") + 1]) if "--port" in sys.argv else 8765
+    server = FakeStrava(port)
+    print(f"🧪 Strava falso en {server.url}")
+    server.serve_forever()
@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import polyline
+import pytest
+from sqlalchemy import event
+
+from app.database import engine
+from app.models import PolylineCells, User
+from app.utils import cell_cache, geo
+from app.utils.strava_import import import_strava_page
+
+
+def _polyline(i):
+    return polyline.encode([(40.40 + i * 0.01, -3.70), (40.40 + i * 0.01, -3.69)])
+
+
+@pytest.fixture
+def cache_db(db, monkeypatch):
+    monkeypatch.setattr(cell_cache, "CELL_CACHE_DB", True)
+    cell_cache.clear()
+    yield db
+    cell_cache.clear()
+
+
+@pytest.fixture
+def cache_queries():
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        if "polyline_cells" in statement:
+            statements.append(statement.split()[0].upper())
+
+    event.listen(engine, "before_cursor_execute", _record)
+    yield statements
+    event.remove(engine, "before_cursor_execute", _record)
+
+
+def test_lookup_many_keeps_going_after_invalid_polyline(cache_db):
+    results = cell_cache.lookup_many([_polyline(0), "@", _polyline(1)], cache_db)
+
+    assert isinstance(results[1], ValueError)
+    for i, value in ((0, results[0]), (1, results[2])):
+        cells, counts = geo.polyline_to_h3_counts(_polyline(i))
+        assert np.array_equal(value[0], cells)
+        assert np.array_equal(value[1], counts)
+    assert cache_db.query(PolylineCells).count() == 2
+
+    with pytest.raises(ValueError):
+        cell_cache.polyline_cells("@")
+
+
+def test_import_page_looks_up_cache_once(cache_db, cache_queries):
+    user = User(email="cache@example.com", username="cache", password_hash="x", strava_athlete_id=1)
+    cache_db.add(user)
+    cache_db.commit()
+
+    start = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    page = [
+        {"id": i, "start_date": start, "map": {"summary_polyline": _polyline(i)}}
+        for i in range(5)
+    ]
+    imported, _ = import_strava_page(cache_db, user, page)
+    cache_db.commit()
+
+    assert imported == 5
+    assert cache_queries == ["SELECT", "INSERT"]
+    assert cache_db.query(PolylineCells).count() == 5
+
+
+def test_engine_version_changes_key(monkeypatch):
+    key = cell_cache.cache_key(_polyline(0))
+    monkeypatch.setattr(geo, "POLYLINE_H3_VERSION", geo.POLYLINE_H3_VERSION + 1)
+    assert cell_cache.cache_key(_polyline(0)) != key
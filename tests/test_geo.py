@@ -0,0 +1,31 @@
+import numpy as np
+import polyline
+import pytest
+
+from app.utils.geo import decode_polyline_array, polyline_to_h3
+from tests.fake_strava import ACTIVITY_POLYLINE
+
+
+def test_decode_matches_reference_decoder():
+    expected = np.array(polyline.decode(ACTIVITY_POLYLINE))
+    assert np.allclose(decode_polyline_array(ACTIVITY_POLYLINE), expected)
+
+
+def test_empty_polyline_has_no_cells():
+    assert decode_polyline_array("").shape == (0, 2)
+    assert polyline_to_h3("") == set()
+
+
+@pytest.mark.parametrize("value", [
+    "!!!",  # bytes por debajo de '?'
+    ACTIVITY_POLYLINE + " ",
+    "ééé",
+    ACTIVITY_POLYLINE[:-1],  # cortada a media coordenada
+    ACTIVITY_POLYLINE + "_",  # último byte con bit de continuación
+    "??" + "?",  # número impar de valores
+])
+def test_malformed_polyline_raises(value):
+    with pytest.raises(ValueError):
+        decode_polyline_array(value)
+    with pytest.raises(ValueError):
+        polyline_to_h3(value)
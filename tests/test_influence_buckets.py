@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import func
+
+from app.models import Activity, TerritoryInfluence, TerritoryInfluenceBucket, User
+from app.utils.footprints import delete_activity
+from app.utils.influence_buckets import INFLUENCE_DAILY_DAYS, INFLUENCE_RETENTION_DAYS, day_number, week_start
+from app.utils.strava_import import import_strava_page
+from tests.fake_strava import ACTIVITY_POLYLINE
+
+
+def _activity(strava_id, days_ago):
+    start = datetime.now(timezone.utc) - timedelta(days=days_ago)
+    return {
+        "id": strava_id,
+        "start_date": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "map": {"summary_polyline": ACTIVITY_POLYLINE},
+    }
+
+
+def _count(db, table):
+    return db.query(func.count()).select_from(table).scalar()
+
+
+@pytest.mark.parametrize("days_ago", [
+    1,
+    INFLUENCE_DAILY_DAYS + 10,
+    # el lunes de su semana ya está fuera de la retención
+    INFLUENCE_RETENTION_DAYS - 1,
+    INFLUENCE_RETENTION_DAYS + 10,
+])
+def test_delete_old_activity_leaves_no_buckets(db, days_ago):
+    user = User(email="old@example.com", username="old", password_hash="x", strava_athlete_id=1)
+    db.add(user)
+    db.commit()
+
+    imported, _ = import_strava_page(db, user, [_activity(1, days_ago)])
+    db.commit()
+    assert imported == 1
+
+    days = {day for (day,) in db.query(TerritoryInfluenceBucket.day).distinct()}
+    day = day_number() - days_ago
+    if week_start(day) < day_number() - INFLUENCE_RETENTION_DAYS:
+        assert days == set()
+    elif days_ago > INFLUENCE_DAILY_DAYS:
+        assert days == {week_start(day)}
+    else:
+        assert days == {day}
+
+    delete_activity(db, db.query(Activity).one())
+    db.commit()
+
+    assert _count(db, TerritoryInfluence) == 0
+    assert _count(db, TerritoryInfluenceBucket) == 0
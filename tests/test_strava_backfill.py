@@ -0,0 +1,129 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app.models import StravaImportJob, User
+from app.utils import strava_backfill, strava_client
+
+
+@pytest.fixture(autouse=True)
+def rate_limiter(monkeypatch):
+    monkeypatch.setattr(strava_client, "rate_limiter", strava_client._RateLimiter())
+
+
+def _user(db, expires_in=3600):
+    user = User(
+        email="backfill@example.com",
+        username="backfill",
+        password_hash="x",
+        strava_athlete_id=1,
+        strava_access_token="old-access",
+        strava_refresh_token="old-refresh",
+        strava_expires_at=int(time.time()) + expires_in,
+    )
+    db.add(user)
+    db.commit()
+    return user
+
+
+def _job(db, user, **fields):
+    job = StravaImportJob(user_id=user.id, after_cursor=0, **fields)
+    db.add(job)
+    db.commit()
+    return job.id
+
+
+def test_rate_limited_refresh_waits_instead_of_failing(db, fake_strava, monkeypatch):
+    user = _user(db, expires_in=-10)
+    job_id = _job(db, user, status="pending")
+
+    # el refresco del token se topa con un 429
+    fake_strava.status = 429
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        fake_strava.status = None
+        monkeypatch.setattr(strava_client, "rate_limiter", strava_client._RateLimiter())
+
+    # solo la espera del backfill (el servidor falso también usa time.sleep)
+    monkeypatch.setattr(strava_backfill, "time", SimpleNamespace(sleep=sleep))
+
+    strava_backfill.run_backfill(job_id)
+
+    db.expire_all()
+    job = db.get(StravaImportJob, job_id)
+    assert job.status == "done", job.error
+    assert len(sleeps) == 1
+    assert fake_strava.count("/oauth/token") == 2
+    assert db.get(User, user.id).strava_access_token == "access-1"
+
+
+def test_concurrent_runners_claim_the_job_once(db, fake_strava, monkeypatch):
+    job_id = _job(db, _user(db), status="pending")
+    fake_strava.api_delay = 0.3
+    later = []
+    monkeypatch.setattr(strava_backfill, "_check_later", later.append)
+
+    barrier = threading.Barrier(4)
+
+    def run():
+        barrier.wait(timeout=5)
+        strava_backfill.run_backfill(job_id)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+
+    db.expire_all()
+    assert db.get(StravaImportJob, job_id).status == "done"
+    assert fake_strava.count("/api/v3/athlete/activities") == 1
+    # los que no lo consiguieron miran más tarde si sigue activo
+    assert len(later) <= 3
+
+
+@pytest.mark.parametrize("age, runs", [(timedelta(seconds=10), False), (timedelta(hours=1), True)])
+def test_running_job_is_taken_over_only_when_its_lock_is_stale(db, fake_strava, monkeypatch, age, runs):
+    locked_at = datetime.now(timezone.utc) - age
+    job_id = _job(db, _user(db), status="running", locked_at=locked_at)
+    later = []
+    monkeypatch.setattr(strava_backfill, "_check_later", later.append)
+
+    strava_backfill.run_backfill(job_id)
+
+    db.expire_all()
+    assert db.get(StravaImportJob, job_id).status == ("done" if runs else "running")
+    assert fake_strava.count("/api/v3/athlete/activities") == (1 if runs else 0)
+    assert later == ([] if runs else [job_id])
+
+
+def test_one_active_job_per_user(db):
+    user = _user(db)
+    _job(db, user, status="done")
+    _job(db, user, status="pending")
+    with pytest.raises(IntegrityError):
+        _job(db, user, status="running")
+
+
+def test_create_or_get_job_race_returns_the_other_job(db, monkeypatch):
+    user = _user(db)
+    other = _job(db, user, status="pending")
+
+    # la comprobación previa no lo ve: como si se hubiera creado justo después
+    active = strava_backfill._active_job
+    calls = []
+
+    def late_active_job(session, user_id):
+        calls.append(user_id)
+        return None if len(calls) == 1 else active(session, user_id)
+
+    monkeypatch.setattr(strava_backfill, "_active_job", late_active_job)
+
+    job, created = strava_backfill.create_or_get_job(db, user)
+    assert (job.id, created) == (other, False)
@@ -0,0 +1,144 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from app.database import SessionLocal
+from app.models import User
+from app.utils import strava_client
+from app.utils.strava_client import (
+    StravaRateLimited,
+    ensure_valid_token,
+    get_activity,
+    refresh_expiring_tokens,
+)
+
+
+@pytest.fixture(autouse=True)
+def rate_limiter(monkeypatch):
+    # presupuesto limpio en cada prueba
+    monkeypatch.setattr(strava_client, "rate_limiter", strava_client._RateLimiter())
+
+
+def _user(db, name, expires_in):
+    user = User(
+        email=f"{name}@example.com",
+        username=name,
+        password_hash="x",
+        strava_athlete_id=abs(hash(name)) % 1_000_000,
+        strava_access_token="old-access",
+        strava_refresh_token="old-refresh",
+        strava_expires_at=int(time.time()) + expires_in,
+    )
+    db.add(user)
+    db.commit()
+    return user
+
+
+def test_concurrent_refresh_is_single_flight(db, fake_strava):
+    user_id = _user(db, "expired", expires_in=-10).id
+    fake_strava.refresh_delay = 0.3
+
+    errors = []
+    barrier = threading.Barrier(8)
+
+    def refresh():
+        session = SessionLocal()
+        try:
+            stale = session.get(User, user_id)
+            barrier.wait(timeout=5)
+            ensure_valid_token(session, stale)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=refresh) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert fake_strava.count("/oauth/token") == 1
+    db.expire_all()
+    stored = db.get(User, user_id)
+    assert stored.strava_access_token == "access-1"
+    assert stored.strava_refresh_token == "refresh-1"
+    assert stored.strava_expires_at > time.time()
+
+
+def test_refresh_sends_stored_refresh_token(db, fake_strava):
+    user = _user(db, "refresh", expires_in=-10)
+    ensure_valid_token(db, user)
+
+    (_, _, params), = fake_strava.calls
+    assert params["grant_type"] == "refresh_token"
+    assert params["refresh_token"] == "old-refresh"
+
+
+def test_valid_token_makes_no_call(db, fake_strava):
+    user = _user(db, "valid", expires_in=2 * 60 * 60)
+    ensure_valid_token(db, user)
+    assert fake_strava.calls == []
+
+
+def test_background_refresh_renews_ahead_of_expiry(db, fake_strava):
+    soon = _user(db, "soon", expires_in=10 * 60)
+    later = _user(db, "later", expires_in=3 * 60 * 60)
+
+    # todavía válido para una petición: no se refresca al usarlo...
+    ensure_valid_token(db, soon)
+    assert fake_strava.calls == []
+
+    # ...pero el refresco en segundo plano lo renueva antes de que caduque
+    assert refresh_expiring_tokens(db, ahead=30 * 60) == 1
+    assert fake_strava.count("/oauth/token") == 1
+
+    db.expire_all()
+    assert db.get(User, soon.id).strava_access_token == "access-1"
+    assert db.get(User, later.id).strava_access_token == "old-access"
+
+
+def test_failed_refresh_keeps_old_token(db, fake_strava):
+    user = _user(db, "broken", expires_in=-10)
+    fake_strava.status = 500
+
+    with pytest.raises(strava_client.StravaAPIError):
+        ensure_valid_token(db, user)
+    db.rollback()
+
+    db.expire_all()
+    assert db.get(User, user.id).strava_refresh_token == "old-refresh"
+
+
+def test_api_call_times_out(fake_strava, monkeypatch):
+    monkeypatch.setattr(strava_client, "REQUEST_TIMEOUT", (1, 0.2))
+    fake_strava.api_delay = 1.0
+
+    start = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        get_activity("token", 1)
+    assert time.monotonic() - start < 1.0
+
+
+def test_oauth_call_times_out(db, fake_strava, monkeypatch):
+    monkeypatch.setattr(strava_client, "REQUEST_TIMEOUT", (1, 0.2))
+    user = _user(db, "slow", expires_in=-10)
+    fake_strava.refresh_delay = 1.0
+
+    with pytest.raises(requests.Timeout):
+        ensure_valid_token(db, user)
+
+
+def test_rate_limit_headers_and_429(fake_strava):
+    fake_strava.rate_limit = (100, 1000)
+    fake_strava.rate_usage = [40, 100]
+    assert get_activity("token", 7)["id"] == 7
+    assert strava_client.rate_limiter.stats()["windows"]["15min"]["remaining"] == 59
+
+    fake_strava.status = 429
+    with pytest.raises(StravaRateLimited):
+        get_activity("token", 7)
+    assert strava_client.rate_limiter.stats()["windows"]["15min"]["remaining"] == 0
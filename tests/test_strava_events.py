@@ -0,0 +1,48 @@
+from app.database import SessionLocal
+from app.models import StravaEvent
+from app.utils.strava_events import _finish, claim_events, enqueue_event
+
+
+def _update(title):
+    return {"object_id": 7, "owner_id": 1, "aspect_type": "update", "updates": {"title": title}}
+
+
+def test_update_while_processing_is_not_claimed_twice(db):
+    enqueue_event(db, _update("a"))
+    worker, other = SessionLocal(), SessionLocal()
+    try:
+        (event,) = claim_events(worker)
+
+        # Strava manda otra edición mientras el worker la procesa
+        enqueue_event(db, _update("b"))
+        db.expire_all()
+        row = db.query(StravaEvent).one()
+        assert (row.status, row.rerun) == ("processing", True)
+        assert claim_events(other) == []
+
+        # el worker termina con lo que leyó: el evento vuelve a la cola
+        _finish(event)
+        worker.commit()
+        (again,) = claim_events(worker)
+        assert again.id == event.id
+        assert again.updates == '{"title": "b"}'
+        assert (again.status, again.rerun, again.attempts) == ("processing", False, 1)
+
+        _finish(again)
+        worker.commit()
+        assert claim_events(worker) == []
+    finally:
+        worker.close()
+        other.close()
+
+
+def test_update_after_done_reopens_event(db):
+    enqueue_event(db, _update("a"))
+    (event,) = claim_events(db)
+    _finish(event)
+    db.commit()
+
+    enqueue_event(db, _update("b"))
+    db.expire_all()
+    row = db.query(StravaEvent).one()
+    assert (row.status, row.rerun, row.attempts) == ("pending", False, 0)
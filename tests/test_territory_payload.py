@@ -0,0 +1,38 @@
+import pytest
+
+from app.utils.http_cache import not_modified
+from app.utils.territory_payload import MSGPACK, RAW, negotiate
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        (None, None),
+        ("", None),
+        ("*/*", None),
+        ("text/html,application/xhtml+xml,*/*;q=0.8", None),
+        ("application/json", None),
+        (MSGPACK, MSGPACK),
+        ("application/x-msgpack", MSGPACK),
+        ("Application/MsgPack", MSGPACK),
+        (RAW, RAW),
+        ("application/json, application/msgpack;q=0", None),
+        ("application/msgpack;q=0, */*", None),
+        ("application/json;q=0.5, application/msgpack", MSGPACK),
+        ("application/msgpack;q=0.4, application/octet-stream;q=0.9", RAW),
+        ("application/msgpack, application/json", MSGPACK),
+        ("application/json, application/msgpack", None),
+        ("application/msgpack, */*;q=0.1", MSGPACK),
+        ("application/*;q=0.2, application/octet-stream", RAW),
+        ("application/msgpack; q=bad, application/json", None),
+    ],
+)
+def test_negotiate(accept, expected):
+    assert negotiate(accept) == expected
+
+
+def test_not_modified_keeps_vary():
+    response = not_modified('W/"abc"', vary="Accept")
+    assert response.status_code == 304
+    assert response.headers["etag"] == 'W/"abc"'
+    assert response.headers["vary"] == "Accept"